@@ -1,21 +1,95 @@
 import streamlit as st
 import os
-import json
-import google.generativeai as genai
 from dotenv import load_dotenv
-import uuid
 import time
 from datetime import datetime
-import re
-import base64
-from gtts import gTTS
+from gemini_client import get_gemini_client
+from metrics import metrics
+from resilience import CircuitOpenError
+from scheduler import BACKGROUND, NORMAL
+from structured_output import TURN_SCHEMA, SchemaError, StructuredStream, field_at_least
+from prompts import build_continue_prompt, build_ending_prompt, build_turn_prompt
+from speculation import SpeculativeBranches
+from text_cleaning import clean_story_text
+from tts import text_to_speech, NarrationStream
+from starter_pool import get_starter_pool
+from recaps import get_recap_worker, has_current_recap
+from summaries import get_summary_worker, summary_key
+from story_codecs import check_codec
+from story_store import save_story_log, resume_story, load_earlier_passages, load_all_passages
+from passages import StoryRenderCache, add_passage, choice_count, format_dialog, story_plain_text, story_stats
+from story_engine import (
+    GENRE_OPTIONS,
+    GENERATION_FALLBACK,
+    FALLBACK_STARTERS,
+    FALLBACK_CHOICES,
+    MAX_TURNS,
+    new_story_state,
+    write_starters,
+    write_choices,
+    write_continuation,
+    write_turn,
+    write_ending,
+    write_summary,
+    write_recap,
+    finalize_story,
+    story_ending_text,
+)
+from story_catalog import record_story, list_stories, count_stories, ensure_catalog
+from story_memory import (
+    new_story_memory,
+    update_story_memory,
+    apply_background_summary,
+    build_story_context,
+    ensure_story_memory,
+)
 
 # Load environment variables
 load_dotenv()
 
-# Configure the Gemini API
+# Configure the Gemini API (one client shared by every session)
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-genai.configure(api_key=GEMINI_API_KEY)
+
+# Identical prompts within the TTL are answered from the response cache
+# (0 disables it); set RESPONSE_CACHE_PATH to persist it to SQLite across restarts
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH")
+
+# Limits shared by every session: model calls in flight at once, and calls
+# started per minute per API key (0 for no limit; set it to the key's quota)
+GEMINI_MAX_CONCURRENT = int(os.getenv("GEMINI_MAX_CONCURRENT", "8"))
+GEMINI_RATE_PER_MINUTE = int(os.getenv("GEMINI_RATE_PER_MINUTE", "0"))
+gemini_client = get_gemini_client(
+    GEMINI_API_KEY,
+    cache_ttl=RESPONSE_CACHE_TTL,
+    cache_path=RESPONSE_CACHE_PATH,
+    max_concurrent=GEMINI_MAX_CONCURRENT,
+    rate_per_minute=GEMINI_RATE_PER_MINUTE
+)
+# Calls run at INTERACTIVE priority unless wrapped in scheduler.priority(...)
+scheduler = gemini_client.scheduler
+
+# Show continuations and endings word by word as they are generated
+# (false keeps the wait-for-the-whole-response path)
+STREAMING_GENERATION = os.getenv("STREAMING_GENERATION", "true").lower() == "true"
+
+# Starter sets kept ready per genre for unnamed protagonists (0 disables the pool)
+STARTER_POOL_DEPTH = int(os.getenv("STARTER_POOL_DEPTH", "2"))
+# on_serve: each set is shown once; on_pick: a set is reused until someone picks from it
+STARTER_POOL_POLICY = os.getenv("STARTER_POOL_POLICY", "on_serve")
+# Also synthesize narration for pooled starters ahead of time
+STARTER_POOL_TTS = os.getenv("STARTER_POOL_TTS", "false").lower() == "true"
+
+# Show the performance panel (stage timings, model calls, cache hit rates) in the sidebar
+ADMIN_PANEL = os.getenv("ADMIN_PANEL", "false").lower() == "true"
+
+# Write each passage and the choices after it in one model call (false keeps
+# the separate continuation and choices calls)
+COMBINED_TURNS = os.getenv("COMBINED_TURNS", "true").lower() == "true"
+
+# Pre-generate the continuation for every displayed choice in the background
+# (costs up to one extra API call per unchosen choice)
+SPECULATIVE_GENERATION = os.getenv("SPECULATIVE_GENERATION", "false").lower() == "true"
 
 # Set page configuration
 st.set_page_config(
@@ -25,66 +99,47 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# Compression for new story logs: none, gzip or zstd (needs the zstandard
+# package). Existing logs keep theirs; story_store.py convert rewrites them.
+STORY_COMPRESSION = check_codec(os.getenv("STORY_COMPRESSION", "none"))
+
 # Ensure required folders exist
 if not os.path.exists("saved_stories"):
     os.makedirs("saved_stories")
 
+# Index existing saved stories the first time the catalog is used
+ensure_catalog()
+
+# Number of saved stories shown per page on the welcome screen
+SAVED_STORIES_PAGE_SIZE = 10
+
 # Audio folder for TTS files
-if not os.path.exists("audio_files"):
-    os.makedirs("audio_files")
+if not os.path.exists(os.path.join("static", "audio")):
+    os.makedirs(os.path.join("static", "audio"))
 
 # Initialize or load session state
 if "story_state" not in st.session_state:
-    st.session_state.story_state = {
-        "story_id": str(uuid.uuid4()),
-        "current_text": "",
-        "choices_made": [],
-        "path_taken": [],
-        "genre": "",
-        "character_name": "",
-        "stage": "welcome",  # welcome, setup, story, ending
-        "story_turns": 0,    # Track story progression
-        "word_count": 0      # Track total word count
-    }
+    st.session_state.story_state = new_story_state()
 
-# TTS function - generates audio and returns HTML for audio player
-def text_to_speech(text, filename=None):
-    if not text:
-        return None
-    
-    # Clean text for TTS (remove HTML tags and special markers)
-    clean_text = re.sub(r'<[^>]*>', '', text)
-    
-    # Generate a unique filename if not provided
-    if filename is None:
-        filename = f"audio_{uuid.uuid4()}.mp3"
-    
-    file_path = os.path.join("audio_files", filename)
-    
-    # Generate the audio file
-    tts = gTTS(text=clean_text, lang='en', slow=False)
-    tts.save(file_path)
-    
-    # Return the audio file path
-    return file_path
-
-# Function to create an audio player HTML
-def get_audio_player_html(audio_path):
-    audio_file = open(audio_path, 'rb')
-    audio_bytes = audio_file.read()
-    audio_base64 = base64.b64encode(audio_bytes).decode()
-    audio_file.close()
-    
-    # Delete the file after reading to save space
-    os.remove(audio_path)
-    
-    html = f'''
-    <audio autoplay controls style="width: 100%;">
-        <source src="data:audio/mp3;base64,{audio_base64}" type="audio/mp3">
-        Your browser does not support the audio element.
-    </audio>
-    '''
-    return html
+# Attach the narration synthesized so far to a placeholder, without waiting
+# for the rest. The job stays in session state until the next passage
+# replaces it, so chunks that finish later are added on a later rerun.
+# Called at the end of a screen so the story is already on the page.
+# st.audio serves the MP3 data with an audio content type.
+def render_narration(tts_job, slot):
+    if tts_job is None:
+        return
+    audio = tts_job.audio()
+    if audio:
+        slot.audio(audio, format="audio/mpeg")
+
+# Keep a passage's narration job for render_narration (None clears it, so an
+# older passage's narration isn't played instead)
+def set_narration(key, tts_job):
+    if tts_job:
+        st.session_state[key] = tts_job
+    else:
+        st.session_state.pop(key, None)
 
 # Improved styling with better contrast and readability
 def load_css():
@@ -318,279 +373,300 @@ def load_css():
 # Load CSS
 load_css()
 
-# Helper function to generate content with Gemini
-def generate_with_gemini(prompt, temperature=0.7, max_retries=3, retry_delay=2):
-    attempt = 0
-    while attempt < max_retries:
-        try:
-            model = genai.GenerativeModel('gemini-2.0-flash')
-            response = model.generate_content(prompt)
-            return response.text
-        except Exception as e:
-            attempt += 1
-            if attempt < max_retries:
-                time.sleep(retry_delay)
-            else:
-                st.error(f"Error generating content after {max_retries} attempts: {str(e)}")
-                return "Once upon a time, there was an error in the storytelling machine..."
-
-# Parse JSON safely
-def safe_json_parse(text):
-    # First try direct parsing
-    try:
-        return json.loads(text)
-    except:
-        # Try to find JSON array in the text using regex
-        json_match = re.search(r'\[\s*".*"\s*\]', text, re.DOTALL)
-        if json_match:
-            try:
-                return json.loads(json_match.group(0))
-            except:
-                pass
-        
-        # Try to extract items with quotes
-        items = re.findall(r'"([^"]*)"', text)
-        if items and len(items) > 0:
-            return items
-        
-        # Fallback: split by newlines, numbers or bullets
-        fallback_items = re.split(r'\n\s*(?:\d+\.|\*)\s*', text)
-        fallback_items = [s.strip() for s in fallback_items if s.strip()]
-        return fallback_items
-
-# Function to clean story text by removing embedded AI choices
-def clean_story_text(text):
-    # Remove patterns like "Option A: ...", "1. ...", "Choice: ..." etc.
-    patterns = [
-        r'(?:Option|Choice)\s+[A-Za-z0-9]+\s*:\s*.*?(?=(?:Option|Choice)|$)',
-        r'\d+\.\s+.*?(?=\d+\.|$)',
-        r'•\s+.*?(?=•|$)'
-    ]
-    
-    cleaned_text = text
-    for pattern in patterns:
-        cleaned_text = re.sub(pattern, '', cleaned_text, flags=re.DOTALL)
-    
-    # Remove any remaining numbered list markers
-    cleaned_text = re.sub(r'^\s*\d+\.\s+', '', cleaned_text, flags=re.MULTILINE)
-    
-    # Remove any "What will you do?" or similar prompts
-    prompts_to_remove = [
-        r'What will you do\?',
-        r'What do you do next\?',
-        r'What happens next\?',
-        r'What choice will you make\?',
-        r'Choose your next action.',
-        r'What would you like to do\?'
-    ]
-    
-    for prompt in prompts_to_remove:
-        cleaned_text = re.sub(prompt, '', cleaned_text)
-    
-    return cleaned_text.strip()
+# Show why a generation step failed
+def report_generation_error(error):
+    if isinstance(error, CircuitOpenError):
+        # The API has been failing for everyone; answer at once instead of waiting on retries
+        st.warning("The storyteller is taking a short break. Please try again in a moment.")
+    elif not isinstance(error, SchemaError):
+        # (a SchemaError was unusable even after a re-ask and is counted in
+        # metrics; the fallback reads fine without a message)
+        st.error(f"Error generating content: {str(error)}")
 
-# Generate story starters based on genre
-def generate_story_starters(genre=None, character_name=None):
-    prompt = """
-    Generate 3 unique and engaging story starters for an interactive fiction game.
-    Each starter should be 2-3 sentences long and end with an intriguing situation that sets up a choice,
-    but DO NOT include the choices in the starter.
-    """
-    
-    if genre:
-        prompt += f" The genre is {genre}."
-        
-    if character_name:
-        prompt += f" The main character's name is {character_name}."
-        
-    prompt += """
-    Make each starter distinct and compelling. Format the response as a JSON array with each starter as a string element.
-    Example format: ["Starter 1...", "Starter 2...", "Starter 3..."]
-    
-    DO NOT include any choices or options in the starters themselves.
-    """
-    
+# Run a generation step from story_engine against the shared client, showing
+# errors on screen and answering with fallback instead
+# (retries, backoff, the circuit breaker and the response cache live in the
+# shared client)
+def generate_with_gemini(write, *args, fallback=GENERATION_FALLBACK, **kwargs):
     try:
-        response = generate_with_gemini(prompt)
-        starters = safe_json_parse(response)
-        return starters[:3]  # Ensure we only return 3 starters
-        
+        return write(gemini_client, *args, **kwargs)
     except Exception as e:
-        st.error(f"Error generating story starters: {str(e)}")
-        return [
-            f"You find yourself standing at the edge of a mysterious forest with a map that seems to lead to a hidden treasure.",
-            f"The spaceship's alarm blares as you wake up from cryosleep, the rest of the crew is missing.",
-            f"The old mansion you just inherited contains a locked room that nobody has entered for over a century."
-        ]
+        report_generation_error(e)
+        return fallback
+
+# Generate story starters based on genre
+# fresh=True skips the response cache (the player asked for new beginnings)
+def generate_story_starters(genre=None, character_name=None, fresh=False):
+    with metrics.span("starters"):
+        starters = generate_with_gemini(write_starters, genre, character_name, fresh=fresh, fallback=None)
+    return starters or list(FALLBACK_STARTERS)
+
+# Starter set for the background pool; raises instead of falling back so
+# failed generations never end up in the pool
+def generate_pooled_starters(genre):
+    with metrics.span("pool_starters"), scheduler.priority(BACKGROUND):
+        starters = write_starters(gemini_client, genre, fresh=True)
+    if len(starters) < 3:
+        raise ValueError("Starter response did not contain three starters")
+    return starters
+
+# Process-wide pool of ready starters, filled in the background
+starter_pool = None
+if STARTER_POOL_DEPTH > 0:
+    starter_pool = get_starter_pool(
+        generate_pooled_starters,
+        GENRE_OPTIONS.keys(),
+        depth=STARTER_POOL_DEPTH,
+        policy=STARTER_POOL_POLICY,
+        prerender=text_to_speech if STARTER_POOL_TTS else None
+    )
 
 # Generate choices for the user
-def generate_choices(story_so_far, genre, character_name, num_choices=3):
-    # First clean the story text to remove any embedded choices
-    cleaned_story = clean_story_text(story_so_far)
-    
-    prompt = f"""
-    Based on this story so far in the {genre} genre:
-    
-    {cleaned_story}
-    
-    Generate exactly {num_choices} interesting and distinct choices for what the character {character_name if character_name else 'the protagonist'} could do next.
-    
-    Each choice should:
-    1. Be 1-2 sentences long
-    2. Offer a clear and specific action
-    3. Lead to different possible story directions
-    4. Make sense given the current story situation
-    5. NOT reference any options or choices that might be in the story text
-    
-    Format the response as a JSON array with each choice as a string element.
-    Example format: ["Choice 1...", "Choice 2...", "Choice 3..."]
-    
-    IMPORTANT: DO NOT number the choices or add prefixes like "Option A" - just provide the plain choice text.
-    """
-    
-    try:
-        response = generate_with_gemini(prompt)
-        choices = safe_json_parse(response)
-        
-        # Ensure we have the requested number of choices
-        while len(choices) < num_choices:
-            choices.append(f"Try something unexpected.")
-            
-        return choices[:num_choices]  # Return only the requested number of choices
-        
-    except Exception as e:
-        st.error(f"Error generating choices: {str(e)}")
-        return [
-            "Continue forward cautiously.",
-            "Turn back and seek another path.",
-            "Call out to see if anyone responds."
-        ]
+# story_context is the rolling memory text from build_story_context, not the full
+# story; its passages were cleaned when they were added, so it is used as is
+def generate_choices(story_context, genre, character_name, num_choices=3):
+    with metrics.span("choices"):
+        return generate_with_gemini(write_choices, story_context, genre, character_name, num_choices,
+                                    fallback=list(FALLBACK_CHOICES))
 
 # Continue the story based on user choice
-def continue_story(story_so_far, chosen_action, genre, character_name):
-    # Clean the story text first
-    cleaned_story = clean_story_text(story_so_far)
-    
-    prompt = f"""
-    Continue this {genre} story where the main character named {character_name if character_name else 'the protagonist'} has chosen the following action:
-    
-    Story so far: {cleaned_story}
-    
-    Chosen action: {chosen_action}
-    
-    Write the next part of the story (about 150-200 words) that follows from this choice. End at a natural stopping point that creates anticipation for what might happen next.
-    
-    IMPORTANT:
-    - DO NOT include any numbered choices, options, or decision points in your response
-    - DO NOT end with phrases like "What will you do?" or "What happens next?"
-    - DO NOT write anything like "Option A:" or "Choice 1:" in your response
-    - Focus on vivid descriptions, character emotions, and advancing the plot
-    - Use a mix of narration and dialog where appropriate
-    """
-    
-    response = generate_with_gemini(prompt, temperature=0.8)
-    
-    return clean_story_text(response)
+def continue_story(story_context, chosen_action, genre, character_name):
+    with metrics.span("continue"):
+        return generate_with_gemini(write_continuation, story_context, chosen_action, genre, character_name)
 
-# Generate a story ending
-def generate_story_ending(story_so_far, genre, character_name):
-    # Clean the story text first
-    cleaned_story = clean_story_text(story_so_far)
-    
-    prompt = f"""
-    Write a satisfying conclusion to this {genre} story featuring {character_name if character_name else 'the protagonist'}:
-    
-    {cleaned_story}
-    
-    Create a meaningful and emotionally resonant ending (about 200-300 words) that:
-    1. Resolves the main tension or conflict
-    2. Provides closure for the character
-    3. Reflects the tone and themes of the {genre} genre
-    4. Leaves the reader with a final image or thought
-    
-    Make the ending feel earned and connected to the character's journey.
-    """
+# Passage and next choices in one call, as (passage, choices); choices is
+# None if they couldn't be written, and are then generated on the next rerun
+def continue_turn(story_context, chosen_action, genre, character_name):
+    with metrics.span("turn_call"):
+        return generate_with_gemini(write_turn, story_context, chosen_action, genre, character_name,
+                                    fallback=(GENERATION_FALLBACK, None))
+
+# Stream story text chunks into a placeholder as they arrive, queueing
+# narration for each finished sentence. Returns the cleaned text and the
+# narration job. With fallback=None, a stream that fails before any text
+# arrives raises its error instead of answering with the fallback.
+def stream_story_text(chunks, slot, fallback=GENERATION_FALLBACK):
+    narration = NarrationStream(clean=clean_story_text)
+    text = ""
+    try:
+        for chunk in chunks:
+            text += chunk
+            narration.feed(chunk)
+            slot.markdown(f"<div class='story-text'>{format_dialog(text)}</div>", unsafe_allow_html=True)
+    except Exception as e:
+        if fallback is None and not clean_story_text(text):
+            raise
+        report_generation_error(e)
     
-    return generate_with_gemini(prompt, temperature=0.8)
+    # Keep whatever arrived before an error; fall back only if nothing did
+    text = clean_story_text(text)
+    if not text:
+        if fallback is None:
+            raise ValueError("The model returned no text")
+        return fallback, None
+    return text, narration.finish()
 
-# Generate story recap
+# Streaming version of continue_story
+def continue_story_streaming(story_context, chosen_action, genre, character_name, slot):
+    prompt = build_continue_prompt(story_context, chosen_action, genre, character_name)
+    with metrics.span("continue", streamed=True):
+        return stream_story_text(
+            gemini_client.generate_stream(prompt, temperature=0.8, max_output_tokens=600), slot)
+
+# Streaming version of continue_turn: the passage is shown as it arrives and
+# the choices are read once the response is complete. Returns the passage,
+# the choices (None if unusable) and the narration job.
+def continue_turn_streaming(story_context, chosen_action, genre, character_name, slot):
+    prompt = build_turn_prompt(story_context, chosen_action, genre, character_name)
+    with metrics.span("turn_call", streamed=True):
+        stream = StructuredStream(
+            gemini_client.generate_stream(prompt, temperature=0.8, max_output_tokens=1000,
+                                          response_schema=TURN_SCHEMA),
+            TURN_SCHEMA, "turn", "passage")
+        text, narration = stream_story_text(stream, slot)
+        try:
+            choices = stream.result(field_at_least("paths", 3))["paths"]
+        except SchemaError:
+            choices = None
+    return text, choices, narration
+
+# Streaming version of generate_story_ending
+def generate_story_ending_streaming(story_context, genre, character_name, slot):
+    prompt = build_ending_prompt(story_context, genre, character_name)
+    with metrics.span("ending", streamed=True):
+        return stream_story_text(
+            gemini_client.generate_stream(prompt, temperature=0.8, max_output_tokens=900), slot,
+            fallback=None)
+
+# Generate a story ending. Errors propagate instead of falling back, so a
+# failed ending is never stored as the story's conclusion (see show_ending).
+def generate_story_ending(story_context, genre, character_name):
+    with metrics.span("ending"):
+        return write_ending(gemini_client, story_context, genre, character_name)
+
+# Process-wide background summary writer
+summary_worker = get_summary_worker()
+
+# One summary fold, written on a summary worker thread (must not touch session state)
+def background_summary(summary, passage):
+    with metrics.span("summary"), scheduler.priority(NORMAL):
+        return write_summary(gemini_client, summary, passage)
+
+# Summarizer for update_story_memory that never blocks: it starts the model
+# summary of the fold in the background and returns None, so story_memory
+# folds with its extractive summary until current_story_memory swaps it in
+def summarize_in_background(story_state):
+    def summarize(summary, passage):
+        # The summarized passage count goes up right after this fold
+        folded = story_state["memory"]["summarized_passages"] + 1
+        summary_worker.start(summary_key(story_state, folded), summary, passage, background_summary)
+        return None
+    return summarize
+
+# The story's memory, with the model summary of its latest fold if it has
+# been written since
+def current_story_memory(story_state):
+    memory = ensure_story_memory(story_state)
+    folded = memory["summarized_passages"]
+    if folded:
+        summary = summary_worker.take(summary_key(story_state, folded))
+        if summary is not None:
+            apply_background_summary(memory, folded, summary)
+    return memory
+
+# Process-wide background recap writer; recaps are memoized on their inputs
+recap_worker = get_recap_worker()
+
+# One recap, written on a recap worker thread (must not touch session state)
+def background_recap(inputs):
+    with metrics.span("recap"), scheduler.priority(NORMAL):
+        return write_recap(gemini_client, inputs)
+
+# Start the recap as soon as the choices are final, so it is written while
+# the ending is. Does nothing if the story already has its recap.
+def start_recap(story_state):
+    # The recap covers every choice, including those of pages not loaded yet
+    if story_state.get("passage_offset"):
+        with metrics.span("load_page"):
+            load_all_passages(story_state)
+    if not has_current_recap(story_state):
+        recap_worker.start(story_state, background_recap)
+
+# Story recap, waiting for the background one if it isn't finished yet
+# (started if needed). Raises the generation error, like generate_story_ending.
 def generate_recap(story_state):
-    choices_made = story_state["choices_made"]
+    return recap_worker.result(story_state, background_recap)
+
+# Position in a story that speculative branches belong to
+def story_position(story_state):
+    return (story_state["story_id"], story_state["story_turns"])
+
+# Session's tracker for background continuations
+def get_speculative_branches():
+    if "speculative_branches" not in st.session_state:
+        st.session_state.speculative_branches = SpeculativeBranches(scheduler=scheduler)
+    return st.session_state.speculative_branches
+
+# Session's cache of the rendered story view
+def get_render_cache():
+    if "render_cache" not in st.session_state:
+        st.session_state.render_cache = StoryRenderCache()
+    return st.session_state.render_cache
+
+# Story HTML, formatting only the passages added since the last rerun
+def render_story_html(story_state):
+    return get_render_cache().render(story_state["story_id"], story_state["passages"],
+                                     story_state.get("passage_offset", 0))
+
+# Button that reads the previous page of a resumed story's passages
+def show_earlier_passages_button(story_state):
+    earlier = story_state.get("passage_offset", 0)
+    if earlier and st.button(f"Show earlier passages ({earlier} more)", key="earlier_passages"):
+        with metrics.span("load_page"):
+            load_earlier_passages(story_state)
+        st.experimental_rerun()
+
+# Whether the turn after this one is written with its choices in one call
+# (the last turn leads to the ending and needs none)
+def combined_turn(story_state):
+    return COMBINED_TURNS and story_state["story_turns"] + 1 < MAX_TURNS
+
+# Start generating a continuation for each displayed choice
+def start_speculative_branches(story_state, choices):
+    # Snapshot everything the worker needs; background threads must not read session state
+    story_context = build_story_context(current_story_memory(story_state))
     genre = story_state["genre"]
-    character_name = story_state["character_name"] if story_state["character_name"] else "the protagonist"
-    
-    # If no choices made yet, return empty string
-    if not choices_made:
-        return ""
-        
-    prompt = f"""
-    Create a brief recap (2-3 sentences) of this {genre} story so far featuring {character_name}.
-    Focus on the key decisions and turning points.
-    
-    Here are the choices that were made: {', '.join(choices_made)}
-    """
-    
-    recap = generate_with_gemini(prompt, temperature=0.7)
-    
-    return recap
+    character_name = story_state["character_name"]
+    combined = combined_turn(story_state)
+    
+    get_speculative_branches().start(
+        story_position(story_state),
+        choices,
+        lambda choice, priority: speculative_continuation(story_context, choice, genre, character_name,
+                                                          combined, priority))
+
+# One background branch, as (passage, choices); choices is None unless the
+# turn is combined. priority starts at BACKGROUND and is raised once the
+# branch is picked. Errors are not shown; a failed (or shed) branch is
+# generated again if it is picked.
+def speculative_continuation(story_context, chosen_action, genre, character_name, combined=False,
+                             priority=BACKGROUND):
+    with scheduler.priority(priority):
+        if combined:
+            return write_turn(gemini_client, story_context, chosen_action, genre, character_name)
+        return write_continuation(gemini_client, story_context, chosen_action, genre, character_name), None
 
-# Save story to file
+# Drop any background continuations for this session
+def cancel_speculative_branches():
+    if "speculative_branches" in st.session_state:
+        st.session_state.speculative_branches.cancel()
+
+# Save story to file (appends only what changed since the last save)
 def save_story(story_state):
-    story_id = story_state["story_id"]
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"saved_stories/{story_id}_{timestamp}.json"
-    
-    with open(filename, "w") as f:
-        json.dump(story_state, f, indent=2)
+    with metrics.span("save"):
+        filename = save_story_log(story_state, compression=STORY_COMPRESSION)
+        
+        # Keep the saved-story catalog in step with the log
+        record_story(story_state, filename, time.time())
         
     return filename
 
-# Load saved stories list
-def get_saved_stories():
+# Load one page of the saved stories list (newest first) from the catalog
+def get_saved_stories(page=0, page_size=SAVED_STORIES_PAGE_SIZE):
     if not os.path.exists("saved_stories"):
         return []
         
     stories = []
-    for filename in os.listdir("saved_stories"):
-        if filename.endswith(".json"):
-            file_path = os.path.join("saved_stories", filename)
-            try:
-                with open(file_path, "r") as f:
-                    story_data = json.load(f)
-                    
-                # Extract key information
-                story_info = {
-                    "filename": filename,
-                    "date": datetime.strptime(filename.split("_")[1].split(".")[0], "%Y%m%d%H%M%S").strftime("%b %d, %Y"),
-                    "genre": story_data.get("genre", "Unknown"),
-                    "character": story_data.get("character_name", "Unknown"),
-                    "choices": len(story_data.get("choices_made", [])),
-                    "story_id": story_data.get("story_id", "")
-                }
-                stories.append(story_info)
-            except:
-                pass
-                
-    # Sort by date (newest first)
-    stories.sort(key=lambda x: x["date"], reverse=True)
+    for entry in list_stories(limit=page_size, offset=page * page_size):
+        stories.append({
+            "filename": entry["filename"],
+            "date": datetime.fromtimestamp(entry["saved_at"]).strftime("%b %d, %Y"),
+            "genre": entry["genre"] or "Unknown",
+            "character": entry["character_name"] or "Unknown",
+            "choices": entry["choices"],
+            "word_count": entry["word_count"] or 0,
+            "story_id": entry["story_id"]
+        })
     return stories
 
 # Calculate story statistics
 def calculate_story_stats(story_state):
-    # Count words in current story
-    word_count = len(story_state["current_text"].split())
+    # Running totals kept up to date as passages are added
+    stats = story_stats(story_state)
     
     # Estimate reading time (avg 200-250 wpm)
-    reading_time = round(word_count / 225)
+    reading_time = round(stats["reading_minutes"])
     if reading_time < 1:
         reading_time = "< 1"
         
     # Count choices made
-    choices_made = len(story_state["choices_made"])
+    choices_made = choice_count(story_state)
     
     return {
-        "word_count": word_count,
+        "word_count": stats["word_count"],
         "reading_time": reading_time,
+        "dialog_ratio": stats["dialog_ratio"],
+        "passage_count": stats["passage_count"],
         "choices_made": choices_made,
         "story_turns": story_state["story_turns"]
     }
@@ -627,7 +703,13 @@ def show_welcome():
             
     # Show saved stories if requested
     if "view_saved" in st.session_state and st.session_state.view_saved:
-        saved_stories = get_saved_stories()
+        page = st.session_state.get("saved_page", 0)
+        saved_stories = get_saved_stories(page)
+        
+        if not saved_stories and page > 0:
+            # The page emptied out; go back to the first one
+            st.session_state.saved_page = 0
+            saved_stories = get_saved_stories(0)
         
         if not saved_stories:
             st.info("No saved stories found. Start a new adventure!")
@@ -641,24 +723,46 @@ def show_welcome():
                     st.markdown(f"""
                     <div class="story-option">
                         <strong>{story['character']}'s {story['genre']} Adventure</strong><br>
-                        <small>Saved on {story['date']} • {story['choices']} choices made</small>
+                        <small>Saved on {story['date']} • {story['choices']} choices made • {story['word_count']} words</small>
                     </div>
                     """, unsafe_allow_html=True)
                     
                 with col2:
                     if st.button("Continue", key=f"load_{story['story_id']}"):
                         file_path = os.path.join("saved_stories", story["filename"])
-                        with open(file_path, "r") as f:
-                            st.session_state.story_state = json.load(f)
-                        st.session_state.story_state["stage"] = "story"
+                        # Only the header and the latest passages are read; older ones on request
+                        st.session_state.story_state = resume_story(file_path)
+                        get_render_cache().invalidate()
+                        ensure_story_memory(st.session_state.story_state)
+                        # Finished stories reopen on their conclusion; nothing is regenerated
+                        st.session_state.story_state["stage"] = "ending" if st.session_state.story_state.get("finalized") else "story"
                         
                         # Clear any temporary states
                         if "view_saved" in st.session_state:
                             del st.session_state.view_saved
                         if "current_choices" in st.session_state:
                             del st.session_state.current_choices
+                        if "saved_page" in st.session_state:
+                            del st.session_state.saved_page
+                        st.session_state.pop("current_audio", None)
+                        st.session_state.pop("ending_audio", None)
                             
                         st.experimental_rerun()
+            
+            # Page through older stories
+            total_pages = max(1, -(-count_stories() // SAVED_STORIES_PAGE_SIZE))
+            page = st.session_state.get("saved_page", 0)
+            col1, col2, col3 = st.columns([1, 2, 1])
+            with col1:
+                if st.button("← Newer", key="saved_newer", disabled=page == 0):
+                    st.session_state.saved_page = page - 1
+                    st.experimental_rerun()
+            with col2:
+                st.markdown(f"<p style='text-align: center;'>Page {page + 1} of {total_pages}</p>", unsafe_allow_html=True)
+            with col3:
+                if st.button("Older →", key="saved_older", disabled=page + 1 >= total_pages):
+                    st.session_state.saved_page = page + 1
+                    st.experimental_rerun()
 
 # Setup screen
 def show_setup():
@@ -667,20 +771,9 @@ def show_setup():
     # Genre selection with color-coded badges
     st.markdown("<p>Select the type of story you want to experience:</p>", unsafe_allow_html=True)
     
-    genre_options = {
-        "Fantasy": "Magical worlds, mythical creatures, and heroic quests",
-        "Science Fiction": "Future technology, space exploration, and scientific possibilities",
-        "Mystery": "Puzzles, investigations, and secrets waiting to be uncovered",
-        "Adventure": "Exploration, discovery, and overcoming challenges",
-        "Horror": "Fear, suspense, and encounters with the unknown",
-        "Romance": "Relationships, emotional connections, and matters of the heart",
-        "Historical": "Stories set in the past, often based on real events or periods",
-        "Comedy": "Humor, wit, and light-hearted situations"
-    }
-    
     # Create genre selection grid
     cols = st.columns(2)
-    for i, (genre, description) in enumerate(genre_options.items()):
+    for i, (genre, description) in enumerate(GENRE_OPTIONS.items()):
         with cols[i % 2]:
             st.markdown(f"""
             <div class="story-option" id="genre-{genre.lower().replace(' ', '-')}">
@@ -707,7 +800,15 @@ def show_setup():
         # Generate story starters
         if st.button("Generate Story Beginnings", key="gen_starters"):
             with st.spinner("Crafting your adventure beginnings..."):
-                starters = generate_story_starters(st.session_state.selected_genre, character_name)
+                starters = None
+                # Unnamed protagonists can be served instantly from the pre-generated pool
+                if starter_pool is not None and not character_name:
+                    starters = starter_pool.take(st.session_state.selected_genre)
+                if not starters:
+                    starters = generate_story_starters(
+                        st.session_state.selected_genre,
+                        character_name,
+                        fresh="story_starters" in st.session_state)
                 st.session_state.story_starters = starters
                 st.session_state.character_trait = character_trait
                 
@@ -725,26 +826,26 @@ def show_setup():
                 if st.button(f"Begin This Story", key=f"starter_{i}"):
                     # Save selections and move to story stage
                     st.session_state.story_state["genre"] = st.session_state.selected_genre
+                    if starter_pool is not None:
+                        starter_pool.mark_used(st.session_state.selected_genre, starter)
                     st.session_state.story_state["character_name"] = character_name if 'character_name' in locals() else ""
                     st.session_state.story_state["character_trait"] = st.session_state.character_trait
-                    st.session_state.story_state["current_text"] = starter
                     st.session_state.story_state["stage"] = "story"
-                    if "selected_genre" in st.session_state:
-        del st.session_state.selected_genre
-    if "story_starters" in st.session_state:
-        del st.session_state.story_starters
-                    st.session_state.story_state["path_taken"].append({"type": "beginning", "text": starter})
-                    st.session_state.story_state["word_count"] = len(starter.split())
+                    add_passage(st.session_state.story_state, "beginning", starter)
                     st.session_state.story_state["story_turns"] = 0
+                    st.session_state.story_state["memory"] = new_story_memory()
+                    update_story_memory(st.session_state.story_state["memory"], starter)
                     
-                    # Generate audio for the starter
-                    audio_path = text_to_speech(starter)
-                    if audio_path:
-                        st.session_state.current_audio = audio_path
+                    # Queue narration for the starter
+                    set_narration("current_audio", text_to_speech(starter))
                     
                     # Clear temporary states
                     if "current_choices" in st.session_state:
                         del st.session_state.current_choices
+                    if "selected_genre" in st.session_state:
+                        del st.session_state.selected_genre
+                    if "story_starters" in st.session_state:
+                        del st.session_state.story_starters
                         
                     st.experimental_rerun()
 
@@ -769,31 +870,33 @@ def show_story():
     </div>
     """, unsafe_allow_html=True)
     
-    # Format and display current story with improved styling
-    formatted_story = st.session_state.story_state["current_text"]
-    
-    # Process for better display - convert dialog
-    formatted_story = re.sub(r'"([^"]*)"', r'<span class="dialog">"\1"</span>', formatted_story)
+    # Display current story; only passages added since the last rerun are rendered
+    show_earlier_passages_button(st.session_state.story_state)
+    formatted_story = render_story_html(st.session_state.story_state)
     
     st.markdown(f"<div class='story-text'>{formatted_story}</div>", unsafe_allow_html=True)
     
-    # Play audio if available
-    if "current_audio" in st.session_state:
-        audio_player = get_audio_player_html(st.session_state.current_audio)
-        st.markdown(audio_player, unsafe_allow_html=True)
-        # Remove the reference after playing
-        del st.session_state.current_audio
+    # Reserve a spot for the narration player; it is filled at the end of the screen
+    narration_slot = st.empty()
+    narration_job = st.session_state.get("current_audio")
+    
+    # Newly generated text is streamed here, right under the story
+    live_slot = st.empty()
     
     # Generate choices if not already present
     if "current_choices" not in st.session_state:
         with st.spinner("Determining possible paths..."):
             choices = generate_choices(
-                st.session_state.story_state["current_text"],
+                build_story_context(current_story_memory(st.session_state.story_state)),
                 st.session_state.story_state["genre"],
                 st.session_state.story_state["character_name"]
             )
             st.session_state.current_choices = choices
     
+    # Generate the continuations for the displayed choices while the player reads
+    if st.session_state.get("speculative_mode", SPECULATIVE_GENERATION):
+        start_speculative_branches(st.session_state.story_state, st.session_state.current_choices)
+    
     # Display choices
     st.markdown("<h3>What will you do next?</h3>", unsafe_allow_html=True)
     
@@ -801,28 +904,58 @@ def show_story():
         if st.button(choice, key=f"choice_{i}", help="Choose this action"):
             chosen_action = choice
             
-            # Record choice
-            st.session_state.story_state["choices_made"].append(chosen_action)
-            st.session_state.story_state["path_taken"].append({"type": "choice", "text": chosen_action})
+            # Timed as a whole, from the click until the next screen is ready
+            turn_started = time.perf_counter()
+            
+            # Use the pre-generated continuation if this branch was speculated
+            next_part = None
+            next_choices = None
+            if "speculative_branches" in st.session_state:
+                branch = st.session_state.speculative_branches.take(
+                    story_position(st.session_state.story_state), chosen_action)
+                if branch is not None:
+                    next_part, next_choices = branch
+            speculated = next_part is not None
+            
+            # One call writes the passage and the next choices unless this is the last turn
+            combined = combined_turn(st.session_state.story_state)
             
             # Continue story based on choice
+            tts_job = None
             with st.spinner("The story unfolds..."):
-                next_part = continue_story(
-                    st.session_state.story_state["current_text"],
-                    chosen_action,
-                    st.session_state.story_state["genre"],
-                    st.session_state.story_state["character_name"])
+                story_context = build_story_context(current_story_memory(st.session_state.story_state))
+                genre = st.session_state.story_state["genre"]
+                character_name = st.session_state.story_state["character_name"]
+                if next_part is None and STREAMING_GENERATION and combined:
+                    next_part, next_choices, tts_job = continue_turn_streaming(
+                        story_context, chosen_action, genre, character_name, live_slot)
+                elif next_part is None and STREAMING_GENERATION:
+                    next_part, tts_job = continue_story_streaming(
+                        story_context, chosen_action, genre, character_name, live_slot)
+                elif next_part is None and combined:
+                    next_part, next_choices = continue_turn(story_context, chosen_action, genre, character_name)
+                elif next_part is None:
+                    next_part = continue_story(story_context, chosen_action, genre, character_name)
+                
+                # Record the choice together with the part it produced, so a rerun
+                # during generation (e.g. a second click) leaves no dangling choice
+                add_passage(st.session_state.story_state, "choice", chosen_action)
                 
-                # Update story text with user's choice and next part
-                st.session_state.story_state["current_text"] += f"\n\n<div class='choice-marker'>You chose: {chosen_action}</div>\n\n{next_part}"
+                # Add the next part to the story (also updates the word count)
+                add_passage(st.session_state.story_state, "continuation", next_part)
                 
-                # Generate audio for the next part
-                audio_path = text_to_speech(next_part)
-                if audio_path:
-                    st.session_state.current_audio = audio_path
+                # Roll the new passage into the story memory used for prompts; a
+                # passage leaving the recent window is summarized in the background
+                update_story_memory(
+                    st.session_state.story_state["memory"],
+                    f"You chose: {chosen_action}\n\n{next_part}",
+                    summarize_in_background(st.session_state.story_state))
                 
-                # Update word count
-                st.session_state.story_state["word_count"] = len(st.session_state.story_state["current_text"].split())
+                # Queue narration for the next part (streamed text already queued it
+                # sentence by sentence); it is synthesized in the background
+                if tts_job is None:
+                    tts_job = text_to_speech(next_part)
+                set_narration("current_audio", tts_job)
                 
                 # Increment turn counter
                 st.session_state.story_state["story_turns"] += 1
@@ -831,8 +964,9 @@ def show_story():
                 save_story(st.session_state.story_state)
                 
                 # Check if we should end story based on turns
-                if st.session_state.story_state["story_turns"] >= 10:
+                if st.session_state.story_state["story_turns"] >= MAX_TURNS:
                     st.session_state.story_state["stage"] = "ending"
+                    start_recap(st.session_state.story_state)
                 
                 # Clear choices for next turn
                 if "current_choices" in st.session_state:
@@ -841,7 +975,12 @@ def show_story():
                 # Add this before rerunning:
                 if "current_choices" in st.session_state:
                     del st.session_state.current_choices   
-                    
+                
+                # Choices written with the passage save the next screen a model call
+                if next_choices:
+                    st.session_state.current_choices = next_choices
+                
+                metrics.observe("turn", time.perf_counter() - turn_started, speculative=speculated)
                 st.rerun()
     
     # Navigation options
@@ -853,27 +992,20 @@ def show_story():
             
     with col2:
         if st.button("End Story", key="end_story_button"):
+            cancel_speculative_branches()
             st.session_state.story_state["stage"] = "ending"
+            start_recap(st.session_state.story_state)
             st.experimental_rerun()
             
     with col3:
         if st.button("New Story", key="new_story_button"):
+            cancel_speculative_branches()
             if st.session_state.story_state["story_turns"] > 0:
                 # Save current story before starting new
                 save_story(st.session_state.story_state)
                 
             # Reset story state
-            st.session_state.story_state = {
-                "story_id": str(uuid.uuid4()),
-                "current_text": "",
-                "choices_made": [],
-                "path_taken": [],
-                "genre": "",
-                "character_name": "",
-                "stage": "welcome",
-                "story_turns": 0,
-                "word_count": 0
-            }
+            st.session_state.story_state = new_story_state()
             
             # Clear any temporary states
             if "current_choices" in st.session_state:
@@ -886,34 +1018,48 @@ def show_story():
                 del st.session_state.current_audio
                 
             st.experimental_rerun()
+    
+    # Attach narration now that the story and choices are on screen
+    render_narration(narration_job, narration_slot)
 
 # Story ending screen
 def show_ending():
     st.markdown("<h2 class='section-header'>Story Conclusion</h2>", unsafe_allow_html=True)
     
-    if "ending_text" not in st.session_state:
+    # Write the ending and recap once; reruns of this screen reuse the stored results
+    if not st.session_state.story_state.get("finalized"):
+        # Usually already running since the last choice; the ending is written meanwhile
+        start_recap(st.session_state.story_state)
+        live_slot = st.empty()
+        streamed_narration = []
+        
+        def write_story_ending(story_state):
+            story_context = build_story_context(current_story_memory(story_state))
+            if not STREAMING_GENERATION:
+                return generate_story_ending(story_context, story_state["genre"], story_state["character_name"])
+            ending, tts_job = generate_story_ending_streaming(
+                story_context, story_state["genre"], story_state["character_name"], live_slot)
+            streamed_narration.append(tts_job)
+            return ending
+        
         with st.spinner("Crafting your story's conclusion..."):
-            ending = generate_story_ending(
-                st.session_state.story_state["current_text"],
-                st.session_state.story_state["genre"],
-                st.session_state.story_state["character_name"]
-            )
-            st.session_state.ending_text = ending
+            try:
+                finalize_story(st.session_state.story_state, write_story_ending, generate_recap, save_story)
+            except Exception as e:
+                # Nothing failed is stored; the next rerun of this screen tries again
+                report_generation_error(e)
             
-            # Generate audio for the ending
-            audio_path = text_to_speech(ending)
-            if audio_path:
-                st.session_state.ending_audio = audio_path
-    
-    # Update story with ending
-    st.session_state.story_state["current_text"] += f"\n\n<div class='section-header'>The Conclusion</div>\n\n{st.session_state.ending_text}"
-    st.session_state.story_state["path_taken"].append({"type": "ending", "text": st.session_state.ending_text})
-    
-    # Update word count
-    st.session_state.story_state["word_count"] = len(st.session_state.story_state["current_text"].split())
-    
-    # Save story with ending
-    save_story(st.session_state.story_state)
+            # Queue narration for the ending (already queued if it was streamed)
+            ending = story_ending_text(st.session_state.story_state)
+            tts_job = streamed_narration[0] if streamed_narration else ending and text_to_speech(ending)
+            set_narration("ending_audio", tts_job)
+        
+        # The ending now appears in the complete story below; without one the
+        # fallback stands in for it
+        if story_ending_text(st.session_state.story_state):
+            live_slot.empty()
+        else:
+            live_slot.markdown(f"<div class='story-text'>{GENERATION_FALLBACK}</div>", unsafe_allow_html=True)
     
     # Display story stats
     stats = calculate_story_stats(st.session_state.story_state)
@@ -928,23 +1074,23 @@ def show_ending():
     </div>
     """, unsafe_allow_html=True)
     
-    # Play ending audio if available
-    if "ending_audio" in st.session_state:
-        audio_player = get_audio_player_html(st.session_state.ending_audio)
-        st.markdown(audio_player, unsafe_allow_html=True)
-        # Remove the reference after playing
-        del st.session_state.ending_audio
+    # Reserve a spot for the ending narration; it is filled once the page is rendered
+    narration_slot = st.empty()
+    narration_job = st.session_state.get("ending_audio")
     
     # Generate and display summary/recap
     with st.expander("Your Adventure Summary", expanded=True):
-        recap = generate_recap(st.session_state.story_state)
+        recap = st.session_state.story_state.get("recap", GENERATION_FALLBACK)
         st.markdown(f"<div class='story-text'>{recap}</div>", unsafe_allow_html=True)
     
+    # The complete story and the export need every passage of a resumed story
+    if st.session_state.story_state.get("passage_offset"):
+        with metrics.span("load_page"):
+            load_all_passages(st.session_state.story_state)
+    
     # Display full story with ending
     with st.expander("Read Your Complete Story", expanded=True):
-        formatted_story = st.session_state.story_state["current_text"]
-        # Process for better display - convert dialog
-        formatted_story = re.sub(r'"([^"]*)"', r'<span class="dialog">"\1"</span>', formatted_story)
+        formatted_story = render_story_html(st.session_state.story_state)
         st.markdown(f"<div class='story-text'>{formatted_story}</div>", unsafe_allow_html=True)
     
     # Options for next steps
@@ -953,17 +1099,7 @@ def show_ending():
     with col1:
         if st.button("Start New Adventure", key="new_adventure"):
             # Reset story state
-            st.session_state.story_state = {
-                "story_id": str(uuid.uuid4()),
-                "current_text": "",
-                "choices_made": [],
-                "path_taken": [],
-                "genre": "",
-                "character_name": "",
-                "stage": "welcome",
-                "story_turns": 0,
-                "word_count": 0
-            }
+            st.session_state.story_state = new_story_state()
             
             # Clear temporary states
             if "current_choices" in st.session_state:
@@ -972,25 +1108,14 @@ def show_ending():
                 del st.session_state.selected_genre
             if "story_starters" in st.session_state:
                 del st.session_state.story_starters
-            if "ending_text" in st.session_state:
-                del st.session_state.ending_text
+            st.session_state.pop("ending_audio", None)
                 
             st.experimental_rerun()
     
     with col2:
         if st.button("Browse Saved Stories", key="view_saved_stories"):
             # Reset story state but keep saved stories
-            st.session_state.story_state = {
-                "story_id": str(uuid.uuid4()),
-                "current_text": "",
-                "choices_made": [],
-                "path_taken": [],
-                "genre": "",
-                "character_name": "",
-                "stage": "welcome",
-                "story_turns": 0,
-                "word_count": 0
-            }
+            st.session_state.story_state = new_story_state()
             
             # Set flag to view saved stories
             st.session_state.view_saved = True
@@ -1002,8 +1127,7 @@ def show_ending():
                 del st.session_state.selected_genre
             if "story_starters" in st.session_state:
                 del st.session_state.story_starters
-            if "ending_text" in st.session_state:
-                del st.session_state.ending_text
+            st.session_state.pop("ending_audio", None)
                 
             st.experimental_rerun()
     
@@ -1014,13 +1138,13 @@ def show_ending():
     
     with col1:
         if st.button("Copy to Clipboard", key="copy_clipboard"):
-            clean_text = re.sub(r'<[^>]*>', '', st.session_state.story_state["current_text"])
+            clean_text = story_plain_text(st.session_state.story_state["passages"])
             st.code(clean_text, language=None)
             st.success("Text copied! Use Ctrl+C or Cmd+C to copy from the box above.")
     
     with col2:
         # Generate download link for text file
-        clean_text = re.sub(r'<[^>]*>', '', st.session_state.story_state["current_text"])
+        clean_text = story_plain_text(st.session_state.story_state["passages"])
         st.download_button(
             label="Download as Text File",
             data=clean_text,
@@ -1028,6 +1152,57 @@ def show_ending():
             mime="text/plain",
             key="download_text"
         )
+    
+    # Attach narration now that the conclusion is on screen
+    render_narration(narration_job, narration_slot)
+
+# Performance panel: where turns spend their time, model usage and cache hit rates
+def show_admin_panel():
+    st.sidebar.markdown("---")
+    with st.sidebar.expander("📈 Performance", expanded=False):
+        stages = metrics.stage_summary()
+        if stages:
+            rows = ["| Stage | Count | p50 ms | p95 ms | Max ms |", "|---|---|---|---|---|"]
+            for stage, summary in sorted(stages.items(), key=lambda item: -item[1]["p95_ms"]):
+                rows.append(f"| {stage} | {summary['count']} | {summary['p50_ms']:.0f} | "
+                            f"{summary['p95_ms']:.0f} | {summary['max_ms']:.0f} |")
+            st.markdown("\n".join(rows))
+        else:
+            st.markdown("No timings recorded yet.")
+        
+        gauges = metrics.gauges()
+        prompt_tokens = sum(metrics.counter_totals("tale_weaver_prompt_tokens_total").values())
+        response_tokens = sum(metrics.counter_totals("tale_weaver_response_tokens_total").values())
+        structured_calls = sum(metrics.counter_totals("tale_weaver_structured_calls_total").values())
+        structured_reasks = sum(metrics.counter_totals("tale_weaver_structured_reasks_total").values())
+        structured_fallbacks = sum(metrics.counter_totals("tale_weaver_structured_fallbacks_total").values())
+        st.markdown(
+            f"*Model calls:* {gauges.get('tale_weaver_gemini_calls', 0)} "
+            f"({gauges.get('tale_weaver_gemini_failures', 0)} failed, "
+            f"{gauges.get('tale_weaver_gemini_retries', 0)} retries)  \n"
+            f"*Tokens (prompt / response):* {prompt_tokens} / {response_tokens}  \n"
+            f"*JSON responses:* {structured_calls} ({structured_reasks} re-asked, "
+            f"{structured_fallbacks} fell back)  \n"
+            f"*Response cache hit rate:* {gauges.get('tale_weaver_gemini_cache_hit_rate', 0):.0%}  \n"
+            f"*Audio cache hit rate:* {gauges.get('tale_weaver_audio_cache_hit_rate', 0):.0%}  \n"
+            f"*Starter pool:* {gauges.get('tale_weaver_starter_pool_ready', 0)} sets ready, "
+            f"{gauges.get('tale_weaver_starter_pool_empty', 0)} misses  \n"
+            f"*Recaps:* {gauges.get('tale_weaver_recaps_started', 0)} written, "
+            f"{gauges.get('tale_weaver_recaps_hits', 0)} reused  \n"
+            f"*Summaries:* {gauges.get('tale_weaver_summaries_applied', 0)} of "
+            f"{gauges.get('tale_weaver_summaries_started', 0)} used  \n"
+            f"*Call queue:* {gauges.get('tale_weaver_scheduler_running', 0)} running, "
+            f"{gauges.get('tale_weaver_scheduler_queue_depth', 0)} waiting "
+            f"(peak {gauges.get('tale_weaver_scheduler_max_waiting', 0)}), "
+            f"{gauges.get('tale_weaver_scheduler_rejected', 0)} background shed"
+        )
+        st.download_button(
+            "Download metrics (Prometheus)",
+            data=metrics.prometheus_text(),
+            file_name="tale_weaver_metrics.prom",
+            mime="text/plain",
+            key="download_metrics"
+        )
 
 # Sidebar content
 def show_sidebar():
@@ -1044,12 +1219,31 @@ def show_sidebar():
             
         if st.session_state.story_state["character_name"]:
             st.sidebar.markdown(f"*Protagonist:* {st.session_state.story_state['character_name']}")
+        
+        stats = calculate_story_stats(st.session_state.story_state)
+        st.sidebar.markdown(
+            f"*Length:* {stats['word_count']} words (~{stats['reading_time']} min) • "
+            f"{stats['passage_count']} passages • {stats['dialog_ratio']:.0%} dialog"
+        )
             
         # Show choices made
         if st.session_state.story_state["choices_made"]:
             with st.sidebar.expander("Your Journey So Far", expanded=False):
-                for i, choice in enumerate(st.session_state.story_state["choices_made"]):
-                    st.sidebar.markdown(f"{i+1}. {choice}")
+                # Choices of pages not loaded yet are left out but still counted
+                first = st.session_state.story_state.get("choice_offset", 0) + 1
+                for i, choice in enumerate(st.session_state.story_state["choices_made"], first):
+                    st.sidebar.markdown(f"{i}. {choice}")
+    
+    # Settings
+    st.sidebar.markdown("---")
+    st.session_state.speculative_mode = st.sidebar.checkbox(
+        "⚡ Pre-generate story paths",
+        value=st.session_state.get("speculative_mode", SPECULATIVE_GENERATION),
+        help="Write the next passage for every choice in the background so your pick appears instantly"
+    )
+    
+    if ADMIN_PANEL:
+        show_admin_panel()
     
     # Tips and information
     st.sidebar.markdown("---")
@@ -0,0 +1,105 @@
+# Content-addressed, size-bounded cache of narration audio on disk.
+# Files are named by a hash of (text, language, speed), so the same sentence
+# is synthesized once and then shared by every session. When the folder grows
+# past its size limit the least recently used files are removed.
+import hashlib
+import os
+import threading
+
+
+# Cache key for a piece of narration
+def audio_cache_key(text, lang='en', slow=False):
+    payload = f"{lang}\0{'slow' if slow else 'normal'}\0{text}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class AudioCache:
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+        # Current size of the folder, tracked so eviction never needs a full scan
+        self.total_bytes = sum(size for _, _, size in self._entries())
+
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}.mp3")
+
+    # True if the audio is cached; marks it as recently used
+    def lookup(self, key):
+        path = self.path(key)
+        try:
+            os.utime(path)
+        except OSError:
+            with self.lock:
+                self.misses += 1
+            return False
+        with self.lock:
+            self.hits += 1
+        return True
+
+    # Produce the file with write(temp_path) and publish it atomically, so a
+    # reader never sees a half-written file
+    def store(self, key, write):
+        path = self.path(key)
+        temp_path = f"{path}.{threading.get_ident()}.part"
+        try:
+            write(temp_path)
+            size = os.path.getsize(temp_path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        os.replace(temp_path, path)
+        with self.lock:
+            self.total_bytes += size
+            over_limit = self.total_bytes > self.max_bytes
+        if over_limit:
+            self.evict()
+        return path
+
+    # (mtime, path, size) of every cached file
+    def _entries(self):
+        entries = []
+        for filename in os.listdir(self.directory):
+            if not filename.endswith(".mp3"):
+                continue
+            file_path = os.path.join(self.directory, filename)
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, file_path, stat.st_size))
+        return entries
+
+    # Remove least recently used files until the cache is back to 90% of its limit
+    def evict(self):
+        with self.lock:
+            entries = sorted(self._entries())
+            total = sum(size for _, _, size in entries)
+            target = int(self.max_bytes * 0.9)
+            for _, file_path, size in entries:
+                if total <= target:
+                    break
+                try:
+                    os.remove(file_path)
+                except OSError:
+                    continue
+                total -= size
+                self.evictions += 1
+            self.total_bytes = total
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes
+            }
@@ -0,0 +1,239 @@
+# Text generation backends for story_engine.
+# A backend is any object with
+#     generate(prompt, temperature=None, max_output_tokens=None, cache=True,
+#              response_schema=None) -> str
+#     generate_stream(prompt, temperature=None, max_output_tokens=None,
+#                     response_schema=None) -> iterator of str
+#     stats() -> dict
+# The shared GeminiClient is the real one. FakeBackend is a deterministic local
+# stand-in for tests, benchmarks and offline runs: it answers each kind of
+# prompt in the shape the real model does, with configurable latency,
+# failures and malformed responses.
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+
+from metrics import metrics
+from resilience import call_with_retries
+
+# Text that identifies each kind of prompt built in prompts.py
+PROMPT_KINDS = [
+    ("turn", '"passage"'),
+    ("starters", "story starters"),
+    ("choices", "distinct choices"),
+    ("summary", "running summary"),
+    ("recap", "brief recap"),
+    ("ending", "satisfying conclusion"),
+]
+
+# Ways JSON-mode list responses still go wrong in practice: too few items, a
+# blank item, or output cut off at the token limit. structured_output re-asks.
+MALFORMED_SHAPES = ("too_few", "empty_item", "truncated")
+
+WORDS = ("the lantern flickered as they stepped into the hall where shadows gathered "
+         "beneath an old map of the harbor and a door creaked somewhere below the stair").split()
+LINES = ["Who is there?", "We should not be here.", "Keep moving, quickly.", "Did you hear that?"]
+
+
+# Raised when more calls are in flight than the fake's capacity, like a
+# provider's 429 (retryable)
+class FakeRateLimitError(Exception):
+    code = 429
+
+
+def prompt_kind(prompt):
+    for kind, marker in PROMPT_KINDS:
+        if marker in prompt:
+            return kind
+    return "passage"
+
+
+class FakeBackend:
+    # latency: seconds per call (plus up to latency_jitter more)
+    # failure_rate: chance a call raises ConnectionError
+    # malformed_rate: chance a list response is malformed or a continuation
+    #     ends with embedded choices
+    # retry_policy: if given, failed calls are retried like GeminiClient does
+    # scheduler: if given, each attempt takes a slot from it like GeminiClient
+    # capacity: calls the fake serves at once; more are rejected with a 429
+    def __init__(self, seed=0, latency=0.0, latency_jitter=0.0, failure_rate=0.0, malformed_rate=0.0,
+                 passage_words=170, retry_policy=None, scheduler=None, capacity=None, sleep=time.sleep):
+        self.seed = seed
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.failure_rate = failure_rate
+        self.malformed_rate = malformed_rate
+        self.passage_words = passage_words
+        self.retry_policy = retry_policy
+        self.scheduler = scheduler
+        self.capacity = capacity
+        self.in_flight = 0
+        self.rate_limited = 0
+        self.sleep = sleep
+        self._lock = threading.Lock()
+        self._seen = {}
+        self.calls = 0
+        self.failures = 0
+        self.retries = 0
+        self.malformed = 0
+        self.prompt_chars = 0
+        self.max_prompt_chars = 0
+        self.response_chars = 0
+        self.kinds = {}
+
+    # Random source for one call. It depends only on the seed, the prompt and
+    # how many times that prompt was sent before, so results don't depend on
+    # how concurrent calls interleave.
+    def _rng(self, prompt):
+        with self._lock:
+            occurrence = self._seen.get(prompt, 0)
+            self._seen[prompt] = occurrence + 1
+        digest = hashlib.sha256(f"{self.seed}:{occurrence}:{prompt}".encode("utf-8")).digest()
+        return random.Random(int.from_bytes(digest[:8], "big"))
+
+    def _sentence(self, rng):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(8, 16))]
+        sentence = " ".join(words).capitalize() + "."
+        if rng.random() < 0.3:
+            sentence += f' "{rng.choice(LINES)}"'
+        return sentence
+
+    def _prose(self, rng, words):
+        sentences = []
+        while sum(len(s.split()) for s in sentences) < words:
+            sentences.append(self._sentence(rng))
+        return " ".join(sentences)
+
+    def _list_response(self, rng, items):
+        if rng.random() >= self.malformed_rate:
+            return json.dumps(items)
+        with self._lock:
+            self.malformed += 1
+        shape = rng.choice(MALFORMED_SHAPES)
+        if shape == "too_few":
+            return json.dumps(items[:-1])
+        if shape == "empty_item":
+            return json.dumps(items[:-1] + [""])
+        return json.dumps(items)[:-len(items[-1]) // 2]
+
+    def _respond(self, prompt, max_output_tokens):
+        if self.scheduler is None:
+            return self._serve(prompt, max_output_tokens)
+        with self.scheduler.slot("fake"):
+            return self._serve(prompt, max_output_tokens)
+
+    def _serve(self, prompt, max_output_tokens):
+        with self._lock:
+            if self.capacity is not None and self.in_flight >= self.capacity:
+                self.rate_limited += 1
+                raise FakeRateLimitError("Fake backend: too many concurrent requests")
+            self.in_flight += 1
+        try:
+            return self._answer(prompt, max_output_tokens)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def _answer(self, prompt, max_output_tokens):
+        rng = self._rng(prompt)
+        kind = prompt_kind(prompt)
+        with self._lock:
+            self.calls += 1
+            self.prompt_chars += len(prompt)
+            self.max_prompt_chars = max(self.max_prompt_chars, len(prompt))
+            self.kinds[kind] = self.kinds.get(kind, 0) + 1
+
+        delay = self.latency + rng.random() * self.latency_jitter
+        if delay > 0:
+            self.sleep(delay)
+        if rng.random() < self.failure_rate:
+            with self._lock:
+                self.failures += 1
+            raise ConnectionError("Fake backend: simulated failure")
+
+        if kind == "starters":
+            response = self._list_response(rng, [self._prose(rng, 35) for _ in range(3)])
+        elif kind == "choices":
+            response = self._list_response(rng, [self._sentence(rng) for _ in range(3)])
+        elif kind == "turn":
+            fields = {"passage": json.dumps(self._prose(rng, self.passage_words)),
+                      "paths": self._list_response(rng, [self._sentence(rng) for _ in range(3)])}
+            # Properties in alphabetical order, as Gemini writes them
+            response = "{" + ", ".join(f'"{name}": {value}' for name, value in sorted(fields.items())) + "}"
+        elif kind in ("summary", "recap"):
+            response = self._prose(rng, 60)
+        else:
+            words = self.passage_words * 3 // 2 if kind == "ending" else self.passage_words
+            response = self._prose(rng, words)
+            if kind == "passage" and rng.random() < self.malformed_rate:
+                with self._lock:
+                    self.malformed += 1
+                response += "\n\nWhat will you do?\n1. Open the door.\n2. Run away.\n3. Call out."
+        if max_output_tokens:
+            # Roughly four characters per token, like the real limit
+            response = response[:max_output_tokens * 4]
+
+        with self._lock:
+            self.response_chars += len(response)
+        metrics.record_call(prompt, response)
+        return response
+
+    def _count_retry(self, attempt, error):
+        with self._lock:
+            self.retries += 1
+        metrics.count("tale_weaver_model_retries_total", stage=metrics.current_stage())
+
+    def generate(self, prompt, temperature=None, max_output_tokens=None, model_name=None, cache=True,
+                 response_schema=None):
+        call = lambda: self._respond(prompt, max_output_tokens)
+        if self.retry_policy is None:
+            return call()
+        return call_with_retries(call, self.retry_policy, sleep=self.sleep, on_retry=self._count_retry)
+
+    def generate_stream(self, prompt, temperature=None, max_output_tokens=None, model_name=None,
+                        response_schema=None):
+        words = self.generate(prompt, temperature, max_output_tokens).split(" ")
+        for start in range(0, len(words), 8):
+            yield " ".join(words[start:start + 8]) + (" " if start + 8 < len(words) else "")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "failures": self.failures,
+                "retries": self.retries,
+                "malformed": self.malformed,
+                "rate_limited": self.rate_limited,
+                "avg_prompt_chars": self.prompt_chars / self.calls if self.calls else 0.0,
+                "max_prompt_chars": self.max_prompt_chars,
+                "response_chars": self.response_chars,
+                "kinds": dict(self.kinds)
+            }
+
+
+# The shared Gemini client, configured from the environment like the app
+def gemini_backend(**options):
+    from dotenv import load_dotenv
+    from gemini_client import get_gemini_client
+
+    load_dotenv()
+    return get_gemini_client(
+        os.getenv("GEMINI_API_KEY"),
+        cache_ttl=int(os.getenv("RESPONSE_CACHE_TTL", "3600")),
+        max_concurrent=int(os.getenv("GEMINI_MAX_CONCURRENT", "8")),
+        rate_per_minute=int(os.getenv("GEMINI_RATE_PER_MINUTE", "0"))
+    )
+
+def fake_backend(**options):
+    return FakeBackend(**options)
+
+# Backends by name; each factory takes keyword options (ignored by gemini)
+BACKENDS = {"gemini": gemini_backend, "fake": fake_backend}
+
+def make_backend(name, **options):
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend: {name}")
+    return BACKENDS[name](**options)
@@ -0,0 +1,93 @@
+# clean_story_text: the original multi-pass regex cleaner vs the precompiled
+# block cleaner, on stories of increasing length. Also checks both give the
+# same output.
+# Run from the repository root: python benchmarks/clean_text.py
+import os
+import random
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from text_cleaning import clean_story_text
+
+WORD_COUNTS = [1000, 5000, 10000]
+REPEATS = 5
+
+
+# The cleaner as it was in app.py
+def legacy_clean_story_text(text):
+    patterns = [
+        r'(?:Option|Choice)\s+[A-Za-z0-9]+\s*:\s*.*?(?=(?:Option|Choice)|$)',
+        r'\d+\.\s+.*?(?=\d+\.|$)',
+        r'•\s+.*?(?=•|$)'
+    ]
+
+    cleaned_text = text
+    for pattern in patterns:
+        cleaned_text = re.sub(pattern, '', cleaned_text, flags=re.DOTALL)
+
+    cleaned_text = re.sub(r'^\s*\d+\.\s+', '', cleaned_text, flags=re.MULTILINE)
+
+    prompts_to_remove = [
+        r'What will you do\?',
+        r'What do you do next\?',
+        r'What happens next\?',
+        r'What choice will you make\?',
+        r'Choose your next action.',
+        r'What would you like to do\?'
+    ]
+
+    for prompt in prompts_to_remove:
+        cleaned_text = re.sub(prompt, '', cleaned_text)
+
+    return cleaned_text.strip()
+
+
+# Story prose with the occasional embedded prompt, plus a model reply that
+# ends in a numbered list of choices
+def make_story(words, seed=0):
+    rng = random.Random(seed)
+    vocabulary = ("the lantern flickered as Mara stepped into the hall and "
+                  "whispered \"Who is there?\" before the door creaked open").split()
+    out = []
+    for i in range(words):
+        out.append(rng.choice(vocabulary))
+        if i % 40 == 39:
+            out[-1] += "."
+        if i % 500 == 499:
+            out.append("What will you do?")
+    return " ".join(out)
+
+
+def make_reply(seed=0):
+    return make_story(180, seed) + "\n\n1. Open the door.\n2. Run away.\n3. Call out.\nWhat happens next?"
+
+
+def main():
+    samples = [make_reply(seed) for seed in range(20)] + [make_story(2000) + " • a • b Option A: go Choice 2: stay"]
+    for sample in samples + ["12.1.\n.:x\n\n", "2.•\n\n::\n"]:
+        assert legacy_clean_story_text(sample) == clean_story_text(sample)
+
+    print(f"{'words':>6} {'legacy ms':>10} {'new ms':>8} {'speedup':>8}")
+    for words in WORD_COUNTS:
+        story = make_story(words)
+        legacy = min(timeit.repeat(lambda: legacy_clean_story_text(story), number=1, repeat=REPEATS)) * 1000
+        new = min(timeit.repeat(lambda: clean_story_text(story), number=1, repeat=REPEATS)) * 1000
+        print(f"{words:>6} {legacy:>10.2f} {new:>8.2f} {legacy / new:>7.1f}x")
+
+    # A list marker near the start makes the legacy lazy scan run to the end
+    story = "1. " + make_story(WORD_COUNTS[-1])
+    legacy = min(timeit.repeat(lambda: legacy_clean_story_text(story), number=1, repeat=REPEATS)) * 1000
+    new = min(timeit.repeat(lambda: clean_story_text(story), number=1, repeat=REPEATS)) * 1000
+    print(f"{WORD_COUNTS[-1]:>6} {legacy:>10.2f} {new:>8.2f} {legacy / new:>7.1f}x  (early list marker)")
+
+    # Per turn the app now cleans only the new passage, not the whole story
+    reply = make_reply()
+    passage = min(timeit.repeat(lambda: clean_story_text(reply), number=1, repeat=REPEATS)) * 1000
+    print(f"new passage only (~180 words): {passage:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+# End-to-end numbers against the local fake backend, for comparing before and
+# after an optimization:
+#   - per-turn engine time and prompt size as a story gets longer
+#   - model calls and prompt size per turn, combined vs separate turn calls
+#   - save (one turn appended), full load and resume time by story length
+#   - saved-story list time by catalog size
+#   - turn latency and throughput with several players at once
+# Run from the repository root: python benchmarks/end_to_end.py [--quick] [--json results.json]
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backends import FakeBackend
+from passages import add_passage
+from resilience import RetryPolicy
+from story_catalog import UPSERT, catalog_row, connect, count_stories, list_stories
+from story_engine import new_story_state, play_story, random_choice
+from story_store import load_story, resume_story, save_story_log
+
+REPEATS = 5
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+# Play one story and time every turn; save() is called after each turn
+def timed_story(backend, turns, seed=0):
+    marks = [time.monotonic()]
+    prompt_chars = [0]
+
+    def save(story_state):
+        marks.append(time.monotonic())
+        prompt_chars.append(backend.prompt_chars)
+
+    play_story(backend, "Fantasy", random_choice(seed), turns=turns, save=save)
+    # marks[i] is the end of turn i (the first also includes the starter, the
+    # last one is the ending), so turn_ms[k] is turn k + 2
+    turn_ms = [(marks[i + 1] - marks[i]) * 1000 for i in range(1, turns)]
+    turn_prompts = [prompt_chars[i + 1] - prompt_chars[i] for i in range(1, turns)]
+    return turn_ms, turn_prompts
+
+def turn_modes(turns, latency):
+    print(f"\nPer turn, combined vs separate passage and choices calls ({latency * 1000:.0f} ms backend latency,"
+          f" all model calls counted)")
+    print(f"{'mode':>9} {'calls':>6} {'prompt chars':>13} {'p50 ms':>8}")
+    rows = []
+    for combined in (False, True):
+        backend = FakeBackend(seed=5, latency=latency)
+        marks = []
+        counts = []
+
+        def save(story_state):
+            marks.append(time.monotonic())
+            counts.append((backend.calls, backend.prompt_chars))
+
+        play_story(backend, "Fantasy", random_choice(0), turns=turns, save=save, combined=combined)
+        # Turns 2..turns-1: past the first choices, before the last turn. Calls
+        # and prompt chars count every model call, including the memory
+        # summaries (the same in both modes)
+        calls = (counts[turns - 2][0] - counts[0][0]) / (turns - 2)
+        turn_ms = [(marks[i + 1] - marks[i]) * 1000 for i in range(turns - 2)]
+        row = {
+            "mode": "combined" if combined else "separate",
+            "calls_per_turn": calls,
+            "prompt_chars_per_turn": (counts[turns - 2][1] - counts[0][1]) / (turns - 2),
+            "p50_ms": statistics.median(turn_ms)
+        }
+        rows.append(row)
+        print(f"{row['mode']:>9} {calls:>6.1f} {row['prompt_chars_per_turn']:>13.0f} {row['p50_ms']:>8.1f}")
+    return rows
+
+def turn_growth(turns):
+    backend = FakeBackend(seed=1)
+    turn_ms, turn_prompts = timed_story(backend, turns)
+    print(f"\nPer turn, one story of {turns} turns (no backend latency)")
+    print(f"{'turn':>5} {'engine ms':>10} {'prompt chars':>13}")
+    rows = []
+    for turn in sorted({2, 5, 10, turns // 2, turns}):
+        if 2 <= turn <= turns:
+            row = {"turn": turn, "engine_ms": turn_ms[turn - 2], "prompt_chars": turn_prompts[turn - 2]}
+            rows.append(row)
+            print(f"{turn:>5} {row['engine_ms']:>10.2f} {row['prompt_chars']:>13}")
+    return rows
+
+# A story of the given number of turns built without the backend
+def make_story(turns):
+    backend = FakeBackend(seed=2)
+    story_state = new_story_state("Fantasy", stage="story")
+    add_passage(story_state, "beginning", backend.generate("starter passage"))
+    for turn in range(turns):
+        add_passage(story_state, "choice", f"Take the stair {turn}")
+        add_passage(story_state, "continuation", backend.generate(f"passage {turn}"))
+        story_state["story_turns"] += 1
+    return story_state
+
+def save_and_load(lengths):
+    directory = tempfile.mkdtemp()
+    print("\nSave, full load and resume (header + latest passages) by story length")
+    print(f"{'turns':>6} {'save ms':>8} {'load ms':>8} {'resume ms':>10}")
+    rows = []
+    for turns in lengths:
+        story_state = make_story(turns)
+        filename = save_story_log(story_state, directory)
+
+        # Time the save of one more turn, as the app does after every choice
+        save_times = []
+        for repeat in range(REPEATS):
+            add_passage(story_state, "choice", "Keep going")
+            add_passage(story_state, "continuation", "The stair went on and on.")
+            started = time.perf_counter()
+            save_story_log(story_state, directory)
+            save_times.append(time.perf_counter() - started)
+
+        load_times = []
+        for repeat in range(REPEATS):
+            started = time.perf_counter()
+            load_story(os.path.join(directory, filename))
+            load_times.append(time.perf_counter() - started)
+
+        resume_times = []
+        for repeat in range(REPEATS):
+            started = time.perf_counter()
+            resume_story(os.path.join(directory, filename))
+            resume_times.append(time.perf_counter() - started)
+
+        row = {"turns": turns, "save_ms": min(save_times) * 1000, "load_ms": min(load_times) * 1000,
+               "resume_ms": min(resume_times) * 1000}
+        rows.append(row)
+        print(f"{turns:>6} {row['save_ms']:>8.2f} {row['load_ms']:>8.2f} {row['resume_ms']:>10.2f}")
+    return rows
+
+def catalog_listing(sizes):
+    print("\nSaved-story list by catalog size (first page of 10 + count)")
+    print(f"{'stories':>8} {'list ms':>8}")
+    rows = []
+    for size in sizes:
+        directory = tempfile.mkdtemp()
+        story_state = make_story(1)
+        entries = []
+        for i in range(size):
+            story_state["story_id"] = f"story-{i}"
+            entries.append(catalog_row(story_state, f"story-{i}.jsonl", float(i)))
+        with connect(directory) as connection:
+            connection.executemany(UPSERT, entries)
+        connection.close()
+
+        times = []
+        for repeat in range(REPEATS):
+            started = time.perf_counter()
+            list_stories(limit=10, offset=0, directory=directory)
+            count_stories(directory)
+            times.append(time.perf_counter() - started)
+        row = {"stories": size, "list_ms": min(times) * 1000}
+        rows.append(row)
+        print(f"{size:>8} {row['list_ms']:>8.2f}")
+    return rows
+
+def concurrent_players(user_counts, turns, latency):
+    print(f"\nConcurrent players, {turns} turns each, {latency * 1000:.0f} ms backend latency, "
+          f"5% failures (retried), 10% malformed")
+    print(f"{'users':>6} {'p50 ms':>8} {'p95 ms':>8} {'turns/s':>8} {'retries':>8}")
+    rows = []
+    for users in user_counts:
+        backend = FakeBackend(seed=3, latency=latency, latency_jitter=latency / 2, failure_rate=0.05,
+                              malformed_rate=0.1, retry_policy=RetryPolicy(base_delay=latency, max_delay=latency * 4))
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=users) as executor:
+            results = list(executor.map(lambda i: timed_story(backend, turns, seed=i)[0], range(users)))
+        elapsed = time.monotonic() - started
+        turn_ms = [ms for story in results for ms in story]
+        row = {
+            "users": users,
+            "p50_ms": statistics.median(turn_ms),
+            "p95_ms": percentile(turn_ms, 0.95),
+            "turns_per_second": users * turns / elapsed,
+            "retries": backend.stats()["retries"]
+        }
+        rows.append(row)
+        print(f"{users:>6} {row['p50_ms']:>8.1f} {row['p95_ms']:>8.1f} {row['turns_per_second']:>8.1f} {row['retries']:>8}")
+    return rows
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog="end_to_end.py")
+    parser.add_argument("--quick", action="store_true", help="smaller sizes for a fast check")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args(argv)
+
+    results = {
+        "turn_growth": turn_growth(10 if args.quick else 30),
+        "turn_modes": turn_modes(6 if args.quick else 10, 0.02),
+        "save_and_load": save_and_load([10, 50] if args.quick else [10, 100, 500]),
+        "catalog_listing": catalog_listing([100, 1000] if args.quick else [100, 1000, 10000]),
+        "concurrent_players": concurrent_players([1, 4] if args.quick else [1, 4, 16], 5, 0.02)
+    }
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nWrote {args.json}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
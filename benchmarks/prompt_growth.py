@@ -0,0 +1,46 @@
+# Prompt size per turn: full story text (old behaviour) vs rolling story memory.
+# Run from the repository root: python benchmarks/prompt_growth.py
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from prompts import build_choices_prompt, build_continue_prompt
+from story_memory import new_story_memory, update_story_memory, build_story_context
+
+TURNS = 10
+PASSAGE_WORDS = 180
+
+
+# Deterministic stand-in for a ~180 word Gemini passage
+def fake_passage(turn):
+    sentence = f"On turn {turn} the hero pressed on through the dark and said \"We keep going.\" "
+    words = []
+    while len(words) < PASSAGE_WORDS:
+        words.extend(sentence.split())
+    return " ".join(words[:PASSAGE_WORDS])
+
+
+def main():
+    genre, character = "Fantasy", "Ayla"
+    full_text = fake_passage(0)
+    memory = new_story_memory()
+    update_story_memory(memory, full_text)
+
+    print(f"{'turn':>4} {'old prompt bytes':>17} {'new prompt bytes':>17}")
+    for turn in range(1, TURNS + 1):
+        action = f"Choice number {turn}"
+        old_bytes = len(build_choices_prompt(full_text, genre, character).encode()) + \
+            len(build_continue_prompt(full_text, action, genre, character).encode())
+        context = build_story_context(memory)
+        new_bytes = len(build_choices_prompt(context, genre, character).encode()) + \
+            len(build_continue_prompt(context, action, genre, character).encode())
+        print(f"{turn:>4} {old_bytes:>17} {new_bytes:>17}")
+
+        passage = fake_passage(turn)
+        full_text += f"\n\n<div class='choice-marker'>You chose: {action}</div>\n\n{passage}"
+        update_story_memory(memory, f"You chose: {action}\n\n{passage}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+# Story view rendering per rerun: formatting the whole story text (as the app
+# used to) vs the render cache, for stories of increasing length. "idle" is a
+# rerun with no new passage (most button clicks), "new" is a rerun right
+# after a turn added a choice and a continuation.
+# Run from the repository root: python benchmarks/render_cache.py
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from passages import StoryRenderCache, make_passage, story_html
+
+PASSAGE_COUNTS = [10, 100, 1000]
+REPEATS = 5
+
+PASSAGE = ("The lantern flickered as Mara stepped into the hall. \"Who is there?\" "
+           "she whispered, and the door creaked open onto the dark stair. ") * 6
+
+
+def make_passages(turns):
+    passages = [make_passage("beginning", PASSAGE)]
+    for turn in range(turns):
+        passages.append(make_passage("choice", f"Follow the stair {turn}"))
+        passages.append(make_passage("continuation", PASSAGE))
+    return passages
+
+
+# The view as show_story used to build it: dialog regex over current_text
+def legacy_render(current_text):
+    return re.sub(r'"([^"]*)"', r'<span class="dialog">"\1"</span>', current_text)
+
+
+def main():
+    print(f"{'passages':>8} {'legacy ms':>10} {'idle ms':>8} {'new ms':>8}")
+    for count in PASSAGE_COUNTS:
+        passages = make_passages(count // 2)
+        current_text = "".join(
+            f"\n\n<div class='choice-marker'>You chose: {p['text']}</div>\n\n" if p["type"] == "choice" else p["text"]
+            for p in passages
+        )
+        legacy = min(timeit.repeat(lambda: legacy_render(current_text), number=1, repeat=REPEATS)) * 1000
+
+        cache = StoryRenderCache()
+        cache.render("bench", passages)
+        assert cache.html == story_html(passages)
+        idle = min(timeit.repeat(lambda: cache.render("bench", passages), number=1, repeat=REPEATS)) * 1000
+
+        # Time only the turn: each measurement starts from a cache two passages behind
+        def new_turn():
+            cache.parts = cache.parts[:-2]
+            cache.html = "".join(cache.parts)
+            start = timeit.default_timer()
+            cache.render("bench", passages)
+            return timeit.default_timer() - start
+        new = min(new_turn() for _ in range(REPEATS)) * 1000
+        print(f"{len(passages):>8} {legacy:>10.3f} {idle:>8.4f} {new:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
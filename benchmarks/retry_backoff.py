@@ -0,0 +1,66 @@
+# Time users spend waiting during an API outage: the old fixed 2s retry loop
+# vs jittered backoff with a shared circuit breaker. Uses a fake upstream and
+# a simulated clock, so it runs instantly and offline.
+# Run from the repository root: python benchmarks/retry_backoff.py
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from resilience import CircuitBreaker, RetryPolicy, call_with_retries
+
+REQUESTS = 20
+
+
+# Upstream that answers every call with HTTP 503
+class UnavailableError(Exception):
+    code = 503
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def outage_call(calls):
+    calls[0] += 1
+    raise UnavailableError("service unavailable")
+
+
+# The loop generate_with_gemini used before: 3 attempts, 2 seconds apart
+def old_policy(clock, calls):
+    for attempt in range(3):
+        try:
+            return outage_call(calls)
+        except Exception:
+            if attempt < 2:
+                clock.sleep(2)
+    return None
+
+
+def main():
+    clock, calls = FakeClock(), [0]
+    for _ in range(REQUESTS):
+        old_policy(clock, calls)
+    print(f"fixed retries:   {calls[0]:>3} upstream calls, {clock.now:6.1f}s total wait for {REQUESTS} requests")
+
+    clock, calls = FakeClock(), [0]
+    breaker = CircuitBreaker(clock=clock)
+    policy = RetryPolicy()
+    for _ in range(REQUESTS):
+        try:
+            call_with_retries(lambda: outage_call(calls), policy, breaker, sleep=clock.sleep)
+        except Exception:
+            pass
+    print(f"backoff+breaker: {calls[0]:>3} upstream calls, {clock.now:6.1f}s total wait for {REQUESTS} requests "
+          f"(breaker {breaker.state}, {breaker.rejected} calls rejected without waiting)")
+
+
+if __name__ == "__main__":
+    main()
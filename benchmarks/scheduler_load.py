@@ -0,0 +1,92 @@
+# Model call latency during a traffic spike, with and without the scheduler.
+# Players make interactive calls one after another while background work
+# (speculative branches) floods in. The fake upstream serves CAPACITY calls at
+# once and answers the rest with a 429, which the client retries with backoff.
+# Run from the repository root: python benchmarks/scheduler_load.py
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backends import FakeBackend
+from resilience import RetryPolicy
+from scheduler import BACKGROUND, Scheduler
+
+PLAYERS = 12
+CALLS_PER_PLAYER = 6
+BACKGROUND_PER_CALL = 3
+CAPACITY = 4
+LATENCY = 0.05
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def run(scheduler):
+    backend = FakeBackend(seed=5, latency=LATENCY, latency_jitter=LATENCY / 2, capacity=CAPACITY,
+                          retry_policy=RetryPolicy(max_attempts=5, base_delay=0.05, max_delay=1.0),
+                          scheduler=scheduler)
+    interactive = []
+    failures = {"interactive": 0, "background": 0}
+    lock = threading.Lock()
+    background_pool = ThreadPoolExecutor(max_workers=PLAYERS * BACKGROUND_PER_CALL)
+
+    def background_call(prompt):
+        try:
+            if scheduler is None:
+                backend.generate(prompt)
+            else:
+                with scheduler.priority(BACKGROUND):
+                    backend.generate(prompt)
+        except Exception:
+            with lock:
+                failures["background"] += 1
+
+    def player(index):
+        for call in range(CALLS_PER_PLAYER):
+            for branch in range(BACKGROUND_PER_CALL):
+                background_pool.submit(background_call, f"branch {index} {call} {branch}")
+            started = time.monotonic()
+            try:
+                backend.generate(f"passage {index} {call}")
+            except Exception:
+                with lock:
+                    failures["interactive"] += 1
+                continue
+            with lock:
+                interactive.append(time.monotonic() - started)
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=PLAYERS) as players:
+        list(players.map(player, range(PLAYERS)))
+    interactive_elapsed = time.monotonic() - started
+    background_pool.shutdown(wait=True)
+    return {
+        "p50": statistics.median(interactive) * 1000 if interactive else 0.0,
+        "p95": percentile(interactive, 0.95) * 1000 if interactive else 0.0,
+        "max": max(interactive) * 1000 if interactive else 0.0,
+        "failed": failures["interactive"],
+        "background_failed": failures["background"],
+        "rate_limited": backend.stats()["rate_limited"],
+        "seconds": interactive_elapsed
+    }
+
+
+def main():
+    print(f"{PLAYERS} players x {CALLS_PER_PLAYER} calls, {BACKGROUND_PER_CALL} background calls each, "
+          f"upstream capacity {CAPACITY}, {LATENCY * 1000:.0f} ms latency")
+    print(f"{'':>12} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8} {'failed':>7} {'bg failed/shed':>15} {'429s':>6}")
+    for name, scheduler in [("direct", None), ("scheduled", Scheduler(max_concurrent=CAPACITY, max_background=8))]:
+        result = run(scheduler)
+        print(f"{name:>12} {result['p50']:>8.0f} {result['p95']:>8.0f} {result['max']:>8.0f} "
+              f"{result['failed']:>7} {result['background_failed']:>15} {result['rate_limited']:>6}")
+
+
+if __name__ == "__main__":
+    main()
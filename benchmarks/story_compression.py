@@ -0,0 +1,102 @@
+# Story log size, save, load and resume time for each compression, by story
+# length. Stories are saved turn by turn as the app does (one frame per save),
+# then converted with convert_story_log (one frame per page).
+# Two kinds of text: the fake backend's prose, which uses a few dozen words
+# and compresses far better than real stories, and words drawn from a
+# 5,000-word vocabulary with English-like frequencies, which is closer to
+# model output.
+# Run from the repository root: python benchmarks/story_compression.py [--quick]
+import argparse
+import os
+import random
+import shutil
+import string
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backends import FakeBackend
+from passages import add_passage
+from story_codecs import available_codecs
+from story_engine import new_story_state
+from story_store import convert_story_log, load_story, resume_story, save_story_log
+
+REPEATS = 3
+PASSAGE_WORDS = 170
+
+
+def fake_text(seed):
+    backend = FakeBackend(seed=seed, passage_words=PASSAGE_WORDS)
+    return lambda turn: backend.generate(f"passage {turn}")
+
+def varied_text(seed):
+    rng = random.Random(seed)
+    vocabulary = ["".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(2, 9)))
+                  for _ in range(5000)]
+    # Zipf-like: the word of rank r is used in proportion to 1 / r
+    weights = [1 / rank for rank in range(1, len(vocabulary) + 1)]
+
+    def passage(turn):
+        words = rng.choices(vocabulary, weights, k=PASSAGE_WORDS)
+        sentences = [" ".join(words[i:i + 15]).capitalize() + "." for i in range(0, len(words), 15)]
+        return " ".join(sentences)
+    return passage
+
+# Save a story of the given length turn by turn; returns (path, ms per save)
+def build_story(directory, turns, compression, text):
+    story_state = new_story_state("Fantasy", stage="story")
+    add_passage(story_state, "beginning", text(-1))
+    save_times = []
+    for turn in range(turns):
+        add_passage(story_state, "choice", f"Take the stair {turn}")
+        add_passage(story_state, "continuation", text(turn))
+        story_state["story_turns"] += 1
+        started = time.perf_counter()
+        filename = save_story_log(story_state, directory, compression)
+        save_times.append(time.perf_counter() - started)
+    return os.path.join(directory, filename), sum(save_times) / len(save_times) * 1000
+
+def best_ms(fn):
+    times = []
+    for repeat in range(REPEATS):
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    return min(times) * 1000
+
+def compare(lengths, text_name, make_text):
+    print(f"\n{text_name}")
+    print(f"{'turns':>6} {'codec':>6} {'KB':>8} {'ratio':>6} {'paged KB':>9} {'ratio':>6} "
+          f"{'save ms':>8} {'load ms':>8} {'resume ms':>10}")
+    for turns in lengths:
+        plain_size = None
+        for compression in available_codecs():
+            directory = tempfile.mkdtemp()
+            try:
+                path, save_ms = build_story(directory, turns, compression, make_text(turns))
+                size = os.path.getsize(path)
+                plain_size = plain_size or size
+                load_ms = best_ms(lambda: load_story(path))
+                resume_ms = best_ms(lambda: resume_story(path))
+                paged_path = os.path.join(directory, convert_story_log(path, compression))
+                paged_size = os.path.getsize(paged_path)
+            finally:
+                shutil.rmtree(directory)
+            print(f"{turns:>6} {compression:>6} {size / 1024:>8.1f} {plain_size / size:>6.1f} "
+                  f"{paged_size / 1024:>9.1f} {plain_size / paged_size:>6.1f} "
+                  f"{save_ms:>8.2f} {load_ms:>8.2f} {resume_ms:>10.2f}")
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog="story_compression.py")
+    parser.add_argument("--quick", action="store_true", help="smaller stories for a fast check")
+    args = parser.parse_args(argv)
+    lengths = [10, 50] if args.quick else [10, 100, 500]
+    compare(lengths, "Fake backend prose (compresses unrealistically well)", fake_text)
+    compare(lengths, "Varied vocabulary (closer to real stories)", varied_text)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
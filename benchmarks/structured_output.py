@@ -0,0 +1,90 @@
+# List responses: the old free-text safe_json_parse fallbacks vs the JSON-mode
+# parse_response path, then re-ask and fallback rates for whole stories
+# against the fake backend at increasing malformed rates.
+# Run from the repository root: python benchmarks/structured_output.py
+import json
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backends import FakeBackend
+from metrics import metrics
+from story_engine import play_story, random_choice
+from structured_output import STRING_LIST_SCHEMA, SchemaError, at_least, parse_response
+
+REPEATS = 5
+NUMBER = 2000
+STORIES = 20
+
+CHOICES = ["Open the door slowly.", "Call out into the dark hall.", "Follow the map toward the harbor."]
+
+# Free-text responses as the model returned them before JSON mode
+FREE_TEXT = {
+    "clean": json.dumps(CHOICES),
+    "fenced": "```json\n" + json.dumps(CHOICES, indent=2) + "\n```",
+    "prose": "Here are some options:\n" + json.dumps(CHOICES) + "\nLet me know if you want more.",
+    "numbered": "\n" + "\n".join(f"{i + 1}. {choice}" for i, choice in enumerate(CHOICES)),
+}
+
+
+# The parser as it was in story_engine.py
+def legacy_safe_json_parse(text):
+    try:
+        return json.loads(text)
+    except:
+        json_match = re.search(r'\[\s*".*"\s*\]', text, re.DOTALL)
+        if json_match:
+            try:
+                return json.loads(json_match.group(0))
+            except:
+                pass
+        items = re.findall(r'"([^"]*)"', text)
+        if items and len(items) > 0:
+            return items
+        fallback_items = re.split(r'\n\s*(?:\d+\.|\*)\s*', text)
+        fallback_items = [s.strip() for s in fallback_items if s.strip()]
+        return fallback_items
+
+def best_us(statement):
+    return min(timeit.repeat(statement, number=NUMBER, repeat=REPEATS)) / NUMBER * 1e6
+
+def parse_cost():
+    print("Parse cost per response (us)")
+    print(f"{'response':>10} {'legacy':>8} {'json mode':>10}")
+    check = at_least(3)
+    for shape, text in FREE_TEXT.items():
+        legacy = best_us(lambda: legacy_safe_json_parse(text))
+        if shape == "clean":
+            structured = f"{best_us(lambda: parse_response(text, STRING_LIST_SCHEMA, check)):>10.2f}"
+        else:
+            # JSON mode doesn't produce these; the validator rejects them at once
+            try:
+                parse_response(text, STRING_LIST_SCHEMA, check)
+                structured = "accepted"
+            except SchemaError:
+                structured = "re-ask"
+        print(f"{shape:>10} {legacy:>8.2f} {structured:>10}")
+
+def story_rates(malformed_rates):
+    print(f"\n{STORIES} stories of 5 turns against the fake backend")
+    print(f"{'malformed':>10} {'list calls':>11} {'re-asks':>8} {'fallbacks':>10} {'calls/story':>12}")
+    for rate in malformed_rates:
+        metrics.counters.clear()
+        backend = FakeBackend(seed=4, malformed_rate=rate)
+        for seed in range(STORIES):
+            try:
+                play_story(backend, "Mystery", random_choice(seed), turns=5)
+            except SchemaError:
+                pass
+        totals = {name: sum(metrics.counter_totals(f"tale_weaver_structured_{name}_total").values())
+                  for name in ("calls", "reasks", "fallbacks")}
+        print(f"{rate:>10.0%} {totals['calls']:>11} {totals['reasks']:>8} {totals['fallbacks']:>10} "
+              f"{backend.stats()['calls'] / STORIES:>12.1f}")
+
+
+if __name__ == "__main__":
+    parse_cost()
+    story_rates([0.0, 0.05, 0.1, 0.3])
@@ -0,0 +1,257 @@
+# Process-wide Gemini client.
+# Model objects are created once per (model, generation config) and shared by
+# every Streamlit session, instead of building a new GenerativeModel on every
+# call. Calls are retried with jittered exponential backoff behind a circuit
+# breaker shared by all sessions, and answered from a response cache when the
+# same prompt was seen recently. Each API attempt first takes a slot from the
+# process-wide scheduler (concurrency, rate and priority limits). Lives outside
+# app.py so it survives Streamlit reruns.
+import json
+import threading
+import time
+from contextlib import ExitStack, nullcontext
+
+import google.generativeai as genai
+
+from metrics import metrics
+from resilience import CircuitBreaker, CircuitOpenError, RetryPolicy, call_with_retries
+from response_cache import ResponseCache, response_cache_key
+from scheduler import api_key_id, get_scheduler
+
+DEFAULT_MODEL = "gemini-2.0-flash"
+
+
+class GeminiClient:
+    def __init__(self, api_key=None, model_name=DEFAULT_MODEL, retry_policy=None, breaker=None, cache=None,
+                 scheduler=None):
+        if api_key:
+            genai.configure(api_key=api_key)
+        self.key_id = api_key_id(api_key)
+        self.scheduler = scheduler
+        self.model_name = model_name
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker()
+        self.cache = cache
+        self._models = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.failures = 0
+        self.retries = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.streams = 0
+        self.total_first_chunk_latency = 0.0
+
+    # Shared model object for a model name and generation config.
+    # response_schema switches the model to JSON output constrained to it.
+    def model(self, model_name=None, temperature=None, max_output_tokens=None, response_schema=None):
+        model_name = model_name or self.model_name
+        schema_key = json.dumps(response_schema, sort_keys=True) if response_schema is not None else None
+        key = (model_name, temperature, max_output_tokens, schema_key)
+        with self._lock:
+            model = self._models.get(key)
+            if model is None:
+                generation_config = {}
+                if temperature is not None:
+                    generation_config["temperature"] = temperature
+                if max_output_tokens is not None:
+                    generation_config["max_output_tokens"] = max_output_tokens
+                if response_schema is not None:
+                    generation_config["response_mime_type"] = "application/json"
+                    generation_config["response_schema"] = response_schema
+                model = genai.GenerativeModel(model_name, generation_config=generation_config or None)
+                self._models[key] = model
+        return model
+
+    # Remove a cached response that turned out to be unusable
+    def forget(self, prompt, temperature=None, max_output_tokens=None, model_name=None, response_schema=None):
+        if self.cache is not None:
+            model_name = model_name or self.model_name
+            self.cache.discard(response_cache_key(prompt, model_name, temperature, max_output_tokens, response_schema))
+
+    # Scheduler slot for one API call (no limits without a scheduler)
+    def _slot(self):
+        if self.scheduler is None:
+            return nullcontext()
+        return self.scheduler.slot(self.key_id)
+
+    # One API call, with latency and failure accounting
+    def _generate_once(self, model, prompt):
+        with self._slot():
+            return self._call_model(model, prompt)
+
+    def _call_model(self, model, prompt):
+        start = time.perf_counter()
+        try:
+            response = model.generate_content(prompt)
+            text = response.text
+            usage = getattr(response, "usage_metadata", None)
+            metrics.record_call(
+                prompt, text,
+                prompt_tokens=getattr(usage, "prompt_token_count", None),
+                response_tokens=getattr(usage, "candidates_token_count", None)
+            )
+            return text
+        except Exception:
+            with self._lock:
+                self.failures += 1
+            raise
+        finally:
+            latency = time.perf_counter() - start
+            with self._lock:
+                self.calls += 1
+                self.total_latency += latency
+                self.max_latency = max(self.max_latency, latency)
+
+    def _count_retry(self, attempt, error):
+        with self._lock:
+            self.retries += 1
+        metrics.count("tale_weaver_model_retries_total", stage=metrics.current_stage())
+
+    # Generate text for a prompt, retrying transient errors. Identical recent
+    # prompts are answered from the cache unless cache=False (for calls that
+    # should come out different every time). Raises the last error, or
+    # resilience.CircuitOpenError while the API is down and nothing is cached.
+    # With response_schema the reply is JSON matching it (see structured_output).
+    def generate(self, prompt, temperature=None, max_output_tokens=None, model_name=None, cache=True,
+                 response_schema=None):
+        model_name = model_name or self.model_name
+        cache = self.cache if cache else None
+        key = None
+        if cache is not None:
+            key = response_cache_key(prompt, model_name, temperature, max_output_tokens, response_schema)
+            cached = cache.get(key)
+            if cached is not None:
+                metrics.record_call(prompt, cached, cached=True)
+                return cached
+
+        model = self.model(model_name, temperature, max_output_tokens, response_schema)
+        try:
+            text = call_with_retries(
+                lambda: self._generate_once(model, prompt),
+                self.retry_policy,
+                self.breaker,
+                on_retry=self._count_retry
+            )
+        except CircuitOpenError:
+            # An old answer beats the fallback while the API is down
+            stale = cache.get(key, allow_stale=True) if cache is not None else None
+            if stale is not None:
+                metrics.record_call(prompt, stale, cached=True)
+                return stale
+            raise
+
+        if cache is not None:
+            cache.put(key, text)
+        return text
+
+    # Open a streaming call; the first chunk arrives before this returns, so
+    # connection and rate-limit errors surface here and can be retried. Each
+    # attempt takes its own scheduler slot; returns (response, slot), where
+    # the slot is still held and must be closed once the stream ends.
+    def _open_stream(self, model, prompt):
+        with ExitStack() as slot:
+            slot.enter_context(self._slot())
+            start = time.perf_counter()
+            try:
+                response = model.generate_content(prompt, stream=True)
+            except Exception:
+                with self._lock:
+                    self.failures += 1
+                raise
+            with self._lock:
+                self.streams += 1
+                self.total_first_chunk_latency += time.perf_counter() - start
+            return response, slot.pop_all()
+
+    # Yield the response text in chunks as the model produces it. Only opening
+    # the stream is retried; an error after text has arrived is raised to the
+    # caller, which can keep what it already has. Never cached. The scheduler
+    # slot of the attempt that opened the stream is held until the stream
+    # ends; backoff between attempts holds no slot.
+    def generate_stream(self, prompt, temperature=None, max_output_tokens=None, model_name=None,
+                        response_schema=None):
+        model = self.model(model_name, temperature, max_output_tokens, response_schema)
+        start = time.perf_counter()
+        response, slot = call_with_retries(
+            lambda: self._open_stream(model, prompt),
+            self.retry_policy,
+            self.breaker,
+            on_retry=self._count_retry
+        )
+        streamed = []
+        try:
+            for chunk in response:
+                try:
+                    text = chunk.text
+                except ValueError:
+                    # Chunk with no text part (e.g. only safety metadata)
+                    continue
+                if text:
+                    streamed.append(text)
+                    yield text
+        except Exception:
+            with self._lock:
+                self.failures += 1
+            raise
+        finally:
+            slot.close()
+            latency = time.perf_counter() - start
+            with self._lock:
+                self.calls += 1
+                self.total_latency += latency
+                self.max_latency = max(self.max_latency, latency)
+            metrics.record_call(prompt, "".join(streamed))
+
+    # Call counters since the process started
+    def stats(self):
+        with self._lock:
+            avg_latency = self.total_latency / self.calls if self.calls else 0.0
+            stats = {
+                "calls": self.calls,
+                "failures": self.failures,
+                "retries": self.retries,
+                "circuit": self.breaker.state,
+                "models": len(self._models),
+                "avg_latency": avg_latency,
+                "max_latency": self.max_latency,
+                "streams": self.streams,
+                "avg_first_chunk_latency": self.total_first_chunk_latency / self.streams if self.streams else 0.0
+            }
+        if self.cache is not None:
+            cache_stats = self.cache.stats()
+            stats["cache"] = cache_stats
+            # Every hit is an API call (and its latency) we didn't pay for
+            stats["calls_saved"] = cache_stats["hits"] + cache_stats["stale_hits"]
+            stats["seconds_saved"] = stats["calls_saved"] * avg_latency
+        return stats
+
+    # Numeric stats for metrics export
+    def gauges(self):
+        stats = self.stats()
+        gauges = {name: value for name, value in stats.items() if isinstance(value, (int, float))}
+        gauges["circuit_open"] = 1 if stats["circuit"] == "open" else 0
+        for name, value in stats.get("cache", {}).items():
+            gauges[f"cache_{name}"] = value
+        return gauges
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+# The shared client, created on first use
+# cache_ttl enables the response cache; cache_path also persists it to SQLite
+# max_concurrent and rate_per_minute configure the shared scheduler
+def get_gemini_client(api_key=None, cache_ttl=None, cache_path=None, cache_entries=512,
+                      max_concurrent=8, rate_per_minute=0):
+    global _client
+    with _client_lock:
+        if _client is None:
+            cache = None
+            if cache_ttl:
+                cache = ResponseCache(max_entries=cache_entries, ttl=cache_ttl, path=cache_path)
+            scheduler = get_scheduler(max_concurrent, rate_per_minute)
+            _client = GeminiClient(api_key, cache=cache, scheduler=scheduler)
+            metrics.register_collector("gemini", _client.gauges)
+        return _client
@@ -0,0 +1,221 @@
+# Process-wide performance instrumentation.
+# Stages of a turn are timed with spans; model calls add prompt/response
+# sizes and token counts, attributed to the stage they ran in. Everything is
+# kept in memory for the admin panel, optionally logged as one JSON object per
+# line, and exported in the Prometheus text format (to a file, which can be
+# placed under static/ to be scraped from the running app).
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Histogram bucket upper bounds, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Recent durations kept per stage for percentiles
+RECENT_SPANS = 1000
+
+# Rough characters per token, used when the API doesn't report token counts
+CHARS_PER_TOKEN = 4
+
+# Minimum seconds between rewrites of the Prometheus file
+EXPORT_INTERVAL = 10
+
+
+def estimate_tokens(text):
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+def _label_text(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(f'{name}="{str(value)}"' for name, value in sorted(labels))
+    return "{" + pairs + "}"
+
+
+class Metrics:
+    def __init__(self, log_path=None, export_path=None, clock=time.time):
+        self.log_path = log_path
+        self.export_path = export_path
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.counters = {}    # (name, labels) -> value
+        self.histograms = {}  # stage -> {"count", "sum", "buckets"}
+        self.recent = {}      # stage -> deque of recent durations
+        self.collectors = {}  # name -> fn returning {gauge name: value}
+        self.local = threading.local()
+        self.last_export = 0.0
+
+    # Stage the calling thread is currently in ("other" outside any span)
+    def current_stage(self):
+        stages = getattr(self.local, "stages", None)
+        return stages[-1] if stages else "other"
+
+    # Time a block of work as one stage. Extra fields go into the JSON log.
+    @contextmanager
+    def span(self, stage, **fields):
+        stages = getattr(self.local, "stages", None)
+        if stages is None:
+            stages = self.local.stages = []
+        stages.append(stage)
+        start = time.perf_counter()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            stages.pop()
+            self.observe(stage, time.perf_counter() - start, error=error, **fields)
+
+    def observe(self, stage, seconds, error=None, **fields):
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = {"count": 0, "sum": 0.0, "buckets": [0] * len(BUCKETS)}
+                self.recent[stage] = deque(maxlen=RECENT_SPANS)
+            histogram["count"] += 1
+            histogram["sum"] += seconds
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    histogram["buckets"][i] += 1
+            self.recent[stage].append(seconds)
+            if error is not None:
+                key = ("tale_weaver_stage_errors_total", (("stage", stage),))
+                self.counters[key] = self.counters.get(key, 0) + 1
+        self.log("span", stage=stage, ms=round(seconds * 1000, 3), error=error, **fields)
+        self.maybe_export()
+
+    def count(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    # Record one model call: sizes and tokens, attributed to the current stage.
+    # Token counts reported by the API are used when given.
+    def record_call(self, prompt, response, prompt_tokens=None, response_tokens=None, cached=False):
+        stage = self.current_stage()
+        source = "cache" if cached else "api"
+        self.count("tale_weaver_model_calls_total", stage=stage, source=source)
+        self.count("tale_weaver_prompt_chars_total", len(prompt), stage=stage)
+        self.count("tale_weaver_response_chars_total", len(response), stage=stage)
+        if not cached:
+            self.count("tale_weaver_prompt_tokens_total",
+                       prompt_tokens if prompt_tokens is not None else estimate_tokens(prompt), stage=stage)
+            self.count("tale_weaver_response_tokens_total",
+                       response_tokens if response_tokens is not None else estimate_tokens(response), stage=stage)
+        self.log("model_call", stage=stage, source=source, prompt_chars=len(prompt), response_chars=len(response))
+
+    # fn() returns {gauge name: value}; read whenever metrics are exported
+    def register_collector(self, name, fn):
+        with self.lock:
+            self.collectors[name] = fn
+
+    def log(self, event, **fields):
+        if not self.log_path:
+            return
+        record = {"ts": round(self.clock(), 3), "event": event}
+        record.update((key, value) for key, value in fields.items() if value is not None)
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        with self.lock:
+            with open(self.log_path, "a") as f:
+                f.write(line)
+
+    def gauges(self):
+        with self.lock:
+            collectors = list(self.collectors.items())
+        gauges = {}
+        for name, fn in collectors:
+            try:
+                values = fn()
+            except Exception:
+                continue
+            for gauge, value in values.items():
+                gauges[f"tale_weaver_{name}_{gauge}"] = value
+        return gauges
+
+    # Per-stage summary for the admin panel
+    def stage_summary(self):
+        with self.lock:
+            return {
+                stage: {
+                    "count": histogram["count"],
+                    "avg_ms": histogram["sum"] / histogram["count"] * 1000,
+                    "p50_ms": percentile(list(self.recent[stage]), 0.5) * 1000,
+                    "p95_ms": percentile(list(self.recent[stage]), 0.95) * 1000,
+                    "max_ms": max(self.recent[stage]) * 1000
+                }
+                for stage, histogram in self.histograms.items()
+            }
+
+    # Totals of one counter by the value of one of its labels
+    def counter_totals(self, name, label="stage"):
+        totals = {}
+        with self.lock:
+            for (counter, labels), value in self.counters.items():
+                if counter == name:
+                    key = dict(labels).get(label, "")
+                    totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def prometheus_text(self):
+        lines = []
+        with self.lock:
+            histograms = {stage: dict(h, buckets=list(h["buckets"])) for stage, h in self.histograms.items()}
+            counters = dict(self.counters)
+
+        lines.append("# TYPE tale_weaver_stage_seconds histogram")
+        for stage, histogram in sorted(histograms.items()):
+            for bound, value in zip(BUCKETS, histogram["buckets"]):
+                lines.append(f'tale_weaver_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {value}')
+            lines.append(f'tale_weaver_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram["count"]}')
+            lines.append(f'tale_weaver_stage_seconds_sum{{stage="{stage}"}} {histogram["sum"]}')
+            lines.append(f'tale_weaver_stage_seconds_count{{stage="{stage}"}} {histogram["count"]}')
+
+        declared = set()
+        for (name, labels), value in sorted(counters.items()):
+            if name not in declared:
+                lines.append(f"# TYPE {name} counter")
+                declared.add(name)
+            lines.append(f"{name}{_label_text(labels)} {value}")
+
+        for name, value in sorted(self.gauges().items()):
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    # Write the Prometheus file (atomically, so a scraper never reads half of it)
+    def export(self, path=None):
+        path = path or self.export_path
+        if not path:
+            return
+        temp_path = f"{path}.{threading.get_ident()}.part"
+        with open(temp_path, "w") as f:
+            f.write(self.prometheus_text())
+        os.replace(temp_path, path)
+
+    def maybe_export(self):
+        if not self.export_path:
+            return
+        now = self.clock()
+        with self.lock:
+            if now - self.last_export < EXPORT_INTERVAL:
+                return
+            self.last_export = now
+        self.export()
+
+
+# METRICS_LOG: file that receives one JSON object per span and model call
+# METRICS_PATH: Prometheus text file, rewritten at most every EXPORT_INTERVAL
+#     seconds (static/metrics.prom is served at app/static/metrics.prom)
+metrics = Metrics(log_path=os.getenv("METRICS_LOG"), export_path=os.getenv("METRICS_PATH"))
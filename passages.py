@@ -0,0 +1,196 @@
+# Structured story text.
+# A story is an ordered list of passage records instead of one growing HTML
+# string. Each record keeps its text, type, word count and rendered HTML, so a
+# new turn only processes the new passage and views of the whole story are
+# plain joins.
+#
+# Passage types: beginning, choice, continuation, ending
+#
+# Story statistics (word_count, dialog_word_count) are running totals kept in
+# the story state and updated from each new passage, so reading them never
+# re-tokenizes the story.
+import re
+
+DIALOG_PATTERN = re.compile(r'"([^"]*)"')
+TAG_PATTERN = re.compile(r'<[^>]*>')
+
+# Average reading speed used for reading time estimates (200-250 wpm)
+WORDS_PER_MINUTE = 225
+
+# Markers used in the legacy current_text string
+LEGACY_MARKER_PATTERN = re.compile(
+    r"\n*<div class='choice-marker'>You chose: (.*?)</div>\n*"
+    r"|\n*<div class='section-header'>The Conclusion</div>\n*",
+    re.DOTALL
+)
+
+
+# Wrap quoted dialog in a styled span
+def format_dialog(text):
+    return DIALOG_PATTERN.sub(r'<span class="dialog">"\1"</span>', text)
+
+def render_passage_html(kind, text):
+    if kind == "choice":
+        return f"\n\n<div class='choice-marker'>You chose: {format_dialog(text)}</div>\n\n"
+    if kind == "ending":
+        return f"\n\n<div class='section-header'>The Conclusion</div>\n\n{format_dialog(text)}"
+    return format_dialog(text)
+
+# Same layout as the HTML, without markup (exports and narration)
+def render_passage_plain(kind, text):
+    if kind == "choice":
+        return f"\n\nYou chose: {text}\n\n"
+    if kind == "ending":
+        return f"\n\nThe Conclusion\n\n{text}"
+    return text
+
+# Words spoken in quoted dialog
+def count_dialog_words(text):
+    return sum(len(quote.split()) for quote in DIALOG_PATTERN.findall(text))
+
+def make_passage(kind, text):
+    return {
+        "type": kind,
+        "text": text,
+        "word_count": len(text.split()),
+        "dialog_word_count": count_dialog_words(text),
+        "html": render_passage_html(kind, text)
+    }
+
+# Fill in the derived fields of records loaded from disk, which store only
+# type and text
+def hydrate_passage(record):
+    if "html" in record and "dialog_word_count" in record:
+        return record
+    return make_passage(record["type"], record["text"])
+
+# The part of a passage that is saved
+def stored_passage(passage):
+    return {"type": passage["type"], "text": passage["text"]}
+
+# Add a passage's counts to the story's running totals
+def count_passage(story_state, passage):
+    story_state["word_count"] = story_state.get("word_count", 0) + passage["word_count"]
+    story_state["dialog_word_count"] = story_state.get("dialog_word_count", 0) + passage["dialog_word_count"]
+
+# Append a passage and update the story's running totals
+def add_passage(story_state, kind, text):
+    passage = make_passage(kind, text)
+    story_state["passages"].append(passage)
+    count_passage(story_state, passage)
+    if kind == "choice":
+        story_state["choices_made"].append(text)
+    return passage
+
+# Recompute the running totals from the passages. Only needed for saves made
+# before the totals were kept (their word counts included HTML markup).
+def recount_story(story_state):
+    story_state["word_count"] = 0
+    story_state["dialog_word_count"] = 0
+    for passage in story_state["passages"]:
+        count_passage(story_state, passage)
+    return story_state
+
+# Reading statistics from the running totals; no text is scanned
+# Passages in a story, including older ones not loaded yet (see
+# story_store.resume_story)
+def passage_count(story_state):
+    return story_state.get("passage_offset", 0) + len(story_state.get("passages", []))
+
+# Choices made in a story, including those in passages not loaded yet
+def choice_count(story_state):
+    return story_state.get("choice_offset", 0) + len(story_state.get("choices_made", []))
+
+def story_stats(story_state):
+    word_count = story_state.get("word_count", 0)
+    dialog_word_count = story_state.get("dialog_word_count", 0)
+    return {
+        "word_count": word_count,
+        "reading_minutes": word_count / WORDS_PER_MINUTE,
+        "dialog_ratio": dialog_word_count / word_count if word_count else 0.0,
+        "passage_count": passage_count(story_state)
+    }
+
+def story_html(passages):
+    return "".join(passage["html"] for passage in passages)
+
+
+# Rendered story view for one session. Keeps the HTML of the passages already
+# shown, keyed by story id and passage index, so a rerun only appends the
+# passages added since the last one; reruns with no new passage (most button
+# clicks) reuse the cached string as is. first is the index of passages[0]
+# in the story; loading earlier passages changes it and starts over.
+class StoryRenderCache:
+    def __init__(self):
+        self.story_id = None
+        self.first = 0
+        self.parts = []
+        self.html = ""
+        self.hits = 0
+        self.rendered = 0
+
+    # Forget the cached view (a story was loaded or replaced)
+    def invalidate(self, story_id=None):
+        if story_id is None or story_id == self.story_id:
+            self.story_id = None
+            self.parts = []
+            self.html = ""
+
+    def render(self, story_id, passages, first=0):
+        if story_id != self.story_id or first != self.first or len(passages) < len(self.parts):
+            self.invalidate()
+            self.story_id = story_id
+            self.first = first
+        new_passages = passages[len(self.parts):]
+        if not new_passages:
+            self.hits += 1
+            return self.html
+        for passage in new_passages:
+            self.parts.append(hydrate_passage(passage)["html"])
+        self.rendered += len(new_passages)
+        self.html += "".join(self.parts[-len(new_passages):])
+        return self.html
+
+    def stats(self):
+        return {"passages": len(self.parts), "hits": self.hits, "rendered": self.rendered}
+
+def story_plain_text(passages):
+    return "".join(render_passage_plain(passage["type"], passage["text"]) for passage in passages)
+
+# Text of the story's ending, if it has one
+def ending_text(passages):
+    for passage in reversed(passages):
+        if passage["type"] == "ending":
+            return passage["text"]
+    return ""
+
+# Split a legacy current_text string into passage records
+def passages_from_text(current_text):
+    passages = []
+    position = 0
+    kind = "beginning"
+    for marker in LEGACY_MARKER_PATTERN.finditer(current_text):
+        text = TAG_PATTERN.sub('', current_text[position:marker.start()]).strip()
+        if text:
+            passages.append(make_passage(kind, text))
+        if marker.group(1) is not None:
+            passages.append(make_passage("choice", marker.group(1).strip()))
+            kind = "continuation"
+        else:
+            kind = "ending"
+        position = marker.end()
+    text = TAG_PATTERN.sub('', current_text[position:]).strip()
+    if text:
+        passages.append(make_passage(kind, text))
+    return passages
+
+# Convert a story saved before passages existed (current_text + path_taken)
+def migrate_legacy_state(story_state):
+    if "passages" in story_state:
+        story_state["passages"] = [hydrate_passage(record) for record in story_state["passages"]]
+    else:
+        story_state["passages"] = passages_from_text(story_state.pop("current_text", ""))
+        story_state.pop("path_taken", None)
+    if "dialog_word_count" not in story_state:
+        recount_story(story_state)
+    return story_state
@@ -0,0 +1,123 @@
+# Prompt templates for Tale Weaver's Gemini calls.
+# Kept free of Streamlit so they can be reused by scripts and benchmarks.
+
+
+# Name used in prompts when the player left the protagonist unnamed
+def protagonist(character_name):
+    return character_name if character_name else 'the protagonist'
+
+# Prompt for the opening story starters
+def build_starters_prompt(genre=None, character_name=None):
+    prompt = """
+    Generate 3 unique and engaging story starters for an interactive fiction game.
+    Each starter should be 2-3 sentences long and end with an intriguing situation that sets up a choice,
+    but DO NOT include the choices in the starter.
+    """
+
+    if genre:
+        prompt += f" The genre is {genre}."
+
+    if character_name:
+        prompt += f" The main character's name is {character_name}."
+
+    prompt += """
+    Make each starter distinct and compelling. Format the response as a JSON array with each starter as a string element.
+    Example format: ["Starter 1...", "Starter 2...", "Starter 3..."]
+
+    DO NOT include any choices or options in the starters themselves.
+    """
+    return prompt
+
+# Prompt for the next set of player choices
+def build_choices_prompt(story_context, genre, character_name, num_choices=3):
+    return f"""
+    Based on this story so far in the {genre} genre:
+
+    {story_context}
+
+    Generate exactly {num_choices} interesting and distinct choices for what the character {protagonist(character_name)} could do next.
+
+    Each choice should:
+    1. Be 1-2 sentences long
+    2. Offer a clear and specific action
+    3. Lead to different possible story directions
+    4. Make sense given the current story situation
+    5. NOT reference any options or choices that might be in the story text
+
+    Format the response as a JSON array with each choice as a string element.
+    Example format: ["Choice 1...", "Choice 2...", "Choice 3..."]
+
+    IMPORTANT: DO NOT number the choices or add prefixes like "Option A" - just provide the plain choice text.
+    """
+
+# Prompt for the passage that follows a player's choice
+def build_continue_prompt(story_context, chosen_action, genre, character_name):
+    return f"""
+    Continue this {genre} story where the main character named {protagonist(character_name)} has chosen the following action:
+
+    Story so far: {story_context}
+
+    Chosen action: {chosen_action}
+
+    Write the next part of the story (about 150-200 words) that follows from this choice. End at a natural stopping point that creates anticipation for what might happen next.
+
+    IMPORTANT:
+    - DO NOT include any numbered choices, options, or decision points in your response
+    - DO NOT end with phrases like "What will you do?" or "What happens next?"
+    - DO NOT write anything like "Option A:" or "Choice 1:" in your response
+    - Focus on vivid descriptions, character emotions, and advancing the plot
+    - Use a mix of narration and dialog where appropriate
+    """
+
+# Prompt for a whole turn in one call: the passage that follows the player's
+# choice and the choices offered after it
+def build_turn_prompt(story_context, chosen_action, genre, character_name, num_choices=3):
+    return f"""
+    Continue this {genre} story where the main character named {protagonist(character_name)} has chosen the following action:
+
+    Story so far: {story_context}
+
+    Chosen action: {chosen_action}
+
+    Reply with a JSON object with two fields:
+    - "passage": the next part of the story (about 150-200 words) that follows from this choice. End at a natural stopping point that creates anticipation for what might happen next. Focus on vivid descriptions, character emotions, and advancing the plot, with a mix of narration and dialog where appropriate. DO NOT include any choices, options or questions like "What will you do?" in the passage.
+    - "paths": exactly {num_choices} different things {protagonist(character_name)} could do after the passage. Each is 1-2 sentences, offers a clear and specific action, leads in a different direction and makes sense right after the passage. No numbers or prefixes like "Option A".
+    """
+
+# Prompt for the story's conclusion
+def build_ending_prompt(story_context, genre, character_name):
+    return f"""
+    Write a satisfying conclusion to this {genre} story featuring {protagonist(character_name)}:
+
+    {story_context}
+
+    Create a meaningful and emotionally resonant ending (about 200-300 words) that:
+    1. Resolves the main tension or conflict
+    2. Provides closure for the character
+    3. Reflects the tone and themes of the {genre} genre
+    4. Leaves the reader with a final image or thought
+
+    Make the ending feel earned and connected to the character's journey.
+    """
+
+# Prompt for the end-of-story recap
+def build_recap_prompt(choices_made, genre, character_name):
+    return f"""
+    Create a brief recap (2-3 sentences) of this {genre} story so far featuring {protagonist(character_name)}.
+    Focus on the key decisions and turning points.
+
+    Here are the choices that were made: {', '.join(choices_made)}
+    """
+
+# Prompt that folds one passage into the running story summary
+def build_summary_prompt(summary, passage, max_words):
+    return f"""
+    You are keeping a running summary of an interactive story.
+
+    Summary so far: {summary if summary else '(the story has just begun)'}
+
+    Newest events: {passage}
+
+    Rewrite the summary so it also covers the newest events. Keep names, places, goals and unresolved threads.
+    Use at most {max_words} words and plain prose only - no lists, headings or commentary.
+    """
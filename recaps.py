@@ -0,0 +1,102 @@
+# Background, memoized end-of-story recaps.
+# A recap depends only on the genre, the protagonist and the choices made, so
+# it can be written as soon as the last choice is in, while the ending is
+# still being generated. Recaps are keyed by a hash of those inputs: a story
+# whose recap_key matches already has its recap, and identical inputs share
+# one generation across sessions.
+#
+# Like speculation.py, this lives outside app.py so the worker threads and the
+# memo survive Streamlit reruns.
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import metrics
+
+# Recaps kept in memory for other sessions with the same inputs
+MAX_ENTRIES = 256
+
+
+# Hash of everything a recap depends on
+def recap_key(story_state):
+    inputs = [story_state["genre"], story_state["character_name"], story_state["choices_made"]]
+    return hashlib.sha256(json.dumps(inputs).encode("utf-8")).hexdigest()[:16]
+
+# True if the story's stored recap was written for its current inputs
+def has_current_recap(story_state):
+    return "recap" in story_state and story_state.get("recap_key") == recap_key(story_state)
+
+
+class RecapWorker:
+    def __init__(self, workers=2, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.futures = OrderedDict()   # recap key -> future
+        self.started = 0
+        self.hits = 0
+        self.failures = 0
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tale-weaver-recaps")
+
+    # Start writing the recap for a story unless it is already written or
+    # under way (a failed attempt is started again). write(inputs) gets a
+    # snapshot of the recap inputs and must not touch Streamlit session
+    # state. Returns the future for the recap.
+    def start(self, story_state, write):
+        key = recap_key(story_state)
+        inputs = {
+            "genre": story_state["genre"],
+            "character_name": story_state["character_name"],
+            "choices_made": list(story_state["choices_made"])
+        }
+        with self.lock:
+            future = self.futures.get(key)
+            if future is not None and not (future.done() and future.exception() is not None):
+                self.futures.move_to_end(key)
+                self.hits += 1
+                return future
+            future = self.futures[key] = self.executor.submit(write, inputs)
+            self.futures.move_to_end(key)
+            self.started += 1
+            while len(self.futures) > self.max_entries:
+                self.futures.popitem(last=False)
+        return future
+
+    # The recap for a story, waiting for it if it is still being written
+    # (starting it first if needed). Raises the generation error.
+    def result(self, story_state, write, timeout=None):
+        future = self.start(story_state, write)
+        try:
+            return future.result(timeout=timeout)
+        except Exception:
+            with self.lock:
+                self.failures += 1
+            raise
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.futures),
+                "pending": sum(1 for future in self.futures.values() if not future.done()),
+                "started": self.started,
+                "hits": self.hits,
+                "failures": self.failures
+            }
+
+    def gauges(self):
+        return self.stats()
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+# The process-wide recap worker, created on first use
+def get_recap_worker():
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            _worker = RecapWorker()
+            metrics.register_collector("recaps", _worker.gauges)
+        return _worker
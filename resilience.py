@@ -0,0 +1,137 @@
+# Retry and circuit-breaker helpers for upstream API calls.
+# Retries use exponential backoff with full jitter so sessions that failed
+# together don't retry together, and only errors that can succeed on retry
+# (rate limits, timeouts, 5xx) are retried. A shared circuit breaker stops
+# calling an upstream that keeps failing, so users get the fallback right away
+# instead of after several slow attempts.
+import random
+import threading
+import time
+
+# HTTP status codes worth retrying: timeout, rate limit and server errors
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+# Raised instead of calling the upstream while the circuit is open
+class CircuitOpenError(Exception):
+    pass
+
+
+# True if an exception is transient. google.api_core errors carry the HTTP
+# status in .code; network errors are retryable, everything else (bad
+# request, auth, blocked content) is not.
+def is_retryable(error):
+    if isinstance(error, CircuitOpenError):
+        return False
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    code = getattr(error, "code", None)
+    if callable(code):
+        # grpc-style errors expose code() instead of an int
+        return False
+    return code in RETRYABLE_STATUS_CODES
+
+
+class RetryPolicy:
+    def __init__(self, max_attempts=3, base_delay=0.5, max_delay=8.0, multiplier=2.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+
+    # Full-jitter backoff: a random wait up to the exponential ceiling
+    def delay(self, attempt):
+        ceiling = min(self.max_delay, self.base_delay * self.multiplier ** attempt)
+        return random.uniform(0, ceiling)
+
+
+class CircuitBreaker:
+    # Opens after failure_threshold consecutive retryable failures, then lets a
+    # single trial call through once reset_timeout seconds have passed
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_progress = False
+        self.rejected = 0
+
+    @property
+    def state(self):
+        with self.lock:
+            return self._state_locked()
+
+    def _state_locked(self):
+        if self.opened_at is None:
+            return "closed"
+        if self.clock() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    # True if a call may go through right now
+    def allow(self):
+        with self.lock:
+            state = self._state_locked()
+            if state == "closed":
+                return True
+            if state == "half_open" and not self.trial_in_progress:
+                self.trial_in_progress = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_progress = False
+
+    # Give back a half-open trial that never reached the upstream, so the
+    # next call can make the trial instead
+    def release_trial(self):
+        with self.lock:
+            if self._state_locked() == "half_open":
+                self.trial_in_progress = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial_in_progress or self.failures >= self.failure_threshold:
+                self.opened_at = self.clock()
+            self.trial_in_progress = False
+
+
+# Call fn() with retries. Non-retryable errors are raised at once; while the
+# breaker is open CircuitOpenError is raised without calling fn.
+# on_retry(attempt, error) is called before each backoff sleep.
+def call_with_retries(fn, policy, breaker=None, sleep=time.sleep, on_retry=None):
+    for attempt in range(policy.max_attempts):
+        if breaker is not None and not breaker.allow():
+            raise CircuitOpenError("Upstream is unavailable; not calling it for now")
+        try:
+            result = fn()
+        except CircuitOpenError:
+            # Turned away before reaching the upstream (e.g. a full scheduler
+            # queue); says nothing about its health, so leave the breaker alone
+            if breaker is not None:
+                breaker.release_trial()
+            raise
+        except Exception as error:
+            retryable = is_retryable(error)
+            if breaker is not None:
+                if retryable:
+                    breaker.record_failure()
+                else:
+                    # The upstream answered; the request itself was bad
+                    breaker.record_success()
+            if not retryable or attempt == policy.max_attempts - 1:
+                raise
+            if on_retry is not None:
+                on_retry(attempt + 1, error)
+            sleep(policy.delay(attempt))
+        else:
+            if breaker is not None:
+                breaker.record_success()
+            return result
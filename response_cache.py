@@ -0,0 +1,158 @@
+# Cache of model responses keyed on the normalized prompt, model and
+# generation config. Entries live in an in-memory LRU with a TTL and can also
+# be persisted to SQLite so they survive restarts and are shared between
+# server processes. The SQLite table is pruned when the cache is opened and
+# every PRUNE_EVERY writes after that: expired rows are deleted and only the
+# newest max_disk_entries rows are kept, so the file stays bounded.
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+# Writes between prunes of the SQLite table
+PRUNE_EVERY = 100
+
+
+# Prompts differing only in indentation or line breaks share a cache entry
+def normalize_prompt(prompt):
+    return WHITESPACE_PATTERN.sub(' ', prompt).strip()
+
+# response_schema (JSON mode) is part of the key; plain-text keys are unchanged
+def response_cache_key(prompt, model_name, temperature=None, max_output_tokens=None, response_schema=None):
+    parts = [normalize_prompt(prompt), model_name, temperature, max_output_tokens]
+    if response_schema is not None:
+        parts.append(response_schema)
+    payload = json.dumps(parts, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, max_entries=512, ttl=3600, path=None, clock=time.time, max_disk_entries=4096):
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl = ttl
+        self.path = path
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> (created_at, value)
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.evictions = 0
+        self.writes = 0
+        self.pruned = 0
+        if path:
+            with self._connect() as connection:
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)"
+                )
+                connection.execute(
+                    "CREATE INDEX IF NOT EXISTS responses_created_at ON responses (created_at)"
+                )
+                self._prune(connection)
+            connection.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    def _fresh(self, created_at):
+        return self.clock() - created_at < self.ttl
+
+    def _remember_locked(self, key, created_at, value):
+        self.entries[key] = (created_at, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def _load_from_disk(self, key):
+        if not self.path:
+            return None
+        connection = self._connect()
+        try:
+            return connection.execute(
+                "SELECT created_at, value FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+        finally:
+            connection.close()
+
+    # Cached response, or None. With allow_stale=True expired entries are
+    # returned too (used when the API is down and anything beats the fallback).
+    def get(self, key, allow_stale=False):
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is None:
+            entry = self._load_from_disk(key)
+            if entry is not None:
+                with self.lock:
+                    self._remember_locked(key, *entry)
+
+        with self.lock:
+            if entry is not None and self._fresh(entry[0]):
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None and allow_stale:
+                self.stale_hits += 1
+                return entry[1]
+            if not allow_stale:
+                self.misses += 1
+            return None
+
+    def put(self, key, value):
+        created_at = self.clock()
+        with self.lock:
+            self._remember_locked(key, created_at, value)
+            self.writes += 1
+            prune = self.writes % PRUNE_EVERY == 0
+        if self.path:
+            with self._connect() as connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO responses (key, value, created_at) VALUES (?, ?, ?)",
+                    (key, value, created_at)
+                )
+                if prune:
+                    self._prune(connection)
+            connection.close()
+
+    # Delete expired rows, then all but the newest max_disk_entries rows.
+    # Expired rows could still serve allow_stale lookups, but only from the
+    # in-memory LRU once they are gone from disk.
+    def _prune(self, connection):
+        removed = connection.execute(
+            "DELETE FROM responses WHERE created_at < ?", (self.clock() - self.ttl,)
+        ).rowcount
+        removed += connection.execute(
+            "DELETE FROM responses WHERE key IN "
+            "(SELECT key FROM responses ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_disk_entries,)
+        ).rowcount
+        with self.lock:
+            self.pruned += removed
+
+    # Drop an entry (e.g. a response that turned out to be unusable)
+    def discard(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+        if self.path:
+            with self._connect() as connection:
+                connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+            connection.close()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "stale_hits": self.stale_hits,
+                "evictions": self.evictions,
+                "pruned": self.pruned,
+                "entries": len(self.entries)
+            }
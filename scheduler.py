@@ -0,0 +1,238 @@
+# Process-wide admission control for model calls.
+# Every API attempt from every session takes a slot here first. The
+# scheduler bounds how many calls are in flight, spaces calls per API key with
+# a token bucket, and hands out free slots in priority order, so a player
+# waiting on the next passage goes ahead of recaps and background
+# pre-generation. Waiting background work is capped and shed beyond that
+# instead of piling up during a spike.
+import hashlib
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
+from metrics import metrics
+from resilience import CircuitOpenError
+
+# Priority classes, most urgent first
+INTERACTIVE = 0   # a player is waiting on the result (passage, choices, ending)
+NORMAL = 1        # needed soon but not on screen yet (summaries, recap)
+BACKGROUND = 2    # speculative branches, starter pool refills
+
+PRIORITY_NAMES = {INTERACTIVE: "interactive", NORMAL: "normal", BACKGROUND: "background"}
+
+
+# No slot was free in time, or background work was shed. Subclasses
+# CircuitOpenError so callers answer from the cache or the fallback at once.
+class SchedulerBusyError(CircuitOpenError):
+    pass
+
+
+# A priority that can be raised while its calls are queued, for background
+# work that a player starts waiting on (see Scheduler.raise_priority)
+class PriorityLevel:
+    def __init__(self, level):
+        self.level = level
+
+
+# Scheduler key for an API key, without keeping the key itself around
+def api_key_id(api_key):
+    if not api_key:
+        return "default"
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12]
+
+
+class TokenBucket:
+    # rate tokens per second, holding at most capacity
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # Seconds until a token is available (0 if one is available now)
+    def delay(self):
+        self._refill()
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self._refill()
+        self.tokens -= 1
+
+
+class Scheduler:
+    # max_concurrent: calls in flight at once, across all keys
+    # rate_per_minute: calls started per minute per key (0 for no limit),
+    #     with bursts of up to burst calls
+    # max_background: background calls allowed to wait; more are rejected
+    # queue_timeout: longest a call waits for a slot before giving up
+    def __init__(self, max_concurrent=8, rate_per_minute=0, burst=None, max_background=16,
+                 queue_timeout=60.0, clock=time.monotonic):
+        self.max_concurrent = max_concurrent
+        self.rate_per_minute = rate_per_minute
+        self.burst = burst or max(1, max_concurrent)
+        self.max_background = max_background
+        self.queue_timeout = queue_timeout
+        self.clock = clock
+        self.condition = threading.Condition()
+        self.local = threading.local()
+        self.sequence = itertools.count()
+        self.waiting = []   # tickets: (priority, sequence, key, PriorityLevel or None)
+        self.buckets = {}
+        self.running = 0
+        self.max_waiting = 0
+        self.admitted = {name: 0 for name in PRIORITY_NAMES.values()}
+        self.rejected = 0
+        self.timeouts = 0
+
+    # Run a block of calls at a priority (applies to the calling thread).
+    # level is a priority class or a PriorityLevel.
+    @contextmanager
+    def priority(self, level):
+        previous = getattr(self.local, "priority", None)
+        self.local.priority = level
+        try:
+            yield
+        finally:
+            self.local.priority = previous
+
+    def current_priority(self):
+        level = getattr(self.local, "priority", None)
+        if isinstance(level, PriorityLevel):
+            return level.level
+        return INTERACTIVE if level is None else level
+
+    # Raise a PriorityLevel (never lower it), moving its queued calls up
+    def raise_priority(self, handle, level):
+        with self.condition:
+            handle.level = min(handle.level, level)
+            self.waiting = [(handle.level,) + ticket[1:] if ticket[3] is handle else ticket
+                            for ticket in self.waiting]
+            self.condition.notify_all()
+
+    # Take a ticket out of the queue; returns it with its current priority
+    def _remove_ticket(self, sequence):
+        for index, ticket in enumerate(self.waiting):
+            if ticket[1] == sequence:
+                return self.waiting.pop(index)
+        return None
+
+    def _bucket(self, key):
+        if not self.rate_per_minute:
+            return None
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(self.rate_per_minute / 60.0, self.burst, self.clock)
+        return bucket
+
+    # The most urgent waiting ticket whose key has a token, and otherwise how
+    # long until some key gets one. Called with the condition held.
+    def _next_ticket(self):
+        soonest = None
+        for ticket in sorted(self.waiting):
+            bucket = self._bucket(ticket[2])
+            delay = bucket.delay() if bucket is not None else 0.0
+            if delay == 0.0:
+                return ticket, None
+            soonest = delay if soonest is None else min(soonest, delay)
+        return None, soonest
+
+    # Hold a call slot for the duration of the block
+    @contextmanager
+    def slot(self, key="default", priority=None, timeout=None):
+        handle = getattr(self.local, "priority", None) if priority is None else None
+        handle = handle if isinstance(handle, PriorityLevel) else None
+        priority = self.current_priority() if priority is None else priority
+        timeout = self.queue_timeout if timeout is None else timeout
+        sequence = next(self.sequence)
+        ticket = (priority, sequence, key, handle)
+        started = self.clock()
+        deadline = started + timeout
+
+        with self.condition:
+            if priority >= BACKGROUND and sum(1 for t in self.waiting if t[0] >= BACKGROUND) >= self.max_background:
+                self.rejected += 1
+                raise SchedulerBusyError("Too much background work queued; skipped")
+            self.waiting.append(ticket)
+            self.max_waiting = max(self.max_waiting, len(self.waiting))
+            try:
+                while True:
+                    wait = None
+                    if self.running < self.max_concurrent:
+                        chosen, wait = self._next_ticket()
+                        if chosen is not None and chosen[1] == sequence:
+                            break
+                    remaining = deadline - self.clock()
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        raise SchedulerBusyError("No model call slot became free in time")
+                    self.condition.wait(remaining if wait is None else min(wait, remaining))
+            except BaseException:
+                self._remove_ticket(sequence)
+                self.condition.notify_all()
+                raise
+            # The priority it was admitted at (raised while queued, perhaps)
+            priority = self._remove_ticket(sequence)[0]
+            bucket = self._bucket(key)
+            if bucket is not None:
+                bucket.take()
+            self.running += 1
+            self.admitted[PRIORITY_NAMES[priority]] += 1
+            # Another slot may still be free for the next ticket
+            self.condition.notify_all()
+
+        metrics.observe(f"queue_wait_{PRIORITY_NAMES[priority]}", self.clock() - started)
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.running -= 1
+                self.condition.notify_all()
+
+    def stats(self):
+        with self.condition:
+            waiting = {name: 0 for name in PRIORITY_NAMES.values()}
+            for ticket in self.waiting:
+                waiting[PRIORITY_NAMES[ticket[0]]] += 1
+            return {
+                "running": self.running,
+                "max_concurrent": self.max_concurrent,
+                "waiting": waiting,
+                "max_waiting": self.max_waiting,
+                "admitted": dict(self.admitted),
+                "rejected": self.rejected,
+                "timeouts": self.timeouts
+            }
+
+    # Numeric stats for metrics export
+    def gauges(self):
+        stats = self.stats()
+        gauges = {name: value for name, value in stats.items() if isinstance(value, int)}
+        gauges["queue_depth"] = sum(stats["waiting"].values())
+        for name, value in stats["waiting"].items():
+            gauges[f"waiting_{name}"] = value
+        for name, value in stats["admitted"].items():
+            gauges[f"admitted_{name}"] = value
+        return gauges
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+# The process-wide scheduler, created on first use
+def get_scheduler(max_concurrent=8, rate_per_minute=0, burst=None, max_background=16):
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = Scheduler(max_concurrent, rate_per_minute, burst, max_background)
+            metrics.register_collector("scheduler", _scheduler.gauges)
+        return _scheduler
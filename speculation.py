@@ -0,0 +1,86 @@
+# Speculative pre-generation of story continuations.
+# While the player reads the current passage, the continuation for each
+# displayed choice is generated in the background so a click can usually be
+# answered immediately.
+#
+# This lives outside app.py because Streamlit re-executes the main script on
+# every rerun; imported modules (and the thread pool below) persist for the
+# lifetime of the server process and are shared by all sessions.
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from scheduler import BACKGROUND, INTERACTIVE, PriorityLevel
+
+# Threads shared by every session on this server
+MAX_WORKERS = 8
+
+# Most background continuations a single session may have running at once
+MAX_IN_FLIGHT_PER_SESSION = 3
+
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="tale-weaver-speculate")
+
+
+# Per-session set of speculative branches for one story position
+# scheduler, if given, is used to move a claimed branch's queued calls up to
+# INTERACTIVE, since the player is now waiting on them
+class SpeculativeBranches:
+    def __init__(self, max_in_flight=MAX_IN_FLIGHT_PER_SESSION, scheduler=None):
+        self.max_in_flight = max_in_flight
+        self.scheduler = scheduler
+        self.position = None
+        self.futures = {}
+        self.priorities = {}
+        self.lock = threading.Lock()
+
+    # Start background generation for each choice not already started.
+    # position identifies the story point (e.g. story id + turn); branches
+    # for any other position are cancelled first.
+    # generate(choice, priority) runs its model calls under the scheduler
+    # priority it is given (a PriorityLevel, BACKGROUND to begin with) and
+    # must not touch Streamlit session state.
+    def start(self, position, choices, generate):
+        with self.lock:
+            if position != self.position:
+                self._cancel_locked()
+                self.position = position
+            for choice in choices:
+                if choice in self.futures:
+                    continue
+                running = sum(1 for future in self.futures.values() if not future.done())
+                if running >= self.max_in_flight:
+                    break
+                priority = self.priorities[choice] = PriorityLevel(BACKGROUND)
+                self.futures[choice] = _executor.submit(generate, choice, priority)
+
+    # Claim the continuation for the chosen branch and cancel the others.
+    # Waits for a branch that is already running or done, since that is never
+    # slower than starting over, with its calls raised to INTERACTIVE; a
+    # branch still queued behind other work is cancelled instead. Returns
+    # None if the branch was not started yet or failed.
+    def take(self, position, choice, timeout=None):
+        with self.lock:
+            future = self.futures.pop(choice, None) if position == self.position else None
+            priority = self.priorities.pop(choice, None)
+            self._cancel_locked()
+        # cancel() only succeeds for a branch that hasn't started
+        if future is None or future.cancel():
+            return None
+        if self.scheduler is not None and priority is not None:
+            self.scheduler.raise_priority(priority, INTERACTIVE)
+        try:
+            return future.result(timeout=timeout)
+        except Exception:
+            return None
+
+    # Drop every branch. Branches that already started keep running until the
+    # API call returns, but their results are discarded.
+    def cancel(self):
+        with self.lock:
+            self._cancel_locked()
+
+    def _cancel_locked(self):
+        for future in self.futures.values():
+            future.cancel()
+        self.futures = {}
+        self.priorities = {}
+        self.position = None
@@ -0,0 +1,120 @@
+# Pool of pre-generated story starters for each genre.
+# Most players pick one of the fixed genres and leave the name blank, so sets
+# of starters are generated ahead of time in the background and handed out
+# instantly. The pool is topped back up after each request.
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import metrics
+
+# Removal policies for served starter sets:
+#   on_serve - a set is shown to one player only, then discarded
+#   on_pick  - a set is reused until a player begins one of its stories
+POLICIES = ("on_serve", "on_pick")
+
+
+class StarterPool:
+    # generate(genre) returns a list of starters and raises on failure;
+    # prerender(text), if given, is called for each pooled starter (e.g. to
+    # warm the narration cache)
+    def __init__(self, generate, genres, depth=2, policy="on_serve", prerender=None, workers=2):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown starter pool policy: {policy}")
+        self.generate = generate
+        self.genres = list(genres)
+        self.depth = depth
+        self.policy = policy
+        self.prerender = prerender
+        self.lock = threading.Lock()
+        self.sets = {genre: deque() for genre in self.genres}
+        self.pending = {genre: 0 for genre in self.genres}
+        self.served = 0
+        self.empty = 0
+        self.failures = 0
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tale-weaver-starters")
+
+    # Queue background generation until every genre is at full depth
+    def fill(self):
+        for genre in self.genres:
+            self.refill(genre)
+
+    def refill(self, genre):
+        with self.lock:
+            missing = self.depth - len(self.sets[genre]) - self.pending[genre]
+            self.pending[genre] += max(missing, 0)
+        for _ in range(max(missing, 0)):
+            self.executor.submit(self._generate_set, genre)
+
+    def _generate_set(self, genre):
+        try:
+            starters = self.generate(genre)
+            if self.prerender is not None:
+                for starter in starters:
+                    self.prerender(starter)
+        except Exception:
+            with self.lock:
+                self.pending[genre] -= 1
+                self.failures += 1
+            return
+        with self.lock:
+            self.pending[genre] -= 1
+            self.sets[genre].append(starters)
+
+    # A ready set of starters for the genre, or None if the pool is empty
+    # (the caller should then generate synchronously)
+    def take(self, genre):
+        if genre not in self.sets:
+            return None
+        with self.lock:
+            if not self.sets[genre]:
+                self.empty += 1
+                starters = None
+            elif self.policy == "on_serve":
+                starters = self.sets[genre].popleft()
+                self.served += 1
+            else:
+                # Rotate so players asking at the same time see different sets
+                starters = self.sets[genre][0]
+                self.sets[genre].rotate(-1)
+                self.served += 1
+        self.refill(genre)
+        return list(starters) if starters else None
+
+    # A player began a story with this starter; under on_pick its set is retired
+    def mark_used(self, genre, starter):
+        if self.policy != "on_pick" or genre not in self.sets:
+            return
+        with self.lock:
+            self.sets[genre] = deque(s for s in self.sets[genre] if starter not in s)
+        self.refill(genre)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "ready": {genre: len(sets) for genre, sets in self.sets.items()},
+                "pending": sum(self.pending.values()),
+                "served": self.served,
+                "empty": self.empty,
+                "failures": self.failures
+            }
+
+    # Numeric stats for metrics export
+    def gauges(self):
+        stats = self.stats()
+        return dict(stats, ready=sum(stats["ready"].values()))
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+# The process-wide pool, created and filled on first use
+def get_starter_pool(generate, genres, depth=2, policy="on_serve", prerender=None):
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = StarterPool(generate, genres, depth, policy, prerender)
+            metrics.register_collector("starter_pool", _pool.gauges)
+            _pool.fill()
+        return _pool
@@ -0,0 +1,138 @@
+# SQLite catalog of saved stories.
+# One row per story, updated whenever the story is saved, so the saved-story
+# list reads a few columns of metadata instead of opening every story file.
+#
+# Rebuild the catalog from the files already on disk with:
+#     python story_catalog.py rebuild [saved_stories_dir]
+import os
+import sqlite3
+import sys
+
+from passages import choice_count, passage_count
+from story_store import SAVED_STORIES_DIR, is_story_log, peek_story, story_saved_at
+
+CATALOG_FILENAME = "catalog.sqlite3"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS stories (
+    story_id TEXT PRIMARY KEY,
+    filename TEXT NOT NULL,
+    genre TEXT,
+    character_name TEXT,
+    stage TEXT,
+    choices INTEGER,
+    story_turns INTEGER,
+    word_count INTEGER,
+    dialog_word_count INTEGER,
+    passage_count INTEGER,
+    saved_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS stories_saved_at ON stories (saved_at DESC);
+"""
+
+COLUMNS = ["story_id", "filename", "genre", "character_name", "stage",
+           "choices", "story_turns", "word_count", "dialog_word_count",
+           "passage_count", "saved_at"]
+
+# Columns added after the first catalog release, with their SQL types
+ADDED_COLUMNS = {"dialog_word_count": "INTEGER", "passage_count": "INTEGER"}
+
+
+def catalog_path(directory=SAVED_STORIES_DIR):
+    return os.path.join(directory, CATALOG_FILENAME)
+
+# Open the catalog, creating the table on first use. A connection per call
+# keeps this safe to use from any Streamlit session thread.
+def connect(directory=SAVED_STORIES_DIR):
+    connection = sqlite3.connect(catalog_path(directory), timeout=10)
+    connection.executescript(SCHEMA)
+    existing = {row[1] for row in connection.execute("PRAGMA table_info(stories)")}
+    for column, column_type in ADDED_COLUMNS.items():
+        if column not in existing:
+            connection.execute(f"ALTER TABLE stories ADD COLUMN {column} {column_type}")
+    return connection
+
+# Catalog row for a story state saved to filename at saved_at (epoch seconds)
+def catalog_row(story_state, filename, saved_at):
+    return (
+        story_state.get("story_id", ""),
+        filename,
+        story_state.get("genre", ""),
+        story_state.get("character_name", ""),
+        story_state.get("stage", ""),
+        choice_count(story_state),
+        story_state.get("story_turns", 0),
+        story_state.get("word_count", 0),
+        story_state.get("dialog_word_count", 0),
+        passage_count(story_state),
+        saved_at
+    )
+
+UPSERT = f"""
+INSERT INTO stories ({', '.join(COLUMNS)}) VALUES ({', '.join('?' for _ in COLUMNS)})
+ON CONFLICT (story_id) DO UPDATE SET
+    {', '.join(f'{column} = excluded.{column}' for column in COLUMNS[1:])}
+WHERE excluded.saved_at >= stories.saved_at
+"""
+
+# Record (or refresh) a story after it has been saved
+def record_story(story_state, filename, saved_at, directory=SAVED_STORIES_DIR):
+    with connect(directory) as connection:
+        connection.execute(UPSERT, catalog_row(story_state, filename, saved_at))
+    connection.close()
+
+# One page of stories, newest first
+def list_stories(limit=10, offset=0, directory=SAVED_STORIES_DIR):
+    connection = connect(directory)
+    try:
+        rows = connection.execute(
+            f"SELECT {', '.join(COLUMNS)} FROM stories ORDER BY saved_at DESC LIMIT ? OFFSET ?",
+            (limit, offset)
+        ).fetchall()
+    finally:
+        connection.close()
+    return [dict(zip(COLUMNS, row)) for row in rows]
+
+def count_stories(directory=SAVED_STORIES_DIR):
+    connection = connect(directory)
+    try:
+        return connection.execute("SELECT COUNT(*) FROM stories").fetchone()[0]
+    finally:
+        connection.close()
+
+# Recreate the catalog from the story logs and legacy snapshots in a
+# directory, keeping the newest file of each story. Logs with a header are
+# not read. Returns the number of stories catalogued.
+def rebuild_catalog(directory=SAVED_STORIES_DIR):
+    latest = {}
+    for filename in os.listdir(directory):
+        if not (filename.endswith(".json") or is_story_log(filename)):
+            continue
+        file_path = os.path.join(directory, filename)
+        try:
+            story_data = peek_story(file_path)
+        except (OSError, ValueError, KeyError):
+            continue
+        saved_at = story_saved_at(file_path)
+        story_id = story_data.get("story_id", "")
+        if story_id not in latest or saved_at >= latest[story_id][2]:
+            latest[story_id] = (story_data, filename, saved_at)
+
+    with connect(directory) as connection:
+        connection.execute("DELETE FROM stories")
+        connection.executemany(UPSERT, [catalog_row(*entry) for entry in latest.values()])
+    connection.close()
+    return len(latest)
+
+# Build the catalog the first time the app runs against an existing folder
+def ensure_catalog(directory=SAVED_STORIES_DIR):
+    if not os.path.exists(catalog_path(directory)):
+        rebuild_catalog(directory)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "rebuild":
+        print("Usage: python story_catalog.py rebuild [saved_stories_dir]")
+        sys.exit(1)
+    target = sys.argv[2] if len(sys.argv) > 2 else SAVED_STORIES_DIR
+    print(f"Catalogued {rebuild_catalog(target)} stories in {catalog_path(target)}")
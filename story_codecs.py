@@ -0,0 +1,81 @@
+# Compression for story logs.
+# A compressed log is a series of independent frames (gzip members or zstd
+# frames), one per save, and a new frame starts at every page of passages, so
+# story_store can start reading at any page offset. Decompressing the whole
+# file gives the same JSON Lines as a plain log.
+#
+# zstd needs the optional zstandard package (pip install zstandard); gzip is
+# built in.
+import gzip
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Codec name -> log file extension. Plain logs come first so they win if a
+# conversion was interrupted with both files on disk.
+LOG_EXTENSIONS = {"none": ".jsonl", "gzip": ".jsonl.gz", "zstd": ".jsonl.zst"}
+
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+# Errors raised by a frame cut short by an interrupted write
+TRUNCATED_ERRORS = (EOFError, zlib.error) + ((zstandard.ZstdError,) if zstandard is not None else ())
+
+
+def available_codecs():
+    return [codec for codec in LOG_EXTENSIONS if codec != "zstd" or zstandard is not None]
+
+def check_codec(codec):
+    if codec not in LOG_EXTENSIONS:
+        raise ValueError(f"Unknown story compression: {codec}")
+    if codec == "zstd" and zstandard is None:
+        raise ValueError("zstd story compression needs the zstandard package (pip install zstandard)")
+    return codec
+
+# Codec of a log file from its name, or None if it isn't a story log
+def log_codec(path):
+    for codec, extension in LOG_EXTENSIONS.items():
+        if path.endswith(extension):
+            return codec
+    return None
+
+# One frame holding data (bytes)
+def encode_frame(codec, data):
+    if codec == "gzip":
+        return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return data
+
+def _decompressor(codec):
+    if codec == "gzip":
+        return zlib.decompressobj(wbits=31)
+    return zstandard.ZstdDecompressor().decompressobj()
+
+# Frames of a log of any codec as (byte offset, decompressed bytes), starting
+# at offset, which must be the start of a frame. Each line of a plain log is
+# its own frame. Stops quietly at a frame cut short by a crash.
+def read_frames(path, offset=0):
+    codec = check_codec(log_codec(path))
+    with open(path, "rb") as f:
+        f.seek(offset)
+        if codec == "none":
+            for line in f:
+                yield offset, line
+                offset += len(line)
+            return
+        data = f.read()
+    position = 0
+    while position < len(data):
+        decompressor = _decompressor(codec)
+        try:
+            frame = decompressor.decompress(data[position:])
+        except TRUNCATED_ERRORS:
+            return
+        if not decompressor.eof:
+            return
+        yield offset + position, frame
+        position = len(data) - len(decompressor.unused_data)
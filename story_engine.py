@@ -0,0 +1,348 @@
+# Story lifecycle steps that don't depend on Streamlit.
+# The model calls are passed in as functions so the same steps can run in the
+# app, in scripts and against stand-in generators.
+#
+# Generation steps take a backend (see backends.py; the shared GeminiClient is
+# one, FakeBackend a local stand-in). They raise when the backend fails; the
+# app turns errors into on-screen messages and fallback text.
+#
+# Run complete stories without the UI (content pre-generation, throughput tests):
+#     python story_engine.py run --stories 20 --workers 4 --policy random --seed 1
+#     python story_engine.py run --stories 50 --backend fake --latency 0.5
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from backends import BACKENDS, make_backend
+from passages import add_passage, ending_text
+from prompts import (
+    build_starters_prompt,
+    build_choices_prompt,
+    build_continue_prompt,
+    build_ending_prompt,
+    build_recap_prompt,
+    build_summary_prompt,
+    build_turn_prompt,
+)
+from recaps import has_current_recap, recap_key
+from resilience import RetryPolicy
+from story_codecs import LOG_EXTENSIONS
+from structured_output import (
+    STRING_LIST_SCHEMA,
+    TURN_SCHEMA,
+    SchemaError,
+    at_least,
+    field_at_least,
+    generate_structured,
+)
+from story_memory import SUMMARY_MAX_WORDS, new_story_memory, update_story_memory, build_story_context
+from text_cleaning import clean_story_text
+
+# Genres offered on the setup screen
+GENRE_OPTIONS = {
+    "Fantasy": "Magical worlds, mythical creatures, and heroic quests",
+    "Science Fiction": "Future technology, space exploration, and scientific possibilities",
+    "Mystery": "Puzzles, investigations, and secrets waiting to be uncovered",
+    "Adventure": "Exploration, discovery, and overcoming challenges",
+    "Horror": "Fear, suspense, and encounters with the unknown",
+    "Romance": "Relationships, emotional connections, and matters of the heart",
+    "Historical": "Stories set in the past, often based on real events or periods",
+    "Comedy": "Humor, wit, and light-hearted situations"
+}
+
+# Turns after which a story moves to its ending
+MAX_TURNS = 10
+
+# Text used when the model can't be reached
+GENERATION_FALLBACK = "Once upon a time, there was an error in the storytelling machine..."
+
+FALLBACK_STARTERS = [
+    "You find yourself standing at the edge of a mysterious forest with a map that seems to lead to a hidden treasure.",
+    "The spaceship's alarm blares as you wake up from cryosleep, the rest of the crew is missing.",
+    "The old mansion you just inherited contains a locked room that nobody has entered for over a century."
+]
+
+FALLBACK_CHOICES = [
+    "Continue forward cautiously.",
+    "Turn back and seek another path.",
+    "Call out to see if anyone responds."
+]
+
+
+# Fresh state for a new story
+def new_story_state(genre="", character_name="", stage="welcome"):
+    return {
+        "story_id": str(uuid.uuid4()),
+        "passages": [],      # Structured story text, see passages.py
+        "choices_made": [],
+        "genre": genre,
+        "character_name": character_name,
+        "stage": stage,      # welcome, setup, story, ending
+        "story_turns": 0,    # Track story progression
+        "word_count": 0,     # Running total of story words (no markup)
+        "dialog_word_count": 0,  # Running total of words inside quoted dialog
+        "saved_passage_count": 0,  # passages already written to the story log
+        "memory": new_story_memory()  # Rolling summary + recent passages for prompts
+    }
+
+# Three story starters for a genre, cleaned since the chosen one becomes the
+# story's first passage. fresh=True skips the response cache. Raises
+# structured_output.SchemaError if the model doesn't return three.
+def write_starters(backend, genre=None, character_name=None, fresh=False):
+    starters = generate_structured(backend, build_starters_prompt(genre, character_name), STRING_LIST_SCHEMA,
+                                   "starters", check=at_least(3), max_output_tokens=600, cache=not fresh)
+    starters = [clean_story_text(s) for s in starters]
+    return [s for s in starters if s]
+
+# num_choices choices for the next turn. Raises structured_output.SchemaError
+# if the model doesn't return that many.
+# story_context is the rolling memory text from build_story_context.
+def write_choices(backend, story_context, genre, character_name, num_choices=3):
+    prompt = build_choices_prompt(story_context, genre, character_name, num_choices)
+    return generate_structured(backend, prompt, STRING_LIST_SCHEMA, "choices",
+                               check=at_least(num_choices), max_output_tokens=400)
+
+def write_continuation(backend, story_context, chosen_action, genre, character_name):
+    prompt = build_continue_prompt(story_context, chosen_action, genre, character_name)
+    return clean_story_text(backend.generate(prompt, temperature=0.8, max_output_tokens=600, cache=False))
+
+# A whole turn in one call: the passage that follows chosen_action and the
+# num_choices choices after it, as (passage, choices). Sends the story context
+# once instead of twice. Raises structured_output.SchemaError if the reply is
+# unusable even after a re-ask.
+def write_turn(backend, story_context, chosen_action, genre, character_name, num_choices=3):
+    prompt = build_turn_prompt(story_context, chosen_action, genre, character_name, num_choices)
+    turn = generate_structured(backend, prompt, TURN_SCHEMA, "turn", check=field_at_least("paths", num_choices),
+                               temperature=0.8, max_output_tokens=1000, cache=False)
+    return clean_story_text(turn["passage"]), turn["paths"]
+
+def write_ending(backend, story_context, genre, character_name):
+    prompt = build_ending_prompt(story_context, genre, character_name)
+    return backend.generate(prompt, temperature=0.8, max_output_tokens=900, cache=False)
+
+# Fold a passage that left the recent window into the running summary.
+# Errors propagate so story_memory falls back to its extractive summary.
+def write_summary(backend, summary, passage):
+    prompt = build_summary_prompt(summary, passage, SUMMARY_MAX_WORDS)
+    return clean_story_text(backend.generate(prompt, temperature=0.3, max_output_tokens=400))
+
+# Recap of the story's choices. Reads only genre, character_name and
+# choices_made, so it can be given a snapshot of those (see recaps.py).
+def write_recap(backend, story_state):
+    if not story_state["choices_made"]:
+        return ""
+    prompt = build_recap_prompt(story_state["choices_made"], story_state["genre"], story_state["character_name"])
+    return backend.generate(prompt, temperature=0.7, max_output_tokens=300)
+
+# Append the ending and recap to a story exactly once.
+# write_ending(story_state) and write_recap(story_state) return text;
+# save(story_state) persists the result. Calling this again on a finalized
+# story does nothing, so Streamlit reruns of the ending screen cost no model
+# calls and no writes. A recap already stored for the same choices (see
+# recaps.py) is kept. Errors from either writer propagate and leave the
+# story unfinalized and unsaved, so the next call tries again (an ending
+# that was written is kept). Returns True if the story was finalized by this call.
+def finalize_story(story_state, write_ending, write_recap, save=None):
+    if story_state.get("finalized"):
+        return False
+
+    if not story_ending_text(story_state):
+        add_passage(story_state, "ending", write_ending(story_state))
+
+    if not has_current_recap(story_state):
+        story_state["recap"] = write_recap(story_state)
+        story_state["recap_key"] = recap_key(story_state)
+    story_state["stage"] = "ending"
+    story_state["finalized"] = True
+
+    if save is not None:
+        save(story_state)
+    return True
+
+# Text of the story's ending, if it has one
+def story_ending_text(story_state):
+    return ending_text(story_state.get("passages", []))
+
+
+# Choice policies for headless stories: choose(options, story_state) returns
+# one of the offered starters or choices
+
+def first_choice():
+    return lambda options, story_state: options[0]
+
+def random_choice(seed=None):
+    rng = random.Random(seed)
+    return lambda options, story_state: rng.choice(options)
+
+# Follow a script of option indexes (or literal actions), then take the first
+# option once the script runs out. The first entry picks the starter.
+def scripted_choice(script):
+    steps = iter(script)
+    def choose(options, story_state):
+        step = next(steps, 0)
+        if isinstance(step, int):
+            return options[step % len(options)]
+        return step
+    return choose
+
+CHOICE_POLICIES = ("first", "random", "scripted")
+
+def make_choice_policy(name, seed=None, script=None):
+    if name == "first":
+        return first_choice()
+    if name == "random":
+        return random_choice(seed)
+    if name == "scripted":
+        return scripted_choice(script or [])
+    raise ValueError(f"Unknown choice policy: {name}")
+
+
+# Play one story from starter to ending against a backend. save(story_state)
+# is called after every turn and once the story is finalized.
+# combined=True writes each passage and the choices after it in one call
+# (write_turn); False uses separate continuation and choices calls.
+def play_story(backend, genre, choose, character_name="", turns=MAX_TURNS, save=None, combined=True):
+    story_state = new_story_state(genre, character_name, stage="story")
+    summarize = lambda summary, passage: write_summary(backend, summary, passage)
+
+    starters = write_starters(backend, genre, character_name, fresh=True)
+    if not starters:
+        raise ValueError("Starter response contained no starters")
+    starter = choose(starters, story_state)
+    add_passage(story_state, "beginning", starter)
+    update_story_memory(story_state["memory"], starter)
+
+    choices = None
+    for turn in range(turns):
+        story_context = build_story_context(story_state["memory"])
+        if choices is None:
+            try:
+                choices = write_choices(backend, story_context, genre, character_name)
+            except SchemaError:
+                choices = list(FALLBACK_CHOICES)
+        chosen_action = choose(choices, story_state)
+        add_passage(story_state, "choice", chosen_action)
+        choices = None
+        # The last turn goes straight to the ending, so it needs no choices
+        if combined and turn < turns - 1:
+            try:
+                next_part, choices = write_turn(backend, story_context, chosen_action, genre, character_name)
+            except SchemaError:
+                next_part = write_continuation(backend, story_context, chosen_action, genre, character_name)
+        else:
+            next_part = write_continuation(backend, story_context, chosen_action, genre, character_name)
+        add_passage(story_state, "continuation", next_part)
+        update_story_memory(story_state["memory"], f"You chose: {chosen_action}\n\n{next_part}", summarize)
+        story_state["story_turns"] += 1
+        if save is not None:
+            save(story_state)
+
+    finalize_story(
+        story_state,
+        lambda state: write_ending(backend, build_story_context(state["memory"]), genre, character_name),
+        lambda state: write_recap(backend, state),
+        save
+    )
+    return story_state
+
+# Play count stories concurrently and save each one (log + catalog entry) in
+# directory. make_policy(index) returns the choice policy for story index.
+# Returns one result dict per story, in order.
+def run_stories(backend, count, genres, make_policy, workers=4, turns=MAX_TURNS, character_name="", directory=None,
+                combined=True, compression="none"):
+    # Imported here so the generation steps above don't pull in storage
+    from story_catalog import record_story
+    from story_store import SAVED_STORIES_DIR, save_story_log
+
+    directory = directory or SAVED_STORIES_DIR
+    os.makedirs(directory, exist_ok=True)
+    catalog_lock = threading.Lock()
+
+    def save(story_state):
+        filename = save_story_log(story_state, directory, compression)
+        with catalog_lock:
+            record_story(story_state, filename, time.time(), directory)
+
+    def run_one(index):
+        genre = genres[index % len(genres)]
+        started = time.monotonic()
+        try:
+            story_state = play_story(backend, genre, make_policy(index), character_name, turns, save, combined)
+        except Exception as e:
+            return {"index": index, "genre": genre, "error": str(e), "seconds": time.monotonic() - started}
+        return {
+            "index": index,
+            "genre": genre,
+            "story_id": story_state["story_id"],
+            "turns": story_state["story_turns"],
+            "word_count": story_state["word_count"],
+            "seconds": time.monotonic() - started
+        }
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tale-weaver-batch") as executor:
+        return list(executor.map(run_one, range(count)))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog="story_engine.py", description="Generate complete stories without the UI")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="play stories concurrently and save them")
+    run.add_argument("--stories", type=int, default=1, help="number of stories to generate")
+    run.add_argument("--workers", type=int, default=4, help="stories played at the same time")
+    run.add_argument("--turns", type=int, default=MAX_TURNS, help="choices per story before the ending")
+    run.add_argument("--genre", action="append", choices=list(GENRE_OPTIONS),
+                     help="genre to use (repeat to rotate; default: all genres)")
+    run.add_argument("--character-name", default="", help="protagonist name (default: second person)")
+    run.add_argument("--policy", choices=CHOICE_POLICIES, default="random")
+    run.add_argument("--script", default="", help="comma-separated option indexes for --policy scripted")
+    run.add_argument("--seed", type=int, default=None, help="seed for --policy random (story i uses seed + i)")
+    run.add_argument("--backend", choices=sorted(BACKENDS), default="gemini")
+    run.add_argument("--latency", type=float, default=0.0, help="fake backend: seconds per call")
+    run.add_argument("--failure-rate", type=float, default=0.0, help="fake backend: chance a call fails")
+    run.add_argument("--malformed-rate", type=float, default=0.0, help="fake backend: chance of a malformed response")
+    run.add_argument("--separate-calls", action="store_true",
+                     help="write each passage and its choices in two calls instead of one")
+    run.add_argument("--compression", choices=list(LOG_EXTENSIONS), default="none",
+                     help="compression for the saved story logs")
+    run.add_argument("--out", default=None, help="saved stories directory (default: saved_stories)")
+    args = parser.parse_args(argv)
+
+    script = [int(step) for step in args.script.split(",") if step.strip()]
+    def make_policy(index):
+        seed = None if args.seed is None else args.seed + index
+        return make_choice_policy(args.policy, seed, script)
+
+    backend = make_backend(
+        args.backend,
+        seed=args.seed or 0,
+        latency=args.latency,
+        failure_rate=args.failure_rate,
+        malformed_rate=args.malformed_rate,
+        retry_policy=RetryPolicy()
+    )
+    started = time.monotonic()
+    results = run_stories(backend, args.stories, args.genre or list(GENRE_OPTIONS), make_policy,
+                          args.workers, args.turns, args.character_name, args.out, not args.separate_calls,
+                          args.compression)
+    elapsed = time.monotonic() - started
+
+    finished = [result for result in results if "error" not in result]
+    for result in results:
+        if "error" in result:
+            print(f"story {result['index']} ({result['genre']}) failed: {result['error']}")
+    turns = sum(result["turns"] for result in finished)
+    print(f"{len(finished)}/{len(results)} stories in {elapsed:.1f}s "
+          f"({len(finished) / elapsed * 60:.1f} stories/min, {turns / elapsed:.2f} turns/s)")
+    if finished:
+        print(f"mean story time {sum(r['seconds'] for r in finished) / len(finished):.1f}s, "
+              f"mean length {sum(r['word_count'] for r in finished) / len(finished):.0f} words")
+    return 0 if len(finished) == len(results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,104 @@
+# Rolling story memory: a compact running summary plus the last few passages.
+# Prompts are built from this instead of the full story text, so their size
+# stays roughly constant no matter how many turns have been played.
+import re
+
+# Number of most recent passages sent to the model word for word
+RECENT_PASSAGES = 3
+
+# Upper bound on the running summary, in words
+SUMMARY_MAX_WORDS = 150
+
+TAG_PATTERN = re.compile(r'<[^>]*>')
+SENTENCE_PATTERN = re.compile(r'(?<=[.!?])\s+')
+
+
+# Create an empty memory for a new story
+def new_story_memory():
+    return {
+        "summary": "",
+        "recent": [],
+        "summarized_passages": 0
+    }
+
+# Trim text to at most max_words words
+def truncate_words(text, max_words):
+    words = text.split()
+    if len(words) <= max_words:
+        return text
+    return " ".join(words[:max_words]) + "..."
+
+# Cheap summary used when no summarizer is given or the summarizer fails:
+# keep the first sentence of each folded passage
+def extractive_summary(summary, passage):
+    sentences = SENTENCE_PATTERN.split(TAG_PATTERN.sub('', passage).strip())
+    first_sentence = sentences[0] if sentences else ""
+    combined = f"{summary} {first_sentence}".strip()
+    # Drop the oldest sentences first so the summary keeps the latest events
+    words = combined.split()
+    if len(words) > SUMMARY_MAX_WORDS:
+        combined = "..." + " ".join(words[-SUMMARY_MAX_WORDS:])
+    return combined
+
+# Fold a passage that dropped out of the recent window into the summary
+def fold_into_summary(summary, passage, summarize=None):
+    if summarize is not None:
+        try:
+            new_summary = summarize(summary, passage)
+        except Exception:
+            new_summary = None
+        if new_summary and new_summary.strip():
+            return truncate_words(new_summary.strip(), SUMMARY_MAX_WORDS)
+    return extractive_summary(summary, passage)
+
+# Record a new passage; the oldest passages beyond the window are summarized.
+# summarize(summary, passage) should return the updated summary text.
+def update_story_memory(memory, passage, summarize=None, recent_limit=RECENT_PASSAGES):
+    memory["recent"].append(passage)
+    while len(memory["recent"]) > recent_limit:
+        oldest = memory["recent"].pop(0)
+        memory["summary"] = fold_into_summary(memory["summary"], oldest, summarize)
+        memory["summarized_passages"] += 1
+    return memory
+
+# Swap in a summary written in the background for the fold that brought the
+# summarized passage count to folded. It is dropped if more passages have
+# been folded since, as it doesn't cover them. Returns True if it was used.
+def apply_background_summary(memory, folded, summary):
+    if memory["summarized_passages"] != folded or not summary or not summary.strip():
+        return False
+    memory["summary"] = truncate_words(summary.strip(), SUMMARY_MAX_WORDS)
+    return True
+
+# Text handed to prompt templates in place of the full story
+def build_story_context(memory):
+    parts = []
+    if memory["summary"]:
+        parts.append(f"Summary of earlier events: {memory['summary']}")
+    if memory["recent"]:
+        parts.append("Most recent events:\n\n" + "\n\n".join(memory["recent"]))
+    return "\n\n".join(parts)
+
+# Memory-sized passages from the story's passage records: the opening, then
+# each choice together with the passage it produced
+def memory_passages(passages):
+    grouped = []
+    choice = None
+    for passage in passages:
+        if passage["type"] == "beginning":
+            grouped.append(passage["text"])
+        elif passage["type"] == "choice":
+            choice = passage["text"]
+        elif passage["type"] == "continuation":
+            grouped.append(f"You chose: {choice}\n\n{passage['text']}" if choice else passage["text"])
+            choice = None
+    return grouped
+
+# Return the story's memory, rebuilding it for saves made before memory existed
+def ensure_story_memory(story_state, summarize=None):
+    if "memory" not in story_state:
+        memory = new_story_memory()
+        for passage in memory_passages(story_state.get("passages", [])):
+            update_story_memory(memory, passage, summarize)
+        story_state["memory"] = memory
+    return story_state["memory"]
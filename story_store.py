@@ -0,0 +1,615 @@
+# Append-only story persistence.
+# Each story is a JSON Lines log, saved_stories/{story_id}.jsonl. A save only
+# appends the passages added since the previous save plus one small state
+# record, so disk use grows linearly with story length. Loading replays the log.
+#
+# Next to the log, saved_stories/{story_id}.header holds the latest state
+# fields, stats and prompt summary, plus the byte offsets of the last page or
+# two of passages in the log. It stays the same size however long the story
+# gets and is rewritten (atomically) after each append. Listing reads only
+# headers, and resuming reads the header plus those pages; the recent
+# passages of the prompt memory are rebuilt from them. Older pages, their
+# offsets and the choices in them are read when the player scrolls back or
+# the ending needs them. A header that doesn't match its log (say, a crash
+# between the two writes) is ignored and the log is replayed instead.
+#
+# Logs can be compressed (see story_codecs.py): {story_id}.jsonl.gz or
+# .jsonl.zst hold the same records in frames, a new one per save and per
+# page. Once a page is full its frames are repacked into one, through a
+# {log}.repack side file that is finished on the next read if a save fails
+# part way. New stories use the compression passed to save_story_log; an
+# existing log keeps its own, and plain logs always load.
+#
+# Record types:
+#   {"type": "path", "entry": {"type": ..., "text": ...}}   one passage
+#   {"type": "state", "ts": ..., "fields": {...}, "memory": {...}}
+#   {"type": "snapshot", "ts": ..., "state": {...}}  full state (compacted legacy saves)
+#
+# Two sessions may continue the same saved story. A save holds a lock on the
+# log and checks that it is still the size this session last saw; if another
+# session appended since, this session's story is saved as a new story
+# instead of interleaving with the other one (see fork_story).
+#
+# Fold old {story_id}_{timestamp}.json snapshots into logs with:
+#     python story_store.py compact [saved_stories_dir]
+# Rewrite every log with another compression (none, gzip or zstd) with:
+#     python story_store.py convert gzip [saved_stories_dir]
+import json
+import os
+import re
+import sys
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: saves of one story are not locked against each other
+    fcntl = None
+
+from passages import (choice_count, hydrate_passage, migrate_legacy_state, passage_count, recount_story,
+                      stored_passage)
+from story_codecs import LOG_EXTENSIONS, check_codec, encode_frame, log_codec, read_frames
+from story_memory import memory_passages
+
+SAVED_STORIES_DIR = "saved_stories"
+LOG_EXTENSION = LOG_EXTENSIONS["none"]
+HEADER_EXTENSION = ".header"
+HEADER_VERSION = 2
+
+# Passages per page of the log; the header has the offset of each page
+PAGE_SIZE = 20
+
+# Passages loaded when a story is resumed (rounded out to whole pages)
+RESUME_PASSAGES = 10
+
+# Timestamp embedded in legacy snapshot names: {story_id}_{YYYYmmdd}_{HHMMSS}.json
+SNAPSHOT_TIMESTAMP_PATTERN = re.compile(r'_(\d{8})_(\d{6})\.json$')
+
+# Scalar story fields written with every save
+STATE_FIELDS = ["story_id", "genre", "character_name", "character_trait",
+                "stage", "story_turns", "word_count", "dialog_word_count",
+                "finalized", "recap", "recap_key"]
+
+
+def story_log_filename(story_id, compression="none"):
+    return f"{story_id}{LOG_EXTENSIONS[compression]}"
+
+def is_story_log(path):
+    return log_codec(path) is not None
+
+# Filename of a story's existing log (of any compression), or None
+def find_story_log(story_id, directory=SAVED_STORIES_DIR):
+    for compression in LOG_EXTENSIONS:
+        filename = story_log_filename(story_id, compression)
+        if os.path.exists(os.path.join(directory, filename)):
+            return filename
+    return None
+
+# Header file that belongs to a story log
+def header_path(log_path):
+    return log_path[:-len(LOG_EXTENSIONS[log_codec(log_path)])] + HEADER_EXTENSION
+
+# Small record of everything except the story text
+def state_record(story_state):
+    memory = story_state.get("memory") or {}
+    return {
+        "type": "state",
+        "ts": time.time(),
+        "fields": {field: story_state[field] for field in STATE_FIELDS if field in story_state},
+        # Recent passages are rebuilt from the path on load; only the summary is stored
+        "memory": {
+            "summary": memory.get("summary", ""),
+            "summarized_passages": memory.get("summarized_passages", 0)
+        }
+    }
+
+# First page read when a story of count passages is resumed
+def resume_page(count):
+    return max(count - RESUME_PASSAGES, 0) // PAGE_SIZE
+
+# Everything needed to list or resume a story without reading all of its log.
+# Only fixed-size metadata, so a save writes no more as the story grows.
+# body_size is the log's size once the save is written.
+def header_record(story_state, body_size):
+    memory = story_state.get("memory") or {}
+    count = passage_count(story_state)
+    page_offsets = story_state.get("page_offsets")
+    return {
+        "version": HEADER_VERSION,
+        "ts": time.time(),
+        "fields": {field: story_state[field] for field in STATE_FIELDS if field in story_state},
+        "memory": {
+            "summary": memory.get("summary", ""),
+            "summarized_passages": memory.get("summarized_passages", 0),
+            "recent_count": len(memory.get("recent") or [])
+        },
+        "passage_count": count,
+        "choice_count": choice_count(story_state),
+        "body_size": body_size,
+        # Offsets of the pages a resume reads, from resume_page(count) on.
+        # None when the log starts with a snapshot, whose passages can't be paged.
+        "page_offsets": page_offsets[resume_page(count):] if page_offsets is not None else None
+    }
+
+# Write a header so readers never see half of it
+def write_header(path, header):
+    temp_path = f"{path}.part"
+    with open(temp_path, "w") as f:
+        json.dump(header, f, separators=(",", ":"))
+    os.replace(temp_path, path)
+
+# Header for a story log, or None if there is none or it is out of date
+def read_story_header(log_path):
+    recover_repack(log_path)
+    try:
+        with open(header_path(log_path), "r") as f:
+            header = json.load(f)
+        body_size = os.path.getsize(log_path)
+    except (OSError, ValueError):
+        return None
+    if header.get("version") != HEADER_VERSION or header.get("body_size") != body_size:
+        return None
+    return header
+
+# Full state, used when the story did not come from a log (legacy snapshots)
+def snapshot_record(story_state):
+    skipped = ("saved_passage_count", "saved_body_size", "page_offsets", "passage_offset", "choice_offset")
+    state = {key: value for key, value in story_state.items() if key not in skipped}
+    if "passages" in state:
+        state["passages"] = [stored_passage(passage) for passage in state["passages"]]
+    return {"type": "snapshot", "ts": time.time(), "state": state}
+
+# One log line per record. json.dumps escapes non-ASCII, so a line's length
+# is its size in bytes.
+def record_lines(records):
+    return [json.dumps(record, separators=(",", ":")) + "\n" for record in records]
+
+def append_records(path, records):
+    with open(path, "a", newline="\n") as f:
+        f.write("".join(record_lines(records)))
+
+# Encode records for appending to a log at body_size. A new frame starts at
+# each passage that begins a page (first_passage_index is the index of the
+# first passage record); their offsets are appended to page_offsets unless
+# it is None. Returns the bytes to append.
+def encode_records(compression, records, first_passage_index=0, page_offsets=None, body_size=0):
+    frames = [[]]
+    page_starts = [False]
+    index = first_passage_index
+    for record, line in zip(records, record_lines(records)):
+        if record["type"] == "path":
+            if index % PAGE_SIZE == 0 and frames[-1]:
+                frames.append([])
+                page_starts.append(False)
+            if index % PAGE_SIZE == 0:
+                page_starts[-1] = True
+            index += 1
+        frames[-1].append(line)
+
+    data = b""
+    for lines_in_frame, page_start in zip(frames, page_starts):
+        if not lines_in_frame:
+            continue
+        if page_start and page_offsets is not None:
+            page_offsets.append(body_size + len(data))
+        data += encode_frame(compression, "".join(lines_in_frame).encode("ascii"))
+    return data
+
+# Exclusive lock on a story log (created if missing) for the length of a save
+@contextmanager
+def locked_log(path):
+    with open(path, "ab") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+# Turn a story whose log another session has appended to into a new story,
+# with all of its passages loaded and none of them saved yet
+def fork_story(story_state, directory=SAVED_STORIES_DIR):
+    load_all_passages(story_state, directory)
+    story_state["story_id"] = str(uuid.uuid4())
+    story_state["saved_passage_count"] = 0
+    story_state["page_offsets"] = []
+    story_state.pop("saved_body_size", None)
+
+# Append whatever changed since the last save, then refresh the header.
+# A story without a log yet gets one with the given compression. If another
+# session has appended to the log since this one last saved or loaded it,
+# the story is forked and saved under a new story_id instead.
+# Returns the log's filename.
+def save_story_log(story_state, directory=SAVED_STORIES_DIR, compression="none"):
+    filename = (find_story_log(story_state["story_id"], directory)
+                or story_log_filename(story_state["story_id"], check_codec(compression)))
+    path = os.path.join(directory, filename)
+    with locked_log(path):
+        _recover_repack_locked(path)
+        body_size = os.path.getsize(path)
+        expected_size = story_state.get("saved_body_size")
+        conflict = expected_size is not None and expected_size != body_size
+        if not conflict:
+            _append_story(story_state, path, body_size)
+    if conflict:
+        fork_story(story_state, directory)
+        return save_story_log(story_state, directory, log_codec(filename))
+    return filename
+
+def _append_story(story_state, path, body_size):
+    if "saved_passage_count" not in story_state:
+        # Loaded from a legacy snapshot: start the log with the whole state so
+        # replay resets anything an older log for this story contains
+        data = encode_records(log_codec(path), [snapshot_record(story_state)])
+        page_offsets = None
+    else:
+        saved = story_state["saved_passage_count"]
+        if "page_offsets" not in story_state:
+            story_state["page_offsets"] = [] if saved == 0 else None
+        # A copy, so the story's offsets only change once the write succeeds
+        page_offsets = story_state["page_offsets"]
+        page_offsets = list(page_offsets) if page_offsets is not None else None
+        unsaved = story_state["passages"][saved - story_state.get("passage_offset", 0):]
+        records = [{"type": "path", "entry": stored_passage(passage)} for passage in unsaved]
+        records.append(state_record(story_state))
+
+        starts_page = any(index % PAGE_SIZE == 0 for index in range(saved, saved + len(unsaved)))
+        if log_codec(path) != "none" and starts_page and page_offsets:
+            # The page before this one is complete: rewrite its small per-save
+            # frames as one, which compresses several times better
+            body_size = repack_last_page(path, story_state, page_offsets)
+        data = encode_records(log_codec(path), records, saved, page_offsets, body_size)
+
+    try:
+        with open(path, "ab") as f:
+            f.write(data)
+    except OSError:
+        # Don't leave a torn frame for the next save to append after
+        os.truncate(path, body_size)
+        raise
+    story_state["page_offsets"] = page_offsets
+    story_state["saved_passage_count"] = passage_count(story_state)
+    story_state["saved_body_size"] = body_size + len(data)
+    write_header(header_path(path), header_record(story_state, body_size + len(data)))
+
+# Rewrite the last page of a compressed log as one frame. Only that page is
+# rewritten, however long the story is. The new bytes go to a side file first
+# (fsynced) and only then over the end of the log, so a failed or interrupted
+# write can always be finished from the side file (see recover_repack); the
+# log then holds the same records as before. From then on the story's
+# saved_body_size is the repacked size, however the repack gets finished.
+# Returns the new log size.
+def repack_last_page(path, story_state, page_offsets):
+    page_start = page_offsets[-1]
+    page_records = [record for _, _, record in read_records(path, page_start)]
+    first_passage_index = (len(page_offsets) - 1) * PAGE_SIZE
+    data = encode_records(log_codec(path), page_records, first_passage_index)
+
+    side_path = repack_path(path)
+    try:
+        with open(side_path, "wb") as f:
+            f.write(json.dumps({"page_start": page_start, "size": len(data)}).encode("ascii") + b"\n")
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+    except OSError:
+        # The log is untouched; without a complete side file there is nothing to finish
+        if os.path.exists(side_path):
+            os.remove(side_path)
+        raise
+    story_state["saved_body_size"] = page_start + len(data)
+    write_repack(path, page_start, data)
+    return page_start + len(data)
+
+# Side file holding a repacked last page until it is written into the log
+def repack_path(log_path):
+    return f"{log_path}.repack"
+
+def write_repack(path, page_start, data):
+    with open(path, "r+b") as f:
+        f.truncate(page_start)
+        f.seek(page_start)
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.remove(repack_path(path))
+
+# Finish a repack that failed or was interrupted after its side file was
+# complete; a side file cut short is discarded, since the log wasn't touched
+# yet. Called before a log is read or appended to. Returns True if a repack
+# was finished.
+def recover_repack(path):
+    if not os.path.exists(repack_path(path)):
+        return False
+    # A save may be writing the side file right now; wait for it
+    with locked_log(path):
+        return _recover_repack_locked(path)
+
+def _recover_repack_locked(path):
+    side_path = repack_path(path)
+    try:
+        with open(side_path, "rb") as f:
+            line = f.readline()
+            data = f.read()
+    except OSError:
+        return False
+    try:
+        info = json.loads(line)
+    except ValueError:
+        info = None
+    if info is None or info.get("size") != len(data):
+        os.remove(side_path)
+        return False
+    write_repack(path, info["page_start"], data)
+    return True
+
+def empty_story_state():
+    return {
+        "story_id": "",
+        "passages": [],
+        "choices_made": [],
+        "genre": "",
+        "character_name": "",
+        "stage": "story",
+        "story_turns": 0,
+        "word_count": 0
+    }
+
+# Apply one log record to a story state
+def apply_record(story_state, record):
+    kind = record.get("type")
+    if kind == "snapshot":
+        story_state.clear()
+        story_state.update(empty_story_state())
+        story_state.update(record["state"])
+        migrate_legacy_state(story_state)
+    elif kind == "path":
+        passage = hydrate_passage(record["entry"])
+        story_state["passages"].append(passage)
+        if passage["type"] == "choice":
+            story_state["choices_made"].append(passage["text"])
+    elif kind == "state":
+        story_state.update(record["fields"])
+        story_state["memory"] = dict(record["memory"], recent=None)
+
+# Offset of every page of a paged log (see load_story_log for the others)
+def read_page_offsets(path):
+    page_offsets = []
+    count = 0
+    for frame_offset, _, record in read_records(path):
+        if record.get("type") == "path":
+            if count % PAGE_SIZE == 0:
+                page_offsets.append(frame_offset)
+            count += 1
+    return page_offsets
+
+# Records of a log as (offset of their frame, first record in the frame, record)
+def read_records(path, offset=0):
+    for frame_offset, frame in read_frames(path, offset):
+        for position, line in enumerate(frame.splitlines()):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A torn final line from an interrupted write
+                continue
+            yield frame_offset, position == 0, record
+
+# Rebuild a story state by replaying its log
+def load_story_log(path):
+    recover_repack(path)
+    story_state = empty_story_state()
+    page_offsets = []
+    for frame_offset, frame_start, record in read_records(path):
+        if record.get("type") == "snapshot":
+            page_offsets = None
+        elif record.get("type") == "path" and page_offsets is not None:
+            if len(story_state["passages"]) % PAGE_SIZE == 0:
+                # Pages can only be read from the start of a frame
+                page_offsets = page_offsets + [frame_offset] if frame_start else None
+        apply_record(story_state, record)
+    story_state["page_offsets"] = page_offsets
+
+    # Logs written before running totals were kept
+    if "dialog_word_count" not in story_state:
+        recount_story(story_state)
+
+    memory = story_state.get("memory")
+    if memory is not None and memory.get("recent") is None:
+        memory["recent"] = memory_passages(story_state["passages"])[memory["summarized_passages"]:]
+    story_state["saved_passage_count"] = len(story_state["passages"])
+    story_state["saved_body_size"] = os.path.getsize(path)
+    return story_state
+
+# At most limit passage records from a log, starting at a page offset
+def read_passages(path, offset, limit):
+    passages = []
+    if limit <= 0:
+        return passages
+    for _, _, record in read_records(path, offset):
+        if record.get("type") == "path":
+            passages.append(hydrate_passage(record["entry"]))
+            if len(passages) >= limit:
+                break
+    return passages
+
+# Story state for continuing a saved story: the header plus the last
+# RESUME_PASSAGES passages (from the start of their page). Older passages,
+# with their page offsets and choices, are read with load_earlier_passages.
+# Falls back to a full load for legacy files, stale headers and logs that
+# start with a snapshot.
+def resume_story(path):
+    header = read_story_header(path) if is_story_log(path) else None
+    if header is None or header["page_offsets"] is None:
+        return load_story(path)
+
+    story_state = empty_story_state()
+    story_state.update(header["fields"])
+    count = header["passage_count"]
+    first_page = resume_page(count)
+    # Offsets of earlier pages are found in the log when they are needed
+    story_state["page_offsets"] = [None] * first_page + header["page_offsets"]
+    if count:
+        story_state["passages"] = read_passages(path, header["page_offsets"][0],
+                                                count - first_page * PAGE_SIZE)
+    story_state["passage_offset"] = first_page * PAGE_SIZE
+    story_state["choices_made"] = [passage["text"] for passage in story_state["passages"]
+                                   if passage["type"] == "choice"]
+    story_state["choice_offset"] = header["choice_count"] - len(story_state["choices_made"])
+
+    # The recent passages are the last few of those just read
+    memory = header["memory"]
+    grouped = memory_passages(story_state["passages"])
+    story_state["memory"] = {
+        "summary": memory["summary"],
+        "recent": grouped[len(grouped) - memory["recent_count"]:] if memory["recent_count"] else [],
+        "summarized_passages": memory["summarized_passages"]
+    }
+    story_state["saved_passage_count"] = count
+    story_state["saved_body_size"] = header["body_size"]
+    return story_state
+
+# Story state with the header's fields and stats but no passages loaded
+# (enough to list the story), or the full story if it has no usable header
+def peek_story(path):
+    header = read_story_header(path) if is_story_log(path) else None
+    if header is None:
+        return load_story(path)
+    story_state = empty_story_state()
+    story_state.update(header["fields"])
+    story_state["passage_offset"] = header["passage_count"]
+    story_state["choice_offset"] = header["choice_count"]
+    return story_state
+
+# Read up to pages more pages of older passages into a resumed story.
+# Returns the number of passages added.
+def load_earlier_passages(story_state, pages=1, directory=SAVED_STORIES_DIR):
+    loaded_from = story_state.get("passage_offset", 0)
+    if not loaded_from:
+        return 0
+    path = os.path.join(directory, find_story_log(story_state["story_id"], directory))
+    first_page = max(loaded_from // PAGE_SIZE - pages, 0)
+    page_offsets = story_state["page_offsets"]
+    if page_offsets[first_page] is None:
+        # A resumed story knows only the offsets of the pages it read
+        known = page_offsets.count(None)
+        page_offsets = story_state["page_offsets"] = read_page_offsets(path)[:known] + page_offsets[known:]
+    earlier = read_passages(path, page_offsets[first_page], loaded_from - first_page * PAGE_SIZE)
+    earlier_choices = [passage["text"] for passage in earlier if passage["type"] == "choice"]
+    story_state["passages"][:0] = earlier
+    story_state["passage_offset"] = first_page * PAGE_SIZE
+    story_state["choices_made"][:0] = earlier_choices
+    story_state["choice_offset"] = story_state.get("choice_offset", 0) - len(earlier_choices)
+    return len(earlier)
+
+# Read the rest of a resumed story (to view or export all of it)
+def load_all_passages(story_state, directory=SAVED_STORIES_DIR):
+    pages = -(-story_state.get("passage_offset", 0) // PAGE_SIZE)
+    return load_earlier_passages(story_state, pages, directory)
+
+# When a story file was last saved: the timestamp in a legacy snapshot's
+# name, otherwise the file's mtime (a log's mtime is its last append)
+def story_saved_at(file_path):
+    match = SNAPSHOT_TIMESTAMP_PATTERN.search(os.path.basename(file_path))
+    if match:
+        try:
+            return datetime.strptime(match.group(1) + match.group(2), "%Y%m%d%H%M%S").timestamp()
+        except ValueError:
+            pass
+    return os.path.getmtime(file_path)
+
+# Load a saved story from a log or a legacy JSON snapshot
+def load_story(path):
+    if is_story_log(path):
+        return load_story_log(path)
+    with open(path, "r") as f:
+        return migrate_legacy_state(json.load(f))
+
+# Replace legacy snapshot files with one log per story (the newest snapshot
+# becomes the log's first record). Returns (stories compacted, files removed).
+def compact_snapshots(directory=SAVED_STORIES_DIR):
+    snapshots = {}
+    for filename in os.listdir(directory):
+        if not filename.endswith(".json"):
+            continue
+        file_path = os.path.join(directory, filename)
+        try:
+            with open(file_path, "r") as f:
+                story_data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        story_id = story_data.get("story_id")
+        if not story_id:
+            continue
+        snapshots.setdefault(story_id, []).append((story_saved_at(file_path), file_path, story_data))
+
+    compacted = removed = 0
+    for story_id, files in snapshots.items():
+        if find_story_log(story_id, directory) is None:
+            _, _, newest = max(files, key=lambda item: item[0])
+            append_records(os.path.join(directory, story_log_filename(story_id)), [snapshot_record(newest)])
+            compacted += 1
+        for _, file_path, _ in files:
+            os.remove(file_path)
+            removed += 1
+    return compacted, removed
+
+# Rewrite one story log with another compression, framed by page, with a
+# fresh header. The old log is removed once the new one is in place.
+# Returns the new filename.
+def convert_story_log(path, compression):
+    directory, filename = os.path.split(path)
+    story_state = load_story_log(path)
+    records = [record for _, _, record in read_records(path)]
+    new_filename = filename[:-len(LOG_EXTENSIONS[log_codec(filename)])] + LOG_EXTENSIONS[compression]
+    new_path = os.path.join(directory, new_filename)
+
+    page_offsets = [] if story_state["page_offsets"] is not None else None
+    data = encode_records(compression, records, 0, page_offsets)
+    temp_path = f"{new_path}.part"
+    with open(temp_path, "wb") as f:
+        f.write(data)
+    os.replace(temp_path, new_path)
+    story_state["page_offsets"] = page_offsets
+    write_header(header_path(new_path), header_record(story_state, len(data)))
+    if new_path != path:
+        os.remove(path)
+    return new_filename
+
+# Convert every story log in a directory to a compression. Run it while the
+# app is stopped. Returns (logs converted, bytes before, bytes after).
+def convert_logs(directory=SAVED_STORIES_DIR, compression="gzip"):
+    check_codec(compression)
+    converted = before = after = 0
+    for filename in sorted(os.listdir(directory)):
+        if log_codec(filename) in (None, compression):
+            continue
+        path = os.path.join(directory, filename)
+        before += os.path.getsize(path)
+        new_filename = convert_story_log(path, compression)
+        after += os.path.getsize(os.path.join(directory, new_filename))
+        converted += 1
+    return converted, before, after
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    if command == "compact":
+        target = sys.argv[2] if len(sys.argv) > 2 else SAVED_STORIES_DIR
+        compacted, removed = compact_snapshots(target)
+        message = f"Compacted {compacted} stories, removed {removed} snapshot files"
+    elif command == "convert" and len(sys.argv) > 2 and sys.argv[2] in LOG_EXTENSIONS:
+        target = sys.argv[3] if len(sys.argv) > 3 else SAVED_STORIES_DIR
+        converted, before, after = convert_logs(target, sys.argv[2])
+        message = f"Converted {converted} logs: {before} -> {after} bytes"
+    else:
+        print("Usage: python story_store.py compact [saved_stories_dir]")
+        print("       python story_store.py convert {none,gzip,zstd} [saved_stories_dir]")
+        sys.exit(1)
+
+    from story_catalog import rebuild_catalog
+    rebuild_catalog(target)
+    print(message)
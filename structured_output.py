@@ -0,0 +1,164 @@
+# Schema-constrained JSON responses.
+# List and record responses are requested in the model's JSON mode with a
+# response schema, parsed with a single json.loads and validated against the
+# same schema. Only when that fails is the model asked again, once, with the
+# validation error spelled out; a second failure raises so the caller can use
+# its fallback. Calls, re-asks and fallbacks are counted per kind.
+import json
+import re
+
+from metrics import metrics
+
+# Schemas in the subset of OpenAPI that Gemini's response_schema accepts
+STRING_LIST_SCHEMA = {"type": "ARRAY", "items": {"type": "STRING"}}
+
+# A whole turn: the next passage and the choices ("paths") that follow it.
+# Gemini writes properties in alphabetical order (the schema type in
+# google-generativeai 0.8.3 has no propertyOrdering), so the keys are named
+# for "passage" to sort first: it streams before the choices that follow it.
+TURN_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {"passage": {"type": "STRING"}, "paths": STRING_LIST_SCHEMA},
+    "required": ["passage", "paths"]
+}
+
+
+# The response did not match the schema (or the caller's extra checks)
+class SchemaError(ValueError):
+    pass
+
+
+# Check a parsed value against a schema; raises SchemaError naming the first
+# problem
+def validate(value, schema, path="response"):
+    kind = schema["type"]
+    if kind == "STRING":
+        if not isinstance(value, str) or not value.strip():
+            raise SchemaError(f"{path} must be a non-empty string")
+    elif kind == "ARRAY":
+        if not isinstance(value, list):
+            raise SchemaError(f"{path} must be a JSON array")
+        for i, item in enumerate(value):
+            validate(item, schema["items"], f"{path}[{i}]")
+    elif kind == "OBJECT":
+        if not isinstance(value, dict):
+            raise SchemaError(f"{path} must be a JSON object")
+        for name in schema.get("required", []):
+            if name not in value:
+                raise SchemaError(f"{path} is missing \"{name}\"")
+        for name, field_schema in schema.get("properties", {}).items():
+            if name in value:
+                validate(value[name], field_schema, f"{path}.{name}")
+    return value
+
+# Parse and validate a response in one pass. check(value), if given, adds
+# checks the schema can't express and returns the final value.
+def parse_response(text, schema, check=None):
+    try:
+        value = json.loads(text)
+    except ValueError as e:
+        raise SchemaError(f"response is not valid JSON ({e.msg})")
+    validate(value, schema)
+    return check(value) if check is not None else value
+
+# Prompt for the single re-ask after a response failed validation
+def build_reask_prompt(prompt, error):
+    return f"""{prompt}
+
+    Your previous reply could not be used: {error}.
+    Reply again with only the JSON, exactly as described above.
+    """
+
+# Generate a validated structured response for a prompt. kind labels the
+# metrics. Raises SchemaError if the re-ask fails too.
+def generate_structured(backend, prompt, schema, kind, check=None, **generate_options):
+    metrics.count("tale_weaver_structured_calls_total", kind=kind)
+    response = backend.generate(prompt, response_schema=schema, **generate_options)
+    try:
+        return parse_response(response, schema, check)
+    except SchemaError as error:
+        # Don't let the unusable reply be served from the response cache
+        forget = getattr(backend, "forget", None)
+        if forget is not None:
+            options = {name: value for name, value in generate_options.items() if name != "cache"}
+            forget(prompt, response_schema=schema, **options)
+        metrics.count("tale_weaver_structured_reasks_total", kind=kind)
+        metrics.log("structured_reask", kind=kind, error=str(error))
+        first_error = error
+
+    # Never answer the re-ask from the cache: the cached reply is the bad one
+    generate_options["cache"] = False
+    response = backend.generate(build_reask_prompt(prompt, first_error), response_schema=schema, **generate_options)
+    try:
+        return parse_response(response, schema, check)
+    except SchemaError as error:
+        metrics.count("tale_weaver_structured_fallbacks_total", kind=kind)
+        metrics.log("structured_fallback", kind=kind, error=str(error))
+        raise
+
+# check() for a list that must hold at least count items; extra items are dropped
+def at_least(count):
+    def check(items):
+        if len(items) < count:
+            raise SchemaError(f"expected {count} items, got {len(items)}")
+        return items[:count]
+    return check
+
+# check() for an object whose list field must hold at least count items
+def field_at_least(field, count):
+    check_items = at_least(count)
+    def check(value):
+        return dict(value, **{field: check_items(value[field])})
+    return check
+
+# Decoded text of a string field in a JSON object that may still be arriving.
+# Stops before an escape sequence that isn't complete yet.
+def partial_string_field(text, field):
+    match = re.search(r'"' + re.escape(field) + r'"\s*:\s*"', text)
+    if match is None:
+        return ""
+    end = match.end()
+    while end < len(text) and text[end] != '"':
+        if text[end] == "\\":
+            step = 6 if text[end + 1:end + 2] == "u" else 2
+            if end + step > len(text):
+                break
+            end += step
+        else:
+            end += 1
+    try:
+        return json.loads('"' + text[match.end():end] + '"', strict=False)
+    except ValueError:
+        return ""
+
+
+# A structured response read as a stream. Iterating yields the new text of
+# one string field as it arrives (for showing and narrating it); result()
+# parses and validates the whole response once the stream has ended.
+# Streams aren't re-asked: the caller has already shown the text.
+class StructuredStream:
+    def __init__(self, chunks, schema, kind, field):
+        self.chunks = chunks
+        self.schema = schema
+        self.kind = kind
+        self.field = field
+        self.text = ""
+        self.shown = ""
+        metrics.count("tale_weaver_structured_calls_total", kind=kind)
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            self.text += chunk
+            value = partial_string_field(self.text, self.field)
+            if len(value) > len(self.shown):
+                delta = value[len(self.shown):]
+                self.shown = value
+                yield delta
+
+    def result(self, check=None):
+        try:
+            return parse_response(self.text, self.schema, check)
+        except SchemaError as error:
+            metrics.count("tale_weaver_structured_fallbacks_total", kind=self.kind)
+            metrics.log("structured_fallback", kind=self.kind, error=str(error), streamed=True)
+            raise
@@ -0,0 +1,88 @@
+# Background summaries for the rolling story memory.
+# When a passage leaves the recent window it is folded into the summary with
+# the cheap extractive summary straight away, and a model-written summary of
+# the same fold is started here. A later rerun swaps it in if no other passage
+# was folded in the meantime, so a player's click never waits on it.
+#
+# Like recaps.py, this lives outside app.py so the worker threads and the
+# finished summaries survive Streamlit reruns.
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import metrics
+
+# Summaries kept for sessions that haven't rerun since they finished
+MAX_ENTRIES = 256
+
+
+# Key for the fold of a story that brought its summarized passage count to folded
+def summary_key(story_state, folded):
+    return (story_state["story_id"], folded)
+
+
+class SummaryWorker:
+    def __init__(self, workers=2, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.futures = OrderedDict()   # summary key -> future
+        self.started = 0
+        self.applied = 0
+        self.failures = 0
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tale-weaver-summaries")
+
+    # Start writing the summary for one fold. write(summary, passage) must not
+    # touch Streamlit session state. Returns the future for the summary.
+    def start(self, key, summary, passage, write):
+        with self.lock:
+            future = self.futures[key] = self.executor.submit(write, summary, passage)
+            self.futures.move_to_end(key)
+            self.started += 1
+            while len(self.futures) > self.max_entries:
+                self.futures.popitem(last=False)
+        return future
+
+    # The finished summary for a fold, or None if it is still being written,
+    # failed or was never started. A finished summary is handed out once.
+    def take(self, key):
+        with self.lock:
+            future = self.futures.get(key)
+            if future is None or not future.done():
+                return None
+            del self.futures[key]
+        try:
+            summary = future.result()
+        except Exception:
+            with self.lock:
+                self.failures += 1
+            return None
+        with self.lock:
+            self.applied += 1
+        return summary
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.futures),
+                "pending": sum(1 for future in self.futures.values() if not future.done()),
+                "started": self.started,
+                "applied": self.applied,
+                "failures": self.failures
+            }
+
+    def gauges(self):
+        return self.stats()
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+# The process-wide summary worker, created on first use
+def get_summary_worker():
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            _worker = SummaryWorker()
+            metrics.register_collector("summaries", _worker.gauges)
+        return _worker
@@ -0,0 +1,103 @@
+# finalize_story writes the ending and recap once, however often the ending
+# screen is rerun or the finished story is reopened.
+# Run from the repository root: python -m pytest tests
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from passages import add_passage
+from story_engine import finalize_story, new_story_state
+from story_store import load_story, resume_story, save_story_log
+
+RERUNS = 20
+
+
+class Writers:
+    def __init__(self, directory):
+        self.directory = directory
+        self.calls = {"ending": 0, "recap": 0, "writes": 0}
+        self.fail_recap = False
+
+    def write_ending(self, story_state):
+        self.calls["ending"] += 1
+        return "And so the journey ended."
+
+    def write_recap(self, story_state):
+        self.calls["recap"] += 1
+        if self.fail_recap:
+            raise TimeoutError("recap timed out")
+        return "A short recap."
+
+    def save(self, story_state):
+        self.calls["writes"] += 1
+        save_story_log(story_state, self.directory)
+
+    def finalize(self, story_state):
+        return finalize_story(story_state, self.write_ending, self.write_recap, self.save)
+
+
+def played_story():
+    story_state = new_story_state("Fantasy", stage="ending")
+    add_passage(story_state, "beginning", "It began.")
+    add_passage(story_state, "choice", "Take the stair")
+    add_passage(story_state, "continuation", "The stair wound down into the dark.")
+    story_state["story_turns"] = 1
+    return story_state
+
+
+def story_path(directory, story_state):
+    return os.path.join(directory, f"{story_state['story_id']}.jsonl")
+
+
+def ending_count(story_state):
+    return sum(1 for passage in story_state["passages"] if passage["type"] == "ending")
+
+
+def test_reruns_finalize_once(tmp_path):
+    writers = Writers(str(tmp_path))
+    story_state = played_story()
+
+    # Every Streamlit rerun of show_ending calls finalize_story again
+    results = [writers.finalize(story_state) for _ in range(RERUNS)]
+
+    assert results == [True] + [False] * (RERUNS - 1)
+    assert writers.calls == {"ending": 1, "recap": 1, "writes": 1}
+    assert ending_count(story_state) == 1
+
+
+@pytest.mark.parametrize("reload", [load_story, resume_story])
+def test_reloaded_story_is_not_finalized_again(tmp_path, reload):
+    writers = Writers(str(tmp_path))
+    story_state = played_story()
+    for _ in range(RERUNS):
+        writers.finalize(story_state)
+
+    reloaded = reload(story_path(str(tmp_path), story_state))
+    for _ in range(RERUNS):
+        assert not writers.finalize(reloaded)
+
+    assert writers.calls == {"ending": 1, "recap": 1, "writes": 1}
+    assert reloaded["finalized"]
+    assert reloaded["recap"] == "A short recap."
+    assert ending_count(load_story(story_path(str(tmp_path), story_state))) == 1
+
+
+def test_failed_recap_is_retried_not_saved(tmp_path):
+    writers = Writers(str(tmp_path))
+    story_state = played_story()
+    writers.fail_recap = True
+
+    with pytest.raises(TimeoutError):
+        writers.finalize(story_state)
+    assert not story_state.get("finalized")
+    assert "recap" not in story_state
+    assert writers.calls["writes"] == 0
+
+    # The next rerun writes only what is missing
+    writers.fail_recap = False
+    assert writers.finalize(story_state)
+    assert writers.calls == {"ending": 1, "recap": 2, "writes": 1}
+    assert ending_count(story_state) == 1
@@ -0,0 +1,59 @@
+# The SQLite response cache drops expired rows and keeps at most
+# max_disk_entries rows, however many responses are written.
+# Run from the repository root: python -m pytest tests
+import os
+import sqlite3
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from response_cache import PRUNE_EVERY, ResponseCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def disk_rows(path):
+    connection = sqlite3.connect(path)
+    try:
+        return connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+    finally:
+        connection.close()
+
+
+def test_disk_rows_are_capped(tmp_path):
+    path = str(tmp_path / "responses.sqlite")
+    cache = ResponseCache(max_entries=8, ttl=3600, path=path, clock=Clock(), max_disk_entries=50)
+
+    for number in range(PRUNE_EVERY * 3):
+        cache.clock.now += 1
+        cache.put(f"key-{number}", f"value-{number}")
+
+    assert disk_rows(path) == 50
+    # The newest rows are the ones kept
+    last = PRUNE_EVERY * 3 - 1
+    assert ResponseCache(ttl=3600, path=path, clock=cache.clock).get(f"key-{last}") == f"value-{last}"
+    assert cache.stats()["pruned"] == PRUNE_EVERY * 3 - 50
+
+
+def test_expired_rows_are_deleted(tmp_path):
+    path = str(tmp_path / "responses.sqlite")
+    clock = Clock()
+    cache = ResponseCache(ttl=60, path=path, clock=clock)
+    for number in range(10):
+        cache.put(f"old-{number}", "stale")
+
+    clock.now += 120
+    for number in range(PRUNE_EVERY - 10):
+        cache.put(f"new-{number}", "fresh")
+    assert disk_rows(path) == PRUNE_EVERY - 10
+
+    # Opening the cache prunes too
+    clock.now += 120
+    ResponseCache(ttl=60, path=path, clock=clock)
+    assert disk_rows(path) == 0
@@ -0,0 +1,141 @@
+# Story logs survive failed and interrupted saves, and their headers stay
+# the same size however long the story gets.
+# Run from the repository root: python -m pytest tests
+import errno
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import story_store
+from passages import add_passage, choice_count
+from story_engine import new_story_state
+from story_memory import update_story_memory
+from story_store import (PAGE_SIZE, header_path, load_all_passages, load_story, repack_path, resume_story,
+                         save_story_log, story_log_filename)
+
+
+def started_story():
+    story_state = new_story_state("Fantasy", stage="story")
+    add_passage(story_state, "beginning", "It began.")
+    return story_state
+
+
+def texts(story_state):
+    return [passage["text"] for passage in story_state["passages"]]
+
+
+# Save one passage at a time up to count passages
+def save_turns(story_state, directory, count):
+    while len(story_state["passages"]) < count:
+        add_passage(story_state, "continuation", f"Passage {len(story_state['passages'])} went on.")
+        save_story_log(story_state, directory, "gzip")
+
+
+def no_space(*args, **kwargs):
+    raise OSError(errno.ENOSPC, "No space left on device")
+
+
+def test_interrupted_repack_is_finished_on_load(tmp_path, monkeypatch):
+    directory = str(tmp_path)
+    story_state = started_story()
+    save_story_log(story_state, directory, "gzip")
+    save_turns(story_state, directory, PAGE_SIZE)
+
+    # The log is cut at the page start and the disk fills up part way through
+    def torn_write(path, page_start, data):
+        with open(path, "r+b") as f:
+            f.truncate(page_start)
+            f.seek(page_start)
+            f.write(data[:len(data) // 2])
+        no_space()
+
+    monkeypatch.setattr(story_store, "write_repack", torn_write)
+    add_passage(story_state, "continuation", "The page turned.")
+    with pytest.raises(OSError):
+        save_story_log(story_state, directory, "gzip")
+    monkeypatch.undo()
+
+    path = os.path.join(directory, f"{story_state['story_id']}.jsonl.gz")
+    assert texts(load_story(path)) == texts(story_state)[:PAGE_SIZE]
+    assert not os.path.exists(repack_path(path))
+
+    # The failed save is retried by the next one
+    save_story_log(story_state, directory, "gzip")
+    assert texts(load_story(path)) == texts(story_state)
+    assert texts(resume_story(path))[-1] == "The page turned."
+
+
+def test_failed_side_file_leaves_log_and_state_alone(tmp_path, monkeypatch):
+    directory = str(tmp_path)
+    story_state = started_story()
+    save_story_log(story_state, directory, "gzip")
+    save_turns(story_state, directory, PAGE_SIZE)
+    page_offsets = list(story_state["page_offsets"])
+
+    monkeypatch.setattr(story_store.os, "fsync", no_space)
+    add_passage(story_state, "continuation", "The page turned.")
+    with pytest.raises(OSError):
+        save_story_log(story_state, directory, "gzip")
+    monkeypatch.undo()
+
+    path = os.path.join(directory, f"{story_state['story_id']}.jsonl.gz")
+    assert story_state["page_offsets"] == page_offsets
+    assert story_state["saved_passage_count"] == PAGE_SIZE
+    assert not os.path.exists(repack_path(path))
+    assert texts(load_story(path)) == texts(story_state)[:PAGE_SIZE]
+
+    save_story_log(story_state, directory, "gzip")
+    assert texts(load_story(path)) == texts(story_state)
+
+
+@pytest.mark.parametrize("compression", ["none", "gzip"])
+def test_second_session_on_the_same_story_forks(tmp_path, compression):
+    directory = str(tmp_path)
+    story_state = started_story()
+    for index in range(1, PAGE_SIZE + 5):
+        add_passage(story_state, "continuation", f"Passage {index} went on.")
+    save_story_log(story_state, directory, compression)
+    path = os.path.join(directory, story_log_filename(story_state["story_id"], compression))
+
+    # Two sessions continue the same saved story
+    first = resume_story(path)
+    second = resume_story(path)
+    add_passage(first, "continuation", "The first player went left.")
+    save_story_log(first, directory)
+    add_passage(second, "continuation", "The second player went right.")
+    second_filename = save_story_log(second, directory)
+
+    assert second["story_id"] != story_state["story_id"]
+    assert texts(load_story(path)) == texts(story_state) + ["The first player went left."]
+    assert texts(load_story(os.path.join(directory, second_filename))) == (
+        texts(story_state) + ["The second player went right."])
+
+
+@pytest.mark.parametrize("compression", ["none", "gzip"])
+def test_header_size_does_not_grow_and_resume_rebuilds_the_rest(tmp_path, compression):
+    directory = str(tmp_path)
+    story_state = started_story()
+    update_story_memory(story_state["memory"], "It began.")
+    header_sizes = []
+    for turn in range(PAGE_SIZE * 3):
+        add_passage(story_state, "choice", f"Choice {turn}")
+        add_passage(story_state, "continuation", f"Passage {turn} went on.")
+        update_story_memory(story_state["memory"], f"You chose: Choice {turn}\n\nPassage {turn} went on.")
+        filename = save_story_log(story_state, directory, compression)
+        header_sizes.append(os.path.getsize(header_path(os.path.join(directory, filename))))
+    path = os.path.join(directory, filename)
+
+    # Only the bounded summary and a page offset or two change in size
+    assert max(header_sizes[PAGE_SIZE:]) - min(header_sizes[PAGE_SIZE:]) < 64
+    resumed = resume_story(path)
+    assert resumed["passage_offset"] > 0
+    assert choice_count(resumed) == PAGE_SIZE * 3
+    assert resumed["memory"] == story_state["memory"]
+
+    load_all_passages(resumed, directory)
+    assert texts(resumed) == texts(story_state)
+    assert resumed["choices_made"] == story_state["choices_made"]
+    assert resumed["page_offsets"] == load_story(path)["page_offsets"]
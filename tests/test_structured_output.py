@@ -0,0 +1,31 @@
+# Combined turn responses stream the passage before the choices.
+# Run from the repository root: python -m pytest tests
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backends import FakeBackend
+from prompts import build_turn_prompt
+from structured_output import TURN_SCHEMA, StructuredStream, field_at_least
+
+
+def test_passage_sorts_first():
+    # Gemini writes properties in alphabetical order
+    assert sorted(TURN_SCHEMA["properties"])[0] == "passage"
+
+
+def test_passage_streams_before_choices():
+    backend = FakeBackend(seed=3)
+    prompt = build_turn_prompt("It began.", "Take the stair", "Fantasy", "Ana")
+    stream = StructuredStream(backend.generate_stream(prompt, response_schema=TURN_SCHEMA),
+                              TURN_SCHEMA, "turn", "passage")
+
+    # By the time the choices start arriving the whole passage has been shown
+    shown_before_paths = None
+    for _ in stream:
+        if shown_before_paths is None and '"paths"' in stream.text:
+            shown_before_paths = stream.shown
+    turn = stream.result(field_at_least("paths", 3))
+    assert shown_before_paths == turn["passage"]
+    assert len(turn["paths"]) == 3
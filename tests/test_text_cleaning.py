@@ -0,0 +1,23 @@
+# clean_story_text removes embedded choices and prompts the way the original
+# regex cleaner did.
+# Run from the repository root: python -m pytest tests
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from text_cleaning import clean_story_text
+
+
+@pytest.mark.parametrize("text, cleaned", [
+    ("The door creaked.\n\n1. Open it.\n2. Run away.\nWhat happens next?", "The door creaked."),
+    ("Mara waited. Option A: go left Choice 2: stay", "Mara waited."),
+    ("It grew dark. • Hide • Fight", "It grew dark."),
+    # A marker cut short by the next number leaves one at a line start
+    ("12.1.\n.:x\n\n", ""),
+    ("2.•\n\n::\n", ""),
+])
+def test_clean_story_text(text, cleaned):
+    assert clean_story_text(text) == cleaned
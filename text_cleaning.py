@@ -0,0 +1,66 @@
+# Removal of choices and prompts the model sometimes embeds in story text.
+# Patterns are compiled once. Each "marker up to the next marker" removal is
+# done with two plain searches per block instead of a lazy DOTALL scan with a
+# lookahead at every character, so cleaning stays linear on long texts.
+import re
+
+# (start of a block to remove, start of whatever ends it)
+BLOCK_PATTERNS = [
+    # "Option A: ...", "Choice 2: ..." up to the next Option/Choice
+    (re.compile(r'(?:Option|Choice)\s+[A-Za-z0-9]+\s*:\s*'), re.compile(r'Option|Choice')),
+    # "1. ..." up to the next number
+    (re.compile(r'\d+\.\s+'), re.compile(r'\d+\.')),
+    # "• ..." up to the next bullet
+    (re.compile(r'•\s+'), re.compile(r'•')),
+]
+
+# Numbered list markers left at line starts, e.g. a marker whose block was
+# cut short by a following number ("12.1.\n" keeps "12.\n")
+LINE_NUMBER_PATTERN = re.compile(r'^\s*\d+\.\s+', re.MULTILINE)
+
+# "What will you do?" and similar closing questions, in one alternation
+PROMPTS_PATTERN = re.compile(
+    r'What will you do\?'
+    r'|What do you do next\?'
+    r'|What happens next\?'
+    r'|What choice will you make\?'
+    r'|Choose your next action.'
+    r'|What would you like to do\?'
+)
+
+
+# Remove every block that starts with start and runs up to (not including)
+# the next match of stop, or to the end of the text. Like the regex "$" the
+# original patterns ended on, the end is before a final newline.
+def remove_blocks(text, start, stop):
+    pieces = []
+    position = 0
+    while True:
+        block = start.search(text, position)
+        if block is None:
+            break
+        pieces.append(text[position:block.start()])
+        following = stop.search(text, block.end())
+        if following is None:
+            position = len(text) - 1 if text.endswith("\n") and block.end() < len(text) else len(text)
+            break
+        position = following.start()
+    if not pieces:
+        return text
+    pieces.append(text[position:])
+    return "".join(pieces)
+
+# Function to clean story text by removing embedded AI choices.
+# Run it once on each new passage; passages already in the story are clean.
+def clean_story_text(text):
+    cleaned_text = text
+    for start, stop in BLOCK_PATTERNS:
+        cleaned_text = remove_blocks(cleaned_text, start, stop)
+
+    # Remove numbered list markers at line starts
+    cleaned_text = LINE_NUMBER_PATTERN.sub('', cleaned_text)
+
+    # Remove any "What will you do?" or similar prompts
+    cleaned_text = PROMPTS_PATTERN.sub('', cleaned_text)
+
+    return cleaned_text.strip()
@@ -0,0 +1,184 @@
+# Background text-to-speech for story narration.
+# Passages are split into sentence chunks and synthesized by a shared worker
+# pool, so the story renders immediately. Chunks are stored in a
+# content-addressed audio cache; each run of the script plays the chunks
+# finished so far through st.audio, which serves them with an audio content
+# type (Streamlit's static file server sends .mp3 files as text/plain, which
+# some browsers refuse to play), and later chunks join the player on a later
+# rerun.
+import os
+import re
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from gtts import gTTS
+
+from audio_cache import AudioCache, audio_cache_key
+from metrics import metrics
+
+# Narration audio cache
+AUDIO_DIR = os.path.join("static", "audio")
+
+# Disk budget for cached narration
+AUDIO_CACHE_MAX_MB = int(os.getenv("AUDIO_CACHE_MAX_MB", "200"))
+
+# gTTS worker threads shared by every session on this server
+TTS_WORKERS = 4
+
+# Target size of each synthesized chunk; the first chunk is always a single
+# sentence so it is the most likely to be ready when the page is drawn
+CHUNK_CHARS = 400
+
+TAG_PATTERN = re.compile(r'<[^>]*>')
+SENTENCE_PATTERN = re.compile(r'(?<=[.!?])\s+|(?<=[.!?]["\')\]])\s+')
+
+_executor = ThreadPoolExecutor(max_workers=TTS_WORKERS, thread_name_prefix="tale-weaver-tts")
+audio_cache = AudioCache(AUDIO_DIR, AUDIO_CACHE_MAX_MB * 1024 * 1024)
+metrics.register_collector("audio_cache", audio_cache.stats)
+
+# Chunks currently being synthesized, so concurrent requests share one call
+_pending = {}
+_pending_lock = threading.Lock()
+
+
+# Remove HTML tags and collapse whitespace before synthesis
+def clean_tts_text(text):
+    return " ".join(TAG_PATTERN.sub('', text).split())
+
+# Split text into sentence-aligned chunks: the first sentence on its own, then
+# groups of sentences up to chunk_chars characters
+def split_into_chunks(text, chunk_chars=CHUNK_CHARS):
+    sentences = [s for s in SENTENCE_PATTERN.split(text) if s and s.strip()]
+    if not sentences:
+        return []
+    chunks = [sentences[0]]
+    current = ""
+    for sentence in sentences[1:]:
+        if current and len(current) + len(sentence) + 1 > chunk_chars:
+            chunks.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}".strip()
+    if current:
+        chunks.append(current)
+    return chunks
+
+# Synthesize one chunk into the audio cache
+def synthesize_chunk(key, text, lang='en', slow=False):
+    try:
+        with metrics.span("tts_synthesize", chars=len(text)):
+            return audio_cache.store(key, lambda path: gTTS(text=text, lang=lang, slow=slow).save(path))
+    finally:
+        with _pending_lock:
+            _pending.pop(key, None)
+
+# Future for a chunk's audio: already resolved on a cache hit, shared with
+# any in-flight synthesis of the same text, or newly queued
+def request_chunk(text, lang='en', slow=False):
+    key = audio_cache_key(text, lang, slow)
+    if audio_cache.lookup(key):
+        future = Future()
+        future.set_result(audio_cache.path(key))
+        return key, future
+    with _pending_lock:
+        future = _pending.get(key)
+        if future is None:
+            future = _executor.submit(synthesize_chunk, key, text, lang, slow)
+            _pending[key] = future
+    return key, future
+
+
+# Handle for one passage's narration, kept in session state
+class TTSJob:
+    def __init__(self, lang='en', slow=False):
+        self.lang = lang
+        self.slow = slow
+        self.chunks = []
+        self.keys = []
+        self.futures = []
+
+    # Queue synthesis of the next chunk of the passage
+    def add_chunk(self, text):
+        key, future = request_chunk(text, self.lang, self.slow)
+        self.chunks.append(text)
+        self.keys.append(key)
+        self.futures.append(future)
+
+    # MP3 data of the chunks synthesized so far, in order, stopping at the
+    # first chunk that failed or isn't ready; never waits. gTTS writes plain
+    # MP3 frames, so the chunks play back to back as one file.
+    def audio(self):
+        data = []
+        for future in self.futures:
+            if not future.done():
+                break
+            try:
+                with open(future.result(), "rb") as f:
+                    data.append(f.read())
+            except Exception:
+                # Failed, or evicted since
+                break
+        return b"".join(data)
+
+
+# Queue narration for a passage and return its job handle immediately
+def text_to_speech(text, lang='en', slow=False):
+    if not text:
+        return None
+
+    clean_text = clean_tts_text(text)
+    chunks = split_into_chunks(clean_text)
+    if not chunks:
+        return None
+
+    with metrics.span("tts_queue", chunks=len(chunks)):
+        job = TTSJob(lang, slow)
+        for chunk in chunks:
+            job.add_chunk(chunk)
+    return job
+
+
+# Narration for text that arrives in pieces (streamed generation). Sentences
+# are queued for synthesis as soon as they are complete, grouped the same way
+# as split_into_chunks. clean(sentence), if given, is applied to each sentence
+# before synthesis.
+class NarrationStream:
+    def __init__(self, lang='en', slow=False, clean=None, chunk_chars=CHUNK_CHARS):
+        self.job = TTSJob(lang, slow)
+        self.clean = clean
+        self.chunk_chars = chunk_chars
+        self.tail = ""
+        self.group = ""
+
+    def _add_sentence(self, sentence):
+        if self.clean is not None:
+            sentence = self.clean(sentence)
+        sentence = clean_tts_text(sentence)
+        if not sentence:
+            return
+        if not self.job.chunks and not self.group:
+            # First sentence on its own so it is ready soonest
+            self.job.add_chunk(sentence)
+        elif self.group and len(self.group) + len(sentence) + 1 > self.chunk_chars:
+            self.job.add_chunk(self.group)
+            self.group = sentence
+        else:
+            self.group = f"{self.group} {sentence}".strip()
+
+    # Add newly arrived text
+    def feed(self, text):
+        sentences = SENTENCE_PATTERN.split(self.tail + text)
+        # The last piece may be an unfinished sentence
+        self.tail = sentences.pop()
+        for sentence in sentences:
+            self._add_sentence(sentence)
+
+    # Queue whatever is left and return the job (None if nothing was spoken)
+    def finish(self):
+        if self.tail:
+            self._add_sentence(self.tail)
+            self.tail = ""
+        if self.group:
+            self.job.add_chunk(self.group)
+            self.group = ""
+        return self.job if self.job.chunks else None